@@ -0,0 +1,131 @@
+"""Bag-of-words corpus backed by CSR-style arrays, and vocabulary pruning.
+
+A corpus of lists of (term id, count) tuples, as built by doc2bow, takes a
+list and a tuple object for every document and distinct term. BowCorpus
+keeps the term ids and counts of all documents in two int32 arrays, with
+int64 offsets of each document's terms, and yields each document as a list
+of (term id, count) when iterated, so gensim models can train and infer on
+it like on the list corpus.
+"""
+from array import array
+import sys
+import numpy as np
+
+# defaults of the vocabulary pruning arguments, which keep all terms
+NO_BELOW = 1
+NO_ABOVE = 1.0
+
+
+def add_vocabulary_arguments(parser):
+    """Add --no_below, --no_above and --keep_n arguments to argument
+    parser.
+    """
+    parser.add_argument('--no_below', type=int, default=NO_BELOW,
+                        help='Drop terms occurring in fewer tweets than '
+                        'this from the dictionary. Defaults to 1 (keep '
+                        'all).')
+    parser.add_argument('--no_above', type=float, default=NO_ABOVE,
+                        help='Drop terms occurring in more than this '
+                        'fraction of tweets from the dictionary. Defaults '
+                        'to 1.0 (keep all).')
+    parser.add_argument('--keep_n', type=int,
+                        help='Keep only this many most frequent terms '
+                        '(after --no_below and --no_above) in the '
+                        'dictionary. Defaults to all.')
+
+
+def filter_vocabulary(dictionary, args):
+    """Prune terms of gensim dictionary with filter_extremes according to
+    command line arguments, if any threshold is set. Returns the number of
+    terms dropped.
+    """
+    if args.no_below == NO_BELOW and args.no_above == NO_ABOVE and \
+            args.keep_n is None:
+        return 0
+    num_terms = len(dictionary)
+    dictionary.filter_extremes(no_below=args.no_below,
+                               no_above=args.no_above, keep_n=args.keep_n)
+    return num_terms - len(dictionary)
+
+
+class BowCorpus:
+    """Bag-of-words corpus of documents stored as rows of CSR arrays."""
+
+    def __init__(self, indptr, indices, counts):
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+
+    @classmethod
+    def from_docs(cls, dictionary, docs):
+        """Return corpus of token lists converted with dictionary's
+        doc2bow, one document at a time.
+        """
+        indptr = array('q', [0])
+        indices = array('i')
+        counts = array('i')
+        for doc in docs:
+            bow = dictionary.doc2bow(doc)
+            if bow:
+                term_ids, term_counts = zip(*bow)
+                indices.extend(term_ids)
+                counts.extend(term_counts)
+            indptr.append(len(indices))
+        return cls(np.frombuffer(indptr, dtype=np.int64),
+                   np.frombuffer(indices, dtype=np.int32),
+                   np.frombuffer(counts, dtype=np.int32))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, i):
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return list(zip(self.indices[start:end].tolist(),
+                        self.counts[start:end].tolist()))
+
+    def __iter__(self):
+        indptr = self.indptr.tolist()
+        for start, end in zip(indptr, indptr[1:]):
+            yield list(zip(self.indices[start:end].tolist(),
+                           self.counts[start:end].tolist()))
+
+    @property
+    def num_nonzero(self):
+        """Number of (document, term) entries."""
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.counts.nbytes
+
+    def get_list_nbytes(self):
+        """Return estimated bytes of the same corpus as a list of lists of
+        (term id, count) tuples built by doc2bow. Term ids are shared with
+        the dictionary and small counts are cached by Python, so only the
+        lists and tuples are counted.
+        """
+        num_docs = len(self)
+        return (sys.getsizeof([None] * num_docs) +
+                num_docs * sys.getsizeof([]) +
+                self.num_nonzero * (8 + sys.getsizeof((0, 0))))
+
+    def save(self, file_path):
+        """Save corpus to .npz file."""
+        np.savez(file_path, indptr=self.indptr, indices=self.indices,
+                 counts=self.counts)
+
+    @classmethod
+    def load(cls, file_path):
+        """Load corpus saved with save."""
+        with np.load(file_path) as data:
+            return cls(data['indptr'], data['indices'], data['counts'])
+
+
+def format_memory_report(corpus):
+    """Return lines comparing memory of corpus with its list version."""
+    list_nbytes = corpus.get_list_nbytes()
+    return ['Corpus: %d documents, %d (document, term) entries'
+            % (len(corpus), corpus.num_nonzero),
+            '  arrays: %10.1f MB' % (corpus.nbytes / 2 ** 20),
+            '  lists:  %10.1f MB (estimated, %.1fx)'
+            % (list_nbytes / 2 ** 20, list_nbytes / max(corpus.nbytes, 1))]
@@ -0,0 +1,151 @@
+"""c_v topic coherence for many LDA models from shared co-occurrence
+statistics.
+
+gensim's CoherenceModel rescans the texts with a boolean sliding window for
+every model. The window counts of a word or word pair do not depend on the
+model, so CoherenceStatistics collects them once for the union of top words
+of all models, and c_v scores of each model are computed from those counts.
+The scores match CoherenceModel(coherence='c_v') with the same topn.
+"""
+from itertools import combinations
+from collections import Counter
+import numpy as np
+from gensim import matutils
+from gensim.topic_coherence.text_analysis import WindowedTextsAnalyzer
+
+# defaults of gensim's c_v coherence measure
+CV_WINDOW_SIZE = 110
+CV_TOPN = 20
+EPSILON = 1e-12
+
+# gensim < 4.0 skips texts without any of the top words when counting
+# windows
+_SKIPS_IRRELEVANT_TEXTS = hasattr(WindowedTextsAnalyzer, 'text_is_relevant')
+
+
+def get_topic_word_ids(ldamodel, topn=CV_TOPN):
+    """Return list of top topn word ids of each topic in ldamodel, as
+    selected by gensim's CoherenceModel.
+    """
+    return [[int(w) for w in matutils.argsort(topic, topn=topn, reverse=True)]
+            for topic in ldamodel.get_topics()]
+
+
+def _iter_window_words(indices, window_size):
+    """Yield sorted list of word indices (ignoring -1) in each sliding
+    window over indices, the whole list being one window if it is shorter
+    than window_size.
+
+    Like gensim, a sliding window drops the word leaving the window even if
+    it occurs again inside the window.
+    """
+    window_words = set(indices[:window_size])
+    window_words.discard(-1)
+    yield sorted(window_words)
+    for start in range(1, len(indices) - window_size + 1):
+        window_words.discard(indices[start - 1])
+        window_words.add(indices[start + window_size - 1])
+        window_words.discard(-1)
+        yield sorted(window_words)
+
+
+class CoherenceStatistics:
+    """Boolean sliding window counts of a set of words in tokenized texts.
+
+    For each window (the whole document if it is shorter than window_size)
+    the number of windows containing each word and each pair of words is
+    counted. The windows of documents containing at least one of the words
+    are also kept per document, since gensim normalizes by the number of
+    windows in documents containing any of the model's top words.
+    """
+
+    def __init__(self, tweet_docs, dictionary, word_ids,
+                 window_size=CV_WINDOW_SIZE):
+        word_ids = sorted(set(word_ids))
+        self.word_index = {w: i for i, w in enumerate(word_ids)}
+        token_index = {dictionary[w]: i for i, w in enumerate(word_ids)}
+
+        self.occurrences = np.zeros(len(word_ids), dtype=np.int64)
+        self.co_occurrences = Counter()
+
+        # number of windows in all documents (gensim >= 4.0 normalizes by
+        # this)
+        self.total_windows = 0
+        doc_windows = []
+        doc_word_indices = []
+        doc_indptr = [0]
+        for doc in tweet_docs:
+            num_windows = max(len(doc) - window_size + 1, 1)
+            self.total_windows += num_windows
+
+            indices = [token_index.get(token, -1) for token in doc]
+            doc_words = set(indices)
+            doc_words.discard(-1)
+            if not doc_words:
+                continue
+
+            for window in _iter_window_words(indices, window_size):
+                self.occurrences[window] += 1
+                self.co_occurrences.update(combinations(window, 2))
+
+            doc_windows.append(num_windows)
+            doc_word_indices.extend(sorted(doc_words))
+            doc_indptr.append(len(doc_word_indices))
+
+        self.doc_windows = np.array(doc_windows, dtype=np.int64)
+        self.doc_word_indices = np.array(doc_word_indices, dtype=np.int64)
+        self.doc_indptr = np.array(doc_indptr, dtype=np.int64)
+
+    def count_windows(self, word_indices):
+        """Return number of windows used to normalize counts of the words:
+        windows in documents containing any of the words (gensim < 4.0), or
+        windows in all documents.
+        """
+        if not _SKIPS_IRRELEVANT_TEXTS:
+            return self.total_windows
+        if len(self.doc_windows) == 0:
+            return 0
+        word_mask = np.zeros(len(self.occurrences), dtype=bool)
+        word_mask[word_indices] = True
+        doc_mask = np.logical_or.reduceat(word_mask[self.doc_word_indices],
+                                          self.doc_indptr[:-1])
+        return int(self.doc_windows[doc_mask].sum())
+
+    def npmi_matrix(self, word_indices, num_windows):
+        """Return matrix of normalized pointwise mutual information between
+        each pair of words.
+        """
+        n = len(word_indices)
+        counts = np.empty((n, n), dtype=np.float64)
+        for i in range(n):
+            counts[i, i] = self.occurrences[word_indices[i]]
+            for j in range(i + 1, n):
+                pair = tuple(sorted((word_indices[i], word_indices[j])))
+                counts[i, j] = counts[j, i] = self.co_occurrences[pair]
+
+        probs = np.diag(counts) / num_windows
+        co_probs = counts / num_windows
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_ratio = np.log((co_probs + EPSILON) /
+                               np.outer(probs, probs))
+            return log_ratio / -np.log(co_probs + EPSILON)
+
+    def get_coherence(self, topics):
+        """Return c_v coherence of topics (lists of dictionary word ids)."""
+        topics = [[self.word_index[w] for w in topic] for topic in topics]
+        num_windows = self.count_windows(
+            sorted(set(w for topic in topics for w in topic)))
+
+        topic_coherences = []
+        for topic in topics:
+            # context vector of each word against the topic, and of the
+            # whole topic (sum of word vectors)
+            context_vectors = self.npmi_matrix(topic, num_windows)
+            topic_vector = context_vectors.sum(axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sims = (context_vectors.dot(topic_vector) /
+                        (np.linalg.norm(context_vectors, axis=1) *
+                         np.linalg.norm(topic_vector)))
+            topic_coherences.append(np.mean(sims))
+
+        return float(np.mean(topic_coherences))
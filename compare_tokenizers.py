@@ -0,0 +1,230 @@
+"""Compare the fast rule-based tokenizer with spacy on a sample of tweets,
+and optionally build the fast tokenizer's lemma table from spacy lemmas.
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from itertools import islice
+import json
+import time
+from tweet_reader import iter_tweet_texts, list_json_files
+from tokenization import load_nlp, normalize_text
+from fast_tokenizer import FastTokenizer, load_lemma_table
+
+# number of most frequent mismatched tokens in the report
+NUM_TOP_MISMATCHES = 20
+
+# texts whose tokens are compared in addition to the sample: words with
+# digits, underscores and hyphens, numbers with units, and contractions
+TOKENIZER_CASES = [
+    'covid19 cases', 'mp3 files', 'foo_bar', 'h2o_2', 'abc123def',
+    '19covid', '2020s', "covid19's spread", 'covid-19 sars-cov-2',
+    '2020-21 season', '5-star e-mail', '5g 3pm 1.5mg 10%', '12:30 1,000',
+    "don't can't it's", "rock'n'roll o'neill", 'U.S. well-known',
+]
+
+
+def parse_arguments():
+    parser = ArgumentParser('Compare the fast tokenizer with spacy on a '
+                            'sample of tweets in JSON format, and optionally '
+                            'build the fast tokenizer\'s lemma table.')
+    parser.add_argument('--input_path', '-i', type=str,
+                        help='Path to input directory or file containing '
+                        'tweets in JSON format.')
+    parser.add_argument('--output_file_path', '-o', type=str,
+                        help='Path to output JSON file with parity report.')
+    parser.add_argument('--spacy_model', '-s', type=str,
+                        default='en_core_web_sm',
+                        help='Name of spacy model to use.')
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='Number of tweets per spacy batch. Defaults to '
+                        '1000.')
+    parser.add_argument('--sample_size', type=int, default=10000,
+                        help='Number of tweets to compare. Defaults to '
+                        '10000.')
+    parser.add_argument('--lemma_table_path', type=str,
+                        help='Path to lemma table of the fast tokenizer, '
+                        'compared on the whole sample. Defaults to a table '
+                        'built from the sample except its held-out tweets, '
+                        'which the tokenizers are compared on.')
+    parser.add_argument('--holdout_fraction', type=float, default=0.2,
+                        help='Fraction of the sample (its last tweets) held '
+                        'out from the lemma table built from the sample, '
+                        'and compared on. Defaults to 0.2.')
+    parser.add_argument('--output_lemma_table_path', type=str,
+                        help='Path to output JSON lemma table built from '
+                        'spacy lemmas of the sample tweets (except the '
+                        'held-out tweets, unless --lemma_table_path is '
+                        'given).')
+    return parser.parse_args()
+
+
+def iter_sample_texts(input_path, sample_size):
+    """Yield first sample_size tweet texts of JSON files in input path."""
+    tweet_texts = (tweet_text
+                   for input_file_path in sorted(list_json_files(input_path))
+                   for tweet_text in iter_tweet_texts(input_file_path))
+    return islice(tweet_texts, sample_size)
+
+
+def tokenize_spacy(nlp, tweet_texts, batch_size):
+    """Return (kept lower-cased tokens of each tweet, lemmas of each tweet,
+    counts of lemmas of each lower-cased token).
+    """
+    tweet_tokens, tweet_lemmas = [], []
+    lemma_counts = {}
+    texts = (normalize_text(tweet_text) for tweet_text in tweet_texts)
+    for doc in nlp.pipe(texts, batch_size=batch_size):
+        kept = [token for token in doc
+                if not token.is_stop and
+                not token.is_punct and
+                not token.is_space]
+        tweet_tokens.append([token.lower_ for token in kept])
+        tweet_lemmas.append([token.lemma_ for token in kept])
+        for token in kept:
+            lemma_counts.setdefault(token.lower_, Counter())[
+                token.lemma_] += 1
+    return tweet_tokens, tweet_lemmas, lemma_counts
+
+
+def get_fast_tokens(fast_tokenizer, tweet_texts):
+    """Return kept lower-cased tokens of each tweet of the fast
+    tokenizer.
+    """
+    tweet_tokens = []
+    for tweet_text in tweet_texts:
+        tokens = fast_tokenizer.tokenize(normalize_text(tweet_text))
+        tweet_tokens.append([t for t in tokens
+                             if fast_tokenizer.get_lemma(t) is not None])
+    return tweet_tokens
+
+
+def compare_cases(nlp, fast_tokenizer, texts):
+    """Return list of (text, spacy tokens, fast tokens) of texts the two
+    tokenizers split differently.
+    """
+    mismatches = []
+    for text in texts:
+        spacy_tokens = [token.text for token in nlp.make_doc(text)]
+        fast_tokens = fast_tokenizer.tokenize(text)
+        if spacy_tokens != fast_tokens:
+            mismatches.append((text, spacy_tokens, fast_tokens))
+    return mismatches
+
+
+def build_lemma_table(lemma_counts):
+    """Return table of most frequent lemma of each lower-cased token, for
+    tokens whose lemma is not the token itself.
+    """
+    lemma_table = {}
+    for lower, counts in lemma_counts.items():
+        lemma = counts.most_common(1)[0][0]
+        if lemma and lemma != lower:
+            lemma_table[lower] = lemma
+    return lemma_table
+
+
+def compare_docs(expected_docs, docs):
+    """Return parity statistics of token lists docs against
+    expected_docs.
+    """
+    num_equal = num_matched = num_expected = num_found = 0
+    missing, extra = Counter(), Counter()
+    for expected_doc, doc in zip(expected_docs, docs):
+        num_equal += expected_doc == doc
+        expected_counts, counts = Counter(expected_doc), Counter(doc)
+        num_matched += sum((expected_counts & counts).values())
+        num_expected += len(expected_doc)
+        num_found += len(doc)
+        missing.update(expected_counts - counts)
+        extra.update(counts - expected_counts)
+
+    precision = num_matched / num_found if num_found else 1.0
+    recall = num_matched / num_expected if num_expected else 1.0
+    return {
+        'exact_match_rate': num_equal / len(docs) if docs else 1.0,
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / (precision + recall)
+        if precision + recall else 0.0,
+        'spacy_only': missing.most_common(NUM_TOP_MISMATCHES),
+        'fast_only': extra.most_common(NUM_TOP_MISMATCHES),
+    }
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    tweet_texts = list(iter_sample_texts(args.input_path, args.sample_size))
+
+    # a lemma table built from the sample is scored on held-out tweets only,
+    # so that parity is not measured on the tweets it was built from
+    if args.lemma_table_path:
+        table_texts, test_texts = [], tweet_texts
+        print('Comparing tokenizers on %d tweets' % len(test_texts))
+    else:
+        num_test = int(round(len(tweet_texts) * args.holdout_fraction))
+        table_texts = tweet_texts[:len(tweet_texts) - num_test]
+        test_texts = tweet_texts[len(tweet_texts) - num_test:]
+        print('Comparing tokenizers on %d held-out tweets, with a lemma '
+              'table built from %d tweets'
+              % (len(test_texts), len(table_texts)))
+
+    nlp = load_nlp(args.spacy_model)
+    start_time = time.perf_counter()
+    _, _, table_lemma_counts = tokenize_spacy(nlp, table_texts,
+                                              args.batch_size)
+    spacy_tokens, spacy_lemmas, test_lemma_counts = tokenize_spacy(
+        nlp, test_texts, args.batch_size)
+    spacy_seconds = time.perf_counter() - start_time
+
+    if args.lemma_table_path:
+        lemma_table = load_lemma_table(args.lemma_table_path)
+        output_lemma_table = build_lemma_table(test_lemma_counts)
+    else:
+        lemma_table = output_lemma_table = build_lemma_table(
+            table_lemma_counts)
+    if args.output_lemma_table_path:
+        with open(args.output_lemma_table_path, 'w', encoding='utf-8') \
+                as file_writer:
+            json.dump(output_lemma_table, file_writer, ensure_ascii=False,
+                      sort_keys=True)
+
+    fast_tokenizer = FastTokenizer(lemma_table)
+    start_time = time.perf_counter()
+    fast_lemmas = list(fast_tokenizer.iter_lemmas(test_texts))
+    fast_seconds = time.perf_counter() - start_time
+    fast_tokens = get_fast_tokens(fast_tokenizer, test_texts)
+
+    spacy_tweets_per_sec = len(tweet_texts) / spacy_seconds \
+        if spacy_seconds else None
+    fast_tweets_per_sec = len(test_texts) / fast_seconds \
+        if fast_seconds else None
+    report = {
+        'num_tweets': len(test_texts),
+        'num_lemma_table_tweets': len(table_texts),
+        'spacy_model': args.spacy_model,
+        'lemma_table_size': len(lemma_table),
+        'spacy_tweets_per_sec': spacy_tweets_per_sec,
+        'fast_tweets_per_sec': fast_tweets_per_sec,
+        'speedup': fast_tweets_per_sec / spacy_tweets_per_sec
+        if fast_tweets_per_sec and spacy_tweets_per_sec else None,
+        'tokens': compare_docs(spacy_tokens, fast_tokens),
+        'lemmas': compare_docs(spacy_lemmas, fast_lemmas),
+        'case_mismatches': compare_cases(nlp, fast_tokenizer,
+                                         TOKENIZER_CASES),
+    }
+
+    print('Speedup: %.1fx' % (report['speedup'] or 0))
+    for name in ['tokens', 'lemmas']:
+        print('%s: exact match %.3f, precision %.3f, recall %.3f'
+              % (name.capitalize(), report[name]['exact_match_rate'],
+                 report[name]['precision'], report[name]['recall']))
+    print('Cases: %d of %d tokenized differently'
+          % (len(report['case_mismatches']), len(TOKENIZER_CASES)))
+    for text, spacy_tokens, fast_tokens in report['case_mismatches']:
+        print('  %r: spacy %s, fast %s' % (text, spacy_tokens, fast_tokens))
+
+    if args.output_file_path:
+        with open(args.output_file_path, 'w', encoding='utf-8') \
+                as file_writer:
+            json.dump(report, file_writer, indent=1, ensure_ascii=False)
@@ -0,0 +1,239 @@
+"""Columnar, memory-mapped store of tweets and their lemmas.
+
+A store is a directory of flat binary columns (one row per tweet) plus a
+meta.json file:
+
+    tweet_id.bin, created_at.bin, user_id.bin     int64 columns
+    text.bin, text_offsets.bin                    utf-8 text and row offsets
+    user_name.bin, user_name_offsets.bin          utf-8 screen names
+    lemma_ids.bin, lemma_offsets.bin              int32 lemma ids and offsets
+
+meta.json holds the number of rows, the lemma vocabulary, the tokenizer
+used for lemmas and the row range of each source file. Columns are opened
+with np.memmap, so reading a store does not load it into memory or parse
+any JSON tweets.
+"""
+from array import array
+import json
+import os
+import numpy as np
+from tweet_reader import get_tweet_text, parse_created_at
+
+META_FILE_NAME = 'meta.json'
+
+# index of rows by created_at written by time_index.py, and the fingerprint
+# of meta.json it was built for; deleted when the store is written again
+TIME_INDEX_FILE_NAME = 'created_at_order.npy'
+TIME_INDEX_META_FILE_NAME = 'created_at_order.json'
+
+# dtype of each column file
+COLUMN_DTYPES = {
+    'tweet_id': np.int64,
+    'created_at': np.int64,
+    'user_id': np.int64,
+    'text': np.uint8,
+    'text_offsets': np.int64,
+    'user_name': np.uint8,
+    'user_name_offsets': np.int64,
+    'lemma_ids': np.int32,
+    'lemma_offsets': np.int64,
+}
+
+# number of rows buffered before columns are appended to disk
+WRITE_CHUNK_SIZE = 10000
+
+
+class CorpusStoreWriter:
+    """Appends tweets and their lemmas to a new store."""
+
+    def __init__(self, store_dir_path, model_key=None):
+        if not os.path.isdir(store_dir_path):
+            os.makedirs(store_dir_path)
+        self.store_dir_path = store_dir_path
+        self.model_key = model_key
+
+        # indexes of the previous store are stale
+        for file_name in [TIME_INDEX_FILE_NAME, TIME_INDEX_META_FILE_NAME]:
+            file_path = os.path.join(store_dir_path, file_name)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+        self.lemma_ids = {}
+        self.lemmas = []
+        self.sources = []
+        self.num_rows = 0
+        self.text_size = 0
+        self.user_name_size = 0
+        self.num_lemmas = 0
+
+        self.files = {name: open(os.path.join(store_dir_path, name + '.bin'),
+                                 'wb')
+                      for name in COLUMN_DTYPES}
+        for name in ['text_offsets', 'user_name_offsets', 'lemma_offsets']:
+            self.files[name].write(np.zeros(1, dtype=np.int64).tobytes())
+        self._reset_buffers()
+
+    def _reset_buffers(self):
+        self.buffers = {'tweet_id': array('q'), 'created_at': array('q'),
+                        'user_id': array('q'), 'text': bytearray(),
+                        'text_offsets': array('q'),
+                        'user_name': bytearray(),
+                        'user_name_offsets': array('q'),
+                        'lemma_ids': array('i'), 'lemma_offsets': array('q')}
+
+    def add_source(self, source_name):
+        """Start rows of a new source (input file)."""
+        self.sources.append([source_name, self.num_rows, self.num_rows])
+
+    def add(self, tweet, tweet_lemmas):
+        """Append tweet (as parsed from JSON) and its lemma list."""
+        buffers = self.buffers
+        buffers['tweet_id'].append(int(tweet.get('id_str',
+                                                 tweet.get('id', -1))))
+        created_at = tweet.get('created_at')
+        buffers['created_at'].append(parse_created_at(created_at)
+                                     if created_at else -1)
+
+        user = tweet.get('user', {})
+        buffers['user_id'].append(int(user.get('id_str', user.get('id', -1))))
+        user_name = user.get('screen_name', '').encode('utf-8')
+        buffers['user_name'] += user_name
+        self.user_name_size += len(user_name)
+        buffers['user_name_offsets'].append(self.user_name_size)
+
+        text = get_tweet_text(tweet).encode('utf-8')
+        buffers['text'] += text
+        self.text_size += len(text)
+        buffers['text_offsets'].append(self.text_size)
+
+        for lemma in tweet_lemmas:
+            lemma_id = self.lemma_ids.get(lemma)
+            if lemma_id is None:
+                lemma_id = self.lemma_ids[lemma] = len(self.lemmas)
+                self.lemmas.append(lemma)
+            buffers['lemma_ids'].append(lemma_id)
+        self.num_lemmas += len(tweet_lemmas)
+        buffers['lemma_offsets'].append(self.num_lemmas)
+
+        self.num_rows += 1
+        if self.sources:
+            self.sources[-1][2] = self.num_rows
+        if len(buffers['tweet_id']) >= WRITE_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Append buffered rows to column files."""
+        for name, buffer in self.buffers.items():
+            self.files[name].write(bytes(buffer))
+        self._reset_buffers()
+
+    def close(self):
+        """Write remaining rows and meta data."""
+        self.flush()
+        for file_writer in self.files.values():
+            file_writer.close()
+
+        with open(os.path.join(self.store_dir_path, META_FILE_NAME), 'w',
+                  encoding='utf-8') as file_writer:
+            json.dump({'num_rows': self.num_rows,
+                       'model_key': self.model_key,
+                       'sources': self.sources,
+                       'lemmas': self.lemmas},
+                      file_writer, ensure_ascii=False)
+
+
+class CorpusStore:
+    """Read-only, memory-mapped view of a store."""
+
+    def __init__(self, store_dir_path):
+        with open(os.path.join(store_dir_path, META_FILE_NAME), 'r',
+                  encoding='utf-8') as file_reader:
+            meta = json.load(file_reader)
+        self.store_dir_path = store_dir_path
+        self.num_rows = meta['num_rows']
+        self.model_key = meta['model_key']
+        self.sources = [tuple(source) for source in meta['sources']]
+        self.lemmas = meta['lemmas']
+
+        self.columns = {}
+        for name, dtype in COLUMN_DTYPES.items():
+            column_path = os.path.join(store_dir_path, name + '.bin')
+            if os.path.getsize(column_path) == 0:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(column_path, dtype=dtype,
+                                               mode='r')
+
+    def __len__(self):
+        return self.num_rows
+
+    def check_model_key(self, spacy_model, tokenizer='spacy',
+                        lemma_table_path=None):
+        """Raise ValueError unless the store's lemmas were made by the
+        given tokenizer (spacy model spacy_model, or the fast tokenizer with
+        the lemma table at lemma_table_path).
+        """
+        from token_cache import get_tokenizer_key
+
+        requested = get_tokenizer_key(spacy_model, tokenizer,
+                                      lemma_table_path)
+        if requested != self.model_key:
+            raise ValueError('Corpus store %s has lemmas of %s, not of %s. '
+                             'Export the store again with the same '
+                             'tokenizer, or read the input directory '
+                             'instead.'
+                             % (self.store_dir_path, self.model_key,
+                                requested))
+
+    def _iter_strings(self, name, start, stop):
+        data = self.columns[name]
+        offsets = self.columns[name + '_offsets'][start:stop + 1].tolist()
+        for begin, end in zip(offsets, offsets[1:]):
+            yield data[begin:end].tobytes().decode('utf-8')
+
+    def iter_texts(self, start=0, stop=None):
+        """Yield tweet texts of rows start to stop."""
+        stop = self.num_rows if stop is None else stop
+        return self._iter_strings('text', start, stop)
+
+    def iter_user_names(self, start=0, stop=None):
+        """Yield user screen names of rows start to stop."""
+        stop = self.num_rows if stop is None else stop
+        return self._iter_strings('user_name', start, stop)
+
+    def iter_lemmas(self, start=0, stop=None):
+        """Yield lemma list of rows start to stop."""
+        stop = self.num_rows if stop is None else stop
+        lemma_ids = self.columns['lemma_ids']
+        offsets = self.columns['lemma_offsets'][start:stop + 1].tolist()
+        for begin, end in zip(offsets, offsets[1:]):
+            yield [self.lemmas[i] for i in lemma_ids[begin:end].tolist()]
+
+    def iter_texts_at(self, rows):
+        """Yield tweet texts of given rows."""
+        data = self.columns['text']
+        offsets = self.columns['text_offsets']
+        rows = np.asarray(rows, dtype=np.int64)
+        for begin, end in zip(offsets[rows].tolist(),
+                              offsets[rows + 1].tolist()):
+            yield data[begin:end].tobytes().decode('utf-8')
+
+    def iter_lemmas_at(self, rows):
+        """Yield lemma list of given rows."""
+        lemma_ids = self.columns['lemma_ids']
+        offsets = self.columns['lemma_offsets']
+        rows = np.asarray(rows, dtype=np.int64)
+        for begin, end in zip(offsets[rows].tolist(),
+                              offsets[rows + 1].tolist()):
+            yield [self.lemmas[i] for i in lemma_ids[begin:end].tolist()]
+
+    def iter_sources(self):
+        """Yield (source name, start row, stop row) of each source file."""
+        return iter(self.sources)
+
+    def get_source_rows(self, source_name):
+        """Return (start row, stop row) of source file."""
+        for name, start, stop in self.sources:
+            if name == source_name:
+                return start, stop
+        raise KeyError(source_name)
@@ -0,0 +1,171 @@
+"""Collapsing of duplicate tweet texts (retweets, copy-pasted text) before
+tokenization, so that each unique text is tokenized and scored once and
+its result weighted by the number of tweets it stands for.
+
+Exact duplicates are found by a hash of the text as passed to the
+tokenizer, so results are the same as without collapsing. Optionally,
+near-duplicates are found with MinHash signatures of word shingles and
+locality-sensitive hashing (LSH) over bands of the signatures; a
+near-duplicate tweet takes the result of the first similar text, so results
+are approximate.
+"""
+import hashlib
+import zlib
+import numpy as np
+
+DEDUP_MODES = ['none', 'exact', 'near']
+
+# number of words per shingle of near-duplicate detection
+SHINGLE_SIZE = 3
+
+# MinHash signature length, split into LSH bands of NUM_PERM / NUM_BANDS
+# values; texts sharing a band are compared by their whole signatures
+NUM_PERM = 128
+NUM_BANDS = 16
+
+
+def add_dedup_arguments(parser):
+    """Add --dedup and --near_duplicate_threshold arguments to argument
+    parser.
+    """
+    parser.add_argument('--dedup', type=str, choices=DEDUP_MODES,
+                        default='none',
+                        help='Collapse duplicate tweet texts before '
+                        'tokenization, and weight results of each unique '
+                        'text by its number of tweets: exact (same text; '
+                        'results are unchanged) or near (also texts with '
+                        'MinHash similarity of at least '
+                        '--near_duplicate_threshold; results are '
+                        'approximate). Defaults to none.')
+    parser.add_argument('--near_duplicate_threshold', type=float,
+                        default=0.8,
+                        help='Min estimated Jaccard similarity of word '
+                        'shingles of near-duplicate texts. Defaults to 0.8.')
+
+
+def get_shingles(text):
+    """Return set of hashes of word shingles of lower-cased text."""
+    words = text.lower().split()
+    size = min(SHINGLE_SIZE, len(words))
+    return {zlib.crc32(' '.join(words[i:i + size]).encode('utf-8'))
+            for i in range(len(words) - size + 1)}
+
+
+def get_text_key(text):
+    """Return hash of text, the key of exact duplicates."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class MinHasher:
+    """MinHash signatures of shingle sets, with multiply-shift hashes of
+    32-bit shingle hashes.
+    """
+
+    def __init__(self, num_perm=NUM_PERM, seed=0):
+        random_state = np.random.RandomState(seed)
+        self.a = random_state.randint(1, 1 << 62, num_perm,
+                                      dtype=np.uint64) | np.uint64(1)
+        self.b = random_state.randint(0, 1 << 62, num_perm,
+                                      dtype=np.uint64)
+
+    def get_signature(self, shingles):
+        """Return MinHash signature (uint32 array) of set of shingle
+        hashes.
+        """
+        x = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        with np.errstate(over='ignore'):
+            hashes = (np.outer(x, self.a) + self.b) >> np.uint64(32)
+        return hashes.min(axis=0).astype(np.uint32)
+
+
+class DuplicateCollapser:
+    """Maps tweet texts to unique texts and counts tweets of each.
+
+    Texts are compared after normalize (e.g. the normalization applied by
+    the tokenizer), but the first tweet text of each unique text is kept as
+    it was given.
+    """
+
+    def __init__(self, normalize=None, near_duplicate_threshold=None):
+        self.normalize = normalize
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.unique_texts = []
+        self.weights = []
+        # unique text id of each text hash
+        self._ids = {}
+
+        if near_duplicate_threshold is not None:
+            self.minhasher = MinHasher()
+            self.band_size = NUM_PERM // NUM_BANDS
+            self.signatures = {}
+            # unique text ids of each (band, band signature bytes)
+            self.buckets = {}
+
+    def add(self, tweet_text):
+        """Return id of unique text of tweet text, adding it if it is
+        new.
+        """
+        text = self.normalize(tweet_text) if self.normalize else tweet_text
+        key = get_text_key(text)
+        unique_id = self._ids.get(key)
+
+        if unique_id is None and self.near_duplicate_threshold is not None:
+            unique_id = self._add_near_duplicate(text)
+
+        if unique_id is None:
+            unique_id = len(self.unique_texts)
+            self.unique_texts.append(tweet_text)
+            self.weights.append(0)
+        self._ids[key] = unique_id
+        self.weights[unique_id] += 1
+        return unique_id
+
+    def get_id(self, tweet_text):
+        """Return id of unique text of a tweet text that was added."""
+        text = self.normalize(tweet_text) if self.normalize else tweet_text
+        return self._ids[get_text_key(text)]
+
+    def _add_near_duplicate(self, text):
+        """Return id of a unique text similar to text, or None after
+        adding text's signature to the LSH buckets as the next unique text.
+        """
+        shingles = get_shingles(text)
+        if not shingles:
+            return None
+        signature = self.minhasher.get_signature(shingles)
+        band_keys = [(band, signature[start:start + self.band_size]
+                      .tobytes())
+                     for band, start in enumerate(range(0, NUM_PERM,
+                                                        self.band_size))]
+
+        candidates = set()
+        for band_key in band_keys:
+            candidates.update(self.buckets.get(band_key, ()))
+        for unique_id in sorted(candidates):
+            similarity = np.mean(self.signatures[unique_id] == signature)
+            if similarity >= self.near_duplicate_threshold:
+                return unique_id
+
+        unique_id = len(self.unique_texts)
+        self.signatures[unique_id] = signature
+        for band_key in band_keys:
+            self.buckets.setdefault(band_key, []).append(unique_id)
+        return None
+
+
+def collapse_duplicates(tweet_texts, dedup='exact',
+                        near_duplicate_threshold=0.8, normalize=None,
+                        with_ids=True):
+    """Return (unique texts, their weights, unique text id of each tweet
+    text) of tweet texts, with near-duplicates also collapsed if dedup is
+    'near'. If not with_ids, the ids are not listed and None is returned
+    instead.
+    """
+    collapser = DuplicateCollapser(
+        normalize, near_duplicate_threshold if dedup == 'near' else None)
+    if not with_ids:
+        for tweet_text in tweet_texts:
+            collapser.add(tweet_text)
+        return collapser.unique_texts, collapser.weights, None
+    unique_ids = [collapser.add(tweet_text) for tweet_text in tweet_texts]
+    return collapser.unique_texts, collapser.weights, unique_ids
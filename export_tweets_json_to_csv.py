@@ -1,30 +1,147 @@
-"""Export tweets in JSON file to CSV.
+"""Export tweets in JSON file (or directory of JSON files) to CSV and/or to a
+columnar corpus store read by the analysis scripts.
 """
 from argparse import ArgumentParser
-import json
 import csv
+from itertools import tee
+import os
+from tweet_reader import iter_tweets, get_tweet_text, is_tweet_file
+from tokenization import tokenize_texts
+from token_cache import open_token_cache, get_tokenizer_key
+from fast_tokenizer import load_fast_tokenizer
+from corpus_store import CorpusStoreWriter
+from metrics import add_metrics_arguments, open_metrics
 
 
 def parse_arguments():
     parser = ArgumentParser('Export tweets in JSON file to CSV.')
     parser.add_argument('--input_file_path', '-i', type=str,
-                        help='Path to input JSON file containing tweets.')
+                        help='Path to input JSON file containing tweets, or '
+                        'directory of JSON files. '
+                        'Files may be line-delimited (.jsonl, .ndjson) and '
+                        'compressed (.gz, .bz2, .zst).')
     parser.add_argument('--output_file_path', '-o', type=str,
                         help='Path to output CSV file containing tweets.')
+    parser.add_argument('--output_store_path', type=str,
+                        help='Path to output corpus store directory with id, '
+                        'created_at, user, text and lemmas of each tweet.')
+    parser.add_argument('--spacy_model', '-s', type=str,
+                        default='en_core_web_sm',
+                        help='Name of spacy model to use for lemmas in the '
+                        'corpus store.')
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='Number of tweets per spacy batch. Defaults to '
+                        '1000.')
+    parser.add_argument('--n_process', type=int, default=1,
+                        help='Number of processes for spacy tokenization. '
+                        'Defaults to 1.')
+    parser.add_argument('--token_cache_path', type=str,
+                        help='Path to SQLite token cache file. Tweets found '
+                        'in the cache are not tokenized again.')
+    parser.add_argument('--tokenizer', type=str, choices=['spacy', 'fast'],
+                        default='spacy',
+                        help='Tokenizer for lemmas in the corpus store: spacy '
+                        '(model given by --spacy_model) or fast (rule-based, '
+                        'with spacy stopwords and the lemma table given by '
+                        '--lemma_table_path; the token cache is not used). '
+                        'Scripts reading the store must use the same '
+                        'tokenizer. Defaults to spacy.')
+    parser.add_argument('--lemma_table_path', type=str,
+                        help='Path to JSON lemma lookup table of the fast '
+                        'tokenizer (written by compare_tokenizers.py).')
+    add_metrics_arguments(parser)
     return parser.parse_args()
 
 
+def list_input_files(input_path):
+    """Return (source name, path) of JSON files in input directory and its
+    subdirectories, in sorted order, or of the input path itself if it is a
+    file. Source names are paths relative to the input directory (e.g.
+    week1/day1.json).
+    """
+    if not os.path.isdir(input_path):
+        return [(os.path.basename(input_path), input_path)]
+
+    input_files = []
+    for dir_path, dir_names, file_names in os.walk(input_path):
+        dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+        for file_name in file_names:
+            if is_tweet_file(file_name):
+                file_path = os.path.join(dir_path, file_name)
+                source_name = os.path.relpath(file_path, input_path)
+                input_files.append((source_name.replace(os.sep, '/'),
+                                    file_path))
+    return sorted(input_files)
+
+
+def iter_source_tweets(input_files, metrics):
+    """Yield (source name, tweet) for each tweet in input files."""
+    for source_name, input_file_path in input_files:
+        print('Processing file: %s' % input_file_path)
+        for tweet in metrics.iter_file(input_file_path,
+                                       iter_tweets(input_file_path)):
+            yield source_name, tweet
+
+
+def write_store(input_files, args, metrics):
+    """Tokenize tweets of input files and write them to the corpus store."""
+    token_cache = open_token_cache(args.token_cache_path, args.spacy_model)
+    writer = CorpusStoreWriter(args.output_store_path,
+                               get_tokenizer_key(args.spacy_model,
+                                                 args.tokenizer,
+                                                 args.lemma_table_path))
+
+    # tweets are read once; the copy for tokenization only runs ahead by
+    # the tokenizer's batch
+    source_tweets, tokenizer_tweets = tee(iter_source_tweets(input_files,
+                                                             metrics))
+    tweet_docs = tokenize_texts(args.spacy_model,
+                                (get_tweet_text(tweet)
+                                 for _, tweet in tokenizer_tweets),
+                                batch_size=args.batch_size,
+                                n_process=args.n_process,
+                                token_cache=token_cache,
+                                fast_tokenizer=load_fast_tokenizer(
+                                    args.lemma_table_path)
+                                if args.tokenizer == 'fast' else None)
+    tweet_docs = metrics.iter_counted(
+        metrics.iter_timed(tweet_docs, 'tokenization'), 'tweets_read',
+        'tokens_kept')
+
+    # add each input file as a source, even if it has no tweets
+    source_names = iter([source_name for source_name, _ in input_files])
+    current_source = None
+    for tweet_tokens, (source_name, tweet) in zip(tweet_docs, source_tweets):
+        while source_name != current_source:
+            current_source = next(source_names)
+            writer.add_source(current_source)
+        writer.add(tweet, tweet_tokens)
+    for source_name in source_names:
+        writer.add_source(source_name)
+    writer.close()
+
+
 if __name__ == '__main__':
     args = parse_arguments()
-    with open(args.input_file_path, 'r', encoding='utf-8') as file_reader:
-        data = json.load(file_reader)
-
-    with open(args.output_file_path, 'w', encoding='utf-8') as file_writer:
-        csv_writer = csv.DictWriter(file_writer, fieldnames=['tweet_text'])
-        csv_writer.writeheader()
-        
-        for tweet in data['results']:
-            if 'extended_tweet' in tweet:
-                csv_writer.writerow(tweet['extended_tweet']['full_text']))
-            else:
-                csv_writer.writerow(tweet['text'])
+    metrics = open_metrics(args)
+
+    input_files = list_input_files(args.input_file_path)
+
+    if args.output_file_path:
+        with metrics.stage('export_csv'), \
+                open(args.output_file_path, 'w', encoding='utf-8') \
+                as file_writer:
+            csv_writer = csv.DictWriter(file_writer,
+                                        fieldnames=['tweet_text'])
+            csv_writer.writeheader()
+
+            # stream tweets from json files
+            for _, input_file_path in input_files:
+                for tweet in iter_tweets(input_file_path):
+                    csv_writer.writerow({'tweet_text': get_tweet_text(tweet)})
+
+    if args.output_store_path:
+        with metrics.stage('export_store'):
+            write_store(input_files, args, metrics)
+
+    metrics.close()
@@ -0,0 +1,138 @@
+"""Rule-based tweet tokenizer, a fast alternative to spacy for lemmas and
+stopword, punctuation and space flags.
+
+Tokens are matched with a single compiled regular expression that keeps
+URLs, mentions, hashtags and emoji sequences whole, and otherwise splits
+like the spacy English tokenizer (contractions such as n't and 's,
+punctuation, hyphens). Stopwords are spacy's English stopword list, and
+lemmas are looked up in a table of lower-cased token -> lemma (built from
+spacy lemmas with compare_tokenizers.py); tokens missing from the table
+are their own lemma.
+"""
+import json
+import re
+import unicodedata
+from spacy.lang.char_classes import UNITS
+from spacy.lang.en.stop_words import STOP_WORDS
+
+# max number of cached token lemmas (URLs and mentions are mostly unique)
+LEMMA_CACHE_SIZE = 1000000
+
+# emoji characters; emoji sequences may have variation selectors, skin tone
+# modifiers and zero width joiners
+_EMOJI = r'[\U0001F300-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF]'
+_EMOJI_MODIFIERS = r'[\uFE0F\U0001F3FB-\U0001F3FF]*'
+
+# alternatives in order of precedence: whitespace, URLs, mentions and
+# hashtags, flags and other emoji sequences, abbreviations, numbers (alone,
+# or before a unit or am/pm, which spacy splits off), words before n't,
+# contraction suffixes, words (letters, digits and underscores, so covid19,
+# mp3 and foo_bar are single tokens as in spacy, and so is a word joined to
+# a number by a hyphen, such as covid-19), punctuation
+TOKEN_PATTERN = re.compile(r'''
+    (?P<space>\s+)
+  | (?:https?://|www\.)\S*[^\s.,!?:;\u2026'"()]
+  | [@\#]\w+
+  | [\U0001F1E6-\U0001F1FF]{2}
+  | %(emoji)s%(modifiers)s(?:\u200D%(emoji)s%(modifiers)s)*
+  | (?:[^\W\d_]\.){2,}
+  | \d+(?:[.,:/]\d+)*(?=(?:%(units)s|[ap]m)?(?!\w))
+  | \w+?(?=n['\u2019]t\b)
+  | n['\u2019]t\b
+  | ['\u2019](?:s|re|ve|ll|d|m)\b
+  | \w+(?:(?:['\u2019](?!(?:s|re|ve|ll|d|m)\b)|(?<!\d)-(?=\d))\w+)*
+  | \.{2,} | [^\w\s]
+''' % {'emoji': _EMOJI, 'modifiers': _EMOJI_MODIFIERS, 'units': UNITS},
+    re.VERBOSE | re.IGNORECASE)
+
+
+def load_lemma_table(lemma_table_path):
+    """Return lemma lookup table (dict) saved as JSON."""
+    with open(lemma_table_path, 'r', encoding='utf-8') as file_reader:
+        return json.load(file_reader)
+
+
+def is_punct(token):
+    """Return True if all characters of token are punctuation, as spacy's
+    is_punct.
+    """
+    return all(unicodedata.category(c).startswith('P') for c in token)
+
+
+class FastTokenizer:
+    """Tweet tokenizer with spacy's stopwords and a lemma lookup table."""
+
+    def __init__(self, lemma_table=None):
+        self.lemma_table = lemma_table or {}
+        # lemma (or None if dropped) of each lower-cased token seen
+        self._lemmas = {}
+
+    def tokenize(self, text):
+        """Return token texts of text. As in spacy, a single space after a
+        token is not a token, but other whitespace is.
+        """
+        tokens = []
+        for match in TOKEN_PATTERN.finditer(text):
+            token = match.group()
+            if match.lastgroup == 'space':
+                if token[0] == ' ':
+                    token = token[1:]
+                if not token:
+                    continue
+            tokens.append(token)
+        return tokens
+
+    def is_kept(self, token):
+        """Return True if token is not a stopword, punctuation or space."""
+        lower = token.lower()
+        return not (lower in STOP_WORDS or token.isspace() or
+                    is_punct(token))
+
+    def get_lemma(self, lower):
+        """Return lemma of lower-cased token, or None if it is a stopword,
+        punctuation or space.
+        """
+        try:
+            return self._lemmas[lower]
+        except KeyError:
+            lemma = self.lemma_table.get(lower, lower) \
+                if self.is_kept(lower) else None
+            if len(self._lemmas) >= LEMMA_CACHE_SIZE:
+                self._lemmas.clear()
+            self._lemmas[lower] = lemma
+            return lemma
+
+    def get_lemmas(self, tweet_text):
+        """Return lemmas of tokens of normalized (lower-cased and
+        stripped) tweet text that are not stopwords, punctuation or space,
+        as tokenization.get_lemmas.
+        """
+        lemmas = []
+        for token in self.tokenize(tweet_text.lower().strip()):
+            lemma = self.get_lemma(token)
+            if lemma is not None:
+                lemmas.append(lemma)
+        return lemmas
+
+    def iter_lemmas(self, tweet_texts):
+        """Yield lemma list of each tweet text."""
+        for tweet_text in tweet_texts:
+            yield self.get_lemmas(tweet_text)
+
+    def iter_tokens(self, tweet_texts):
+        """Yield (token texts, flags of tokens that are not stopwords,
+        punctuation or space) of each tweet text, for n-gram counting.
+        """
+        for tweet_text in tweet_texts:
+            tokens = self.tokenize(tweet_text)
+            yield tokens, [self.get_lemma(t.lower()) is not None
+                           for t in tokens]
+
+
+def load_fast_tokenizer(lemma_table_path=None):
+    """Return FastTokenizer with lemma table loaded from JSON file (if
+    given).
+    """
+    lemma_table = load_lemma_table(lemma_table_path) \
+        if lemma_table_path else None
+    return FastTokenizer(lemma_table)
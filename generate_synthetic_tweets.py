@@ -0,0 +1,152 @@
+"""Generate synthetic tweets in JSON format for benchmarks.
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import random
+
+# words tweets are made of, sampled with Zipf-like frequencies (stopwords
+# and protest vocabulary first, so they are the most frequent)
+WORDS = ('the to and of a in is for on that this with are be it not we at '
+         'they you by from was will have all but our has their who what '
+         'protest caa nrc police students delhi india citizenship law '
+         'university government protesters constitution against support '
+         'people country minister violence peace rally march shaheen bagh '
+         'jamia jnu amu assam modi shah bjp congress muslims refugees '
+         'detention rights democracy freedom unity secular vote court '
+         'supreme act bill parliament internet shutdown section 144 curfew '
+         'stand strong today tomorrow night morning city streets voice '
+         'fight justice women youth mothers children home family hope '
+         'fear anger love nation history future silence truth lies news '
+         'video photo watch read share join live update breaking').split()
+
+HASHTAGS = ['#caa', '#nrc', '#caa_nrc_protests', '#standwithjamia',
+            '#indiaagainstcaa', '#supportcaa', '#shaheenbagh', '#npr',
+            '#delhiprotests', '#hindumuslimunity']
+
+PUNCTUATION = ['.', ',', '!', '?', '...', ':']
+
+# max length of text of tweets that are not extended
+TEXT_LENGTH = 140
+
+CREATED_AT_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+
+
+def parse_arguments():
+    parser = ArgumentParser('Generate synthetic tweets in JSON format for '
+                            'benchmarks.')
+    parser.add_argument('--output_dir_path', '-o', type=str, required=True,
+                        help='Path to output directory for JSON files.')
+    parser.add_argument('--num_files', type=int, default=10,
+                        help='Number of JSON files. Defaults to 10.')
+    parser.add_argument('--tweets_per_file', type=int, default=10000,
+                        help='Number of tweets per file. Defaults to 10000.')
+    parser.add_argument('--extended_fraction', type=float, default=0.3,
+                        help='Fraction of tweets with an extended tweet '
+                        '(full text longer than 140 characters). Defaults '
+                        'to 0.3.')
+    parser.add_argument('--num_users', type=int, default=1000,
+                        help='Number of distinct users. Defaults to 1000.')
+    parser.add_argument('--start_date', type=str, default='2019-12-10',
+                        help='Date of the first file (one file per day). '
+                        'Defaults to 2019-12-10.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed. Defaults to 0.')
+    return parser.parse_args()
+
+
+class TweetGenerator:
+    """Generates random tweets with Zipf-like word frequencies."""
+
+    def __init__(self, extended_fraction=0.3, num_users=1000, seed=0):
+        self.extended_fraction = extended_fraction
+        self.num_users = num_users
+        self.random = random.Random(seed)
+        self.word_weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+        self.next_id = 1200000000000000000
+
+    def get_words(self, num_words):
+        rand = self.random
+        words = rand.choices(WORDS, weights=self.word_weights, k=num_words)
+        for i in range(num_words):
+            r = rand.random()
+            if r < 0.06:
+                words[i] = rand.choice(HASHTAGS)
+            elif r < 0.08:
+                words[i] = '@user%d' % rand.randrange(self.num_users)
+            elif r < 0.12:
+                words[i] += rand.choice(PUNCTUATION)
+        if rand.random() < 0.3:
+            words.append('https://t.co/%010x' % rand.getrandbits(40))
+        return words
+
+    def get_tweet(self, created_at):
+        """Return tweet dict created at datetime."""
+        rand = self.random
+        user_id = rand.randrange(self.num_users)
+        tweet = {
+            'created_at': created_at.strftime(CREATED_AT_FORMAT),
+            'id': self.next_id,
+            'id_str': str(self.next_id),
+            'user': {'id': user_id, 'id_str': str(user_id),
+                     'screen_name': 'user%d' % user_id},
+        }
+        self.next_id += 1
+
+        if rand.random() < self.extended_fraction:
+            full_text = ' '.join(self.get_words(rand.randint(30, 55)))
+            tweet['text'] = full_text[:TEXT_LENGTH - 24] + \
+                '… https://t.co/%010x' % rand.getrandbits(40)
+            tweet['truncated'] = True
+            tweet['extended_tweet'] = {'full_text': full_text}
+        else:
+            text = ' '.join(self.get_words(rand.randint(4, 22)))
+            tweet['text'] = text[:TEXT_LENGTH]
+            tweet['truncated'] = False
+        return tweet
+
+    def get_tweets(self, num_tweets, day):
+        """Return list of num_tweets tweets created on day (datetime), in
+        order of creation.
+        """
+        seconds = sorted(self.random.randrange(86400)
+                         for _ in range(num_tweets))
+        return [self.get_tweet(day + timedelta(seconds=s)) for s in seconds]
+
+
+def generate_tweet_files(output_dir_path, num_files, tweets_per_file,
+                         extended_fraction=0.3, num_users=1000,
+                         start_date='2019-12-10', seed=0):
+    """Write num_files JSON files (one per day) of tweets_per_file tweets
+    each to output directory. Returns paths of written files.
+    """
+    if not os.path.isdir(output_dir_path):
+        os.makedirs(output_dir_path)
+
+    generator = TweetGenerator(extended_fraction, num_users, seed)
+    start_day = datetime.strptime(start_date, '%Y-%m-%d') \
+        .replace(tzinfo=timezone.utc)
+
+    output_file_paths = []
+    for file_num in range(num_files):
+        day = start_day + timedelta(days=file_num)
+        output_file_path = os.path.join(output_dir_path,
+                                        day.strftime('%Y-%m-%d') + '.json')
+        with open(output_file_path, 'w', encoding='utf-8') as file_writer:
+            json.dump({'results': generator.get_tweets(tweets_per_file,
+                                                       day)},
+                      file_writer)
+        output_file_paths.append(output_file_path)
+    return output_file_paths
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    for output_file_path in generate_tweet_files(
+            args.output_dir_path, args.num_files, args.tweets_per_file,
+            extended_fraction=args.extended_fraction,
+            num_users=args.num_users, start_date=args.start_date,
+            seed=args.seed):
+        print('Wrote file: %s' % output_file_path)
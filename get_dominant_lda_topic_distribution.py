@@ -1,15 +1,28 @@
 """Get dominant LDA topic distribution for each JSON file in input directory
 with tweets.
 """
-import json
 import os
 import csv
-import spacy
+import time
 import gensim
+import numpy as np
 from gensim import corpora, models
 from gensim.models import CoherenceModel
 from gensim.models.ldamodel import LdaModel
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from tweet_reader import iter_tweet_texts, is_tweet_file
+from tokenization import tokenize_texts, normalize_text
+from fast_tokenizer import load_fast_tokenizer
+from token_cache import open_token_cache
+from topic_inference import count_dominant_topics, get_name_seed
+from corpus_store import CorpusStore
+from time_index import (TimeIndex, SlidingWindow, add_period_arguments,
+                        check_period_arguments, format_period)
+from dedup import add_dedup_arguments, collapse_duplicates
+from topic_client import TopicClient, add_server_arguments
+from manifest import Manifest, get_output_fingerprint, get_file_fingerprint
+from metrics import Metrics, add_metrics_arguments, open_metrics
 
 
 def parse_arguments():
@@ -17,93 +30,364 @@ def parse_arguments():
                             'JSON file in input directory with tweets.')
     parser.add_argument('--input_dir_path', '-i', type=str,
                         help='Path to input directory containing JSON files '
-                        'with tweets.')
+                        'with tweets. '
+                        'Files may be line-delimited (.jsonl, .ndjson) and '
+                        'compressed (.gz, .bz2, .zst).')
     parser.add_argument('--model_path', '-m', type=str,
                         help='Path to LDA trained model file.')
     parser.add_argument('--model_num_topics', '-t', type=int,
-                        help='Number of topics in trained LDA model.')
+                        help='Number of topics in trained LDA model. '
+                        'Defaults to that of the topic server with '
+                        '--server_url.')
     parser.add_argument('--output_file_path', '-o', type=str,
                         help='Path to output CSV file containing dominant '
                         'topic information.')
-    return parser.parse_args()
+    parser.add_argument('--dictionary_path', type=str,
+                        help='Path to dictionary saved by train_lda_topics.py '
+                        '(lda_dictionary.dict). Defaults to the dictionary '
+                        'stored in the LDA model.')
+    parser.add_argument('--spacy_model', '-s', type=str,
+                        default='en_core_web_sm',
+                        help='Name of spacy model to use.'
+                        )
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='Number of tweets per spacy batch. Defaults to '
+                        '1000.')
+    parser.add_argument('--n_process', type=int, default=1,
+                        help='Number of processes for spacy tokenization. '
+                        'Defaults to 1.')
+    parser.add_argument('--token_cache_path', type=str,
+                        help='Path to SQLite token cache file. Tweets found '
+                        'in the cache are not tokenized again.')
+    parser.add_argument('--tokenizer', type=str, choices=['spacy', 'fast'],
+                        default='spacy',
+                        help='Tokenizer for lemmas: spacy (model given by '
+                        '--spacy_model) or fast (rule-based, with spacy '
+                        'stopwords and the lemma table given by '
+                        '--lemma_table_path; the token cache is not used). '
+                        'Use the same tokenizer for training and '
+                        'prediction. Defaults to spacy.')
+    parser.add_argument('--lemma_table_path', type=str,
+                        help='Path to JSON lemma lookup table of the fast '
+                        'tokenizer (written by compare_tokenizers.py).')
+    parser.add_argument('--chunk_size', type=int, default=100000,
+                        help='Number of tweets scored per inference call. '
+                        'Defaults to 100000.')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of worker processes scoring files at '
+                        'the same time. Defaults to 1.')
+    parser.add_argument('--corpus_store_path', type=str,
+                        help='Path to corpus store written by '
+                        'export_tweets_json_to_csv.py. Lemmas of each source '
+                        'file are read from the store instead of the input '
+                        'directory; the store must be exported with the same '
+                        '--tokenizer and --spacy_model (or '
+                        '--lemma_table_path).')
+    parser.add_argument('--manifest_path', type=str,
+                        help='Path to manifest of JSON files already scored '
+                        'into the output file. Only new or changed files are '
+                        'scored, and their rows merged into the output. '
+                        'Defaults to the output file path with '
+                        '.manifest.json appended.')
+    parser.add_argument('--force', action='store_true',
+                        help='Score all files again, ignoring the manifest '
+                        'and existing output.')
+    add_period_arguments(parser)
+    add_dedup_arguments(parser)
+    add_server_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    check_period_arguments(parser, args)
+    return args
 
 
-if __name__ == '__main__':
-    args = parse_arguments()
+# model, dictionary, token cache and corpus store of this process (set by
+# init_worker)
+_worker_data = {}
 
-    if not os.path.isdir(args.input_dir_path):
-        print('Input path must be a directory.')
 
-    # load spacy nlp module
-    nlp = spacy.load('en_core_web_sm')
+def init_worker(args):
+    """Load LDA model and dictionary (or connect to the topic server), and
+    open token cache or corpus store, once per process.
+    """
+    corpus_store = CorpusStore(args.corpus_store_path) \
+        if args.corpus_store_path else None
+    if args.server_url:
+        _worker_data.update(args=args, client=TopicClient(args.server_url),
+                            corpus_store=corpus_store)
+        return
 
-    # load LDA model
     ldamodel = LdaModel.load(args.model_path)
 
-    with open(args.output_file_path, 'w', encoding='utf-8') as file_writer:
+    # load id <-> term dictionary used to train the model
+    if args.dictionary_path:
+        dictionary = corpora.Dictionary.load(args.dictionary_path)
+    else:
+        dictionary = ldamodel.id2word
 
-        csv_writer = csv.DictWriter(file_writer,
-                                    fieldnames=['filename'] +
-                                    ['topic_' + str(t)
-                                     for t in range(args.model_num_topics)])
-        csv_writer.writeheader()
+    # open token cache (if any); spacy model is loaded only for tweets
+    # missing from the cache
+    token_cache = open_token_cache(args.token_cache_path, args.spacy_model)
+    fast_tokenizer = load_fast_tokenizer(args.lemma_table_path) \
+        if args.tokenizer == 'fast' else None
 
-        # iterate over each subdir in input_subdir_paths
-        for input_file_name in os.listdir(args.input_dir_path):
+    _worker_data.update(args=args, ldamodel=ldamodel, dictionary=dictionary,
+                        token_cache=token_cache,
+                        fast_tokenizer=fast_tokenizer,
+                        corpus_store=corpus_store, client=None)
 
-            # only read JSON files
-            if not input_file_name.endswith('.json'):
-                continue
 
-            print('Processing file: %s' % input_file_name)
+def score_file(input_file_path, rows=None):
+    """Return (dominant topic counts, number of tweets, seconds taken, stage
+    timings, counters) for tweets in JSON file (or source file of the corpus
+    store, or the given rows of the corpus store).
+    """
+    args = _worker_data['args']
+    corpus_store = _worker_data['corpus_store']
+    file_metrics = Metrics()
+    start_time = time.time()
+
+    if _worker_data['client'] is not None:
+        dominant_topic_dist = score_file_with_server(input_file_path,
+                                                     file_metrics, rows)
+        return (dominant_topic_dist.tolist(), int(dominant_topic_dist.sum()),
+                time.time() - start_time, file_metrics.stages,
+                file_metrics.counters)
+
+    dictionary = _worker_data['dictionary']
+    weights = None
+    if corpus_store is not None:
+        # lemmas of the source file's rows in the corpus store
+        if rows is None:
+            tweet_docs = corpus_store.iter_lemmas(
+                *corpus_store.get_source_rows(input_file_path))
+        else:
+            tweet_docs = corpus_store.iter_lemmas_at(rows)
+        if args.dedup != 'none':
+            # collapse tweets with the same lemmas
+            tweet_docs, weights, _ = collapse_duplicates(
+                tweet_docs, args.dedup, args.near_duplicate_threshold,
+                '\n'.join, with_ids=False)
+    else:
+        tweet_texts = file_metrics.iter_counted(
+            iter_tweet_texts(input_file_path), 'tweets_read')
+        if args.dedup != 'none':
+            # tokenize and score each unique text once
+            with file_metrics.stage('dedup'):
+                tweet_texts, weights, _ = collapse_duplicates(
+                    tweet_texts, args.dedup, args.near_duplicate_threshold,
+                    normalize_text, with_ids=False)
+
+        # stream tweets from json file and tokenize them in batches
+        tweet_docs = tokenize_texts(
+            args.spacy_model, tweet_texts,
+            batch_size=args.batch_size, n_process=args.n_process,
+            token_cache=_worker_data['token_cache'],
+            fast_tokenizer=_worker_data['fast_tokenizer'])
+    tweet_docs = file_metrics.iter_counted(
+        file_metrics.iter_timed(tweet_docs, 'tokenization'),
+        'documents_scored', 'tokens_kept')
+
+    # Count documents by dominant topic, scored in chunks converted through
+    # the model's dictionary into array-backed document-term matrices;
+    # inference is seeded from the file name, so counts do not depend on
+    # the number of workers or on the files scored before
+    with file_metrics.stage('predict'):
+        dominant_topic_dist = count_dominant_topics(
+            _worker_data['ldamodel'], tweet_docs, args.chunk_size, weights,
+            dictionary, get_name_seed(os.path.basename(input_file_path)))
+
+    return (dominant_topic_dist.tolist(), int(dominant_topic_dist.sum()),
+            time.time() - start_time, file_metrics.stages,
+            file_metrics.counters)
+
+
+def score_file_with_server(input_file_path, file_metrics, rows=None):
+    """Return dominant topic counts of tweets in JSON file (or source file
+    of the corpus store, or the given rows of the corpus store), scored by
+    the topic server.
+    """
+    args = _worker_data['args']
+    corpus_store = _worker_data['corpus_store']
+    if rows is not None:
+        tweet_texts = corpus_store.iter_texts_at(rows)
+    elif corpus_store is not None:
+        tweet_texts = corpus_store.iter_texts(
+            *corpus_store.get_source_rows(input_file_path))
+    else:
+        tweet_texts = iter_tweet_texts(input_file_path)
+    tweet_texts = file_metrics.iter_counted(tweet_texts, 'tweets_read')
+
+    weights = None
+    if args.dedup != 'none':
+        with file_metrics.stage('dedup'):
+            tweet_texts, weights, _ = collapse_duplicates(
+                tweet_texts, args.dedup, args.near_duplicate_threshold,
+                normalize_text, with_ids=False)
+
+    # the dominant topic of each tweet is its top topic
+    with file_metrics.stage('predict'):
+        dominant_topics = [topic_ids[0] for topic_ids, _ in
+                           _worker_data['client'].iter_top_topics(
+                               file_metrics.iter_counted(tweet_texts,
+                                                         'documents_scored'),
+                               1)]
+    return np.bincount(np.array(dominant_topics, dtype=np.int64),
+                       weights=weights, minlength=args.model_num_topics) \
+        .astype(np.int64)
 
-            input_file_path = os.path.join(
-                args.input_dir_path, input_file_name)
 
-            # load data from json file
-            with open(input_file_path, 'r') as file_reader:
-                data = json.load(file_reader)
+def read_output_rows(output_file_path):
+    """Return dict of file name to its row in existing output file."""
+    if not os.path.exists(output_file_path):
+        return {}
+    with open(output_file_path, 'r', encoding='utf-8') as file_reader:
+        csv_reader = csv.reader(file_reader)
+        next(csv_reader, None)
+        return {row[0]: row for row in csv_reader if row}
 
-            tweet_docs = []
-            # iterate over each tweet in json, and form ngram frequency dictionary
-            for tweet in data['results']:
-                if 'extended_tweet' in tweet:
-                    tweet_text = tweet['extended_tweet']['full_text']
-                else:
-                    tweet_text = tweet['text']
 
-                doc = nlp(tweet_text.lower().strip())
+if __name__ == '__main__':
+    args = parse_arguments()
+    metrics = open_metrics(args)
 
-                tweet_tokens = [token.lemma_ for token in doc
-                                if not token.is_stop and
-                                not token.is_punct and
-                                not token.is_space]
+    # lemmas of the corpus store are scored unless the server tokenizes
+    # the texts
+    if args.corpus_store_path and not args.server_url:
+        CorpusStore(args.corpus_store_path).check_model_key(
+            args.spacy_model, args.tokenizer, args.lemma_table_path)
 
-                tweet_docs.append(tweet_tokens)
+    # rows of the corpus store and start time of each period, by label
+    period_rows = {}
+    period_starts = {}
+    if args.period:
+        # score the corpus store's tweets of each period, in time order
+        time_index = TimeIndex(CorpusStore(args.corpus_store_path))
+        for period_start, rows in time_index.iter_periods(args.period):
+            label = format_period(period_start, args.period)
+            period_rows[label] = rows
+            period_starts[label] = period_start
+        input_file_names = list(period_rows)
+        input_file_paths = input_file_names
+    elif args.corpus_store_path:
+        # score source files of the corpus store by name
+        input_file_names = sorted(
+            name for name, _, _ in
+            CorpusStore(args.corpus_store_path).iter_sources())
+        input_file_paths = input_file_names
+    else:
+        if not os.path.isdir(args.input_dir_path):
+            print('Input path must be a directory.')
 
-            # turn our tokenized documents into a id <-> term dictionary
-            dictionary = corpora.Dictionary(tweet_docs)
+        # only read (possibly compressed) JSON and JSONL files, in sorted
+        # order so that output rows are deterministic
+        input_file_names = sorted(f for f in os.listdir(args.input_dir_path)
+                                  if is_tweet_file(f))
+        input_file_paths = [os.path.join(args.input_dir_path, f)
+                            for f in input_file_names]
 
-            # convert tokenized documents into a document-term matrix
-            corpus = [dictionary.doc2bow(doc) for doc in tweet_docs]
+    # rows of files scored by previous runs with the same model, kept if
+    # their file is unchanged (corpus store sources are always scored)
+    previous_rows = {}
+    manifest = None
+    if args.server_url:
+        # model and tokenizer are those of the topic server
+        server_info = TopicClient(args.server_url).get_info()
+        if args.model_num_topics is None:
+            args.model_num_topics = server_info['num_topics']
+        model_fingerprint = [server_info['fingerprint']]
+    else:
+        model_fingerprint = [
+            get_file_fingerprint(args.model_path),
+            get_file_fingerprint(args.dictionary_path), args.spacy_model,
+            args.tokenizer, get_file_fingerprint(args.lemma_table_path)]
 
-            # Get dominant topic in each document
-            dominant_topic_dist = {}
-            for i, row in enumerate(ldamodel[corpus]):
-                row = sorted(row, key=lambda x: (x[1]), reverse=True)
-                # Get the most dominant topic
-                topic_num, _ = row[0]
-                if topic_num in dominant_topic_dist:
-                    dominant_topic_dist[topic_num] += 1
-                else:
-                    dominant_topic_dist[topic_num] = 1
+    if not args.corpus_store_path:
+        manifest = Manifest(
+            args.manifest_path or args.output_file_path + '.manifest.json',
+            get_output_fingerprint(
+                model_fingerprint, args.model_num_topics, args.dedup,
+                args.near_duplicate_threshold
+                if args.dedup == 'near' else None),
+            force=args.force)
+        if not args.force:
+            previous_rows = read_output_rows(args.output_file_path)
+    pending_file_paths = [p for f, p in zip(input_file_names,
+                                            input_file_paths)
+                          if f not in previous_rows or
+                          not manifest.is_current(p)]
+    metrics.count('files_skipped',
+                  len(input_file_paths) - len(pending_file_paths))
+    print('Scoring %d of %d files' % (len(pending_file_paths),
+                                       len(input_file_paths)))
 
-            topic_freq_list = []
-            for t in range(args.model_num_topics):
-                freq = 0
-                if t in dominant_topic_dist:
-                    freq = dominant_topic_dist[t]
+    pending_rows = [period_rows.get(p) for p in pending_file_paths]
 
-                topic_freq_list.append(freq)
+    # with --window, rows are running totals over the periods of the window
+    window = None
+    if args.window:
+        window_dist = np.zeros(args.model_num_topics, dtype=np.int64)
+        window = SlidingWindow(
+            args.window, args.period,
+            lambda dist: np.add(window_dist, dist, out=window_dist),
+            lambda dist: np.subtract(window_dist, dist, out=window_dist))
 
+    # score files in a pool of worker processes, each loading the model
+    # once; results are returned in input file order
+    if args.jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs,
+                                       initializer=init_worker,
+                                       initargs=(args,))
+        file_results = executor.map(score_file, pending_file_paths,
+                                    pending_rows)
+    elif pending_file_paths:
+        executor = None
+        init_worker(args)
+        file_results = map(score_file, pending_file_paths, pending_rows)
+    else:
+        executor = None
+        file_results = iter([])
+
+    with open(args.output_file_path, 'w', encoding='utf-8') as file_writer:
+
+        csv_writer = csv.writer(file_writer)
+        csv_writer.writerow(['period' if args.period else 'filename'] +
+                            ['topic_' + str(t)
+                             for t in range(args.model_num_topics)])
+
+        # merge rows of scored files with rows of unchanged files, in
+        # input file order
+        pending = set(pending_file_paths)
+        file_num = 0
+        for input_file_name, input_file_path in zip(input_file_names,
+                                                    input_file_paths):
+            if input_file_path not in pending:
+                csv_writer.writerow(previous_rows[input_file_name])
+                continue
+
+            topic_freq_list, num_tweets, elapsed_time, stages, counters = \
+                next(file_results)
+            file_num += 1
+            metrics.merge(stages, counters)
+            metrics.add_file(input_file_path, num_tweets, elapsed_time)
+
+            print('Processed file %d/%d: %s (%d tweets in %.1fs)'
+                  % (file_num, len(pending_file_paths), input_file_name,
+                     num_tweets, elapsed_time))
+
+            if window is not None:
+                window.push(period_starts[input_file_name], topic_freq_list)
+                topic_freq_list = window_dist.tolist()
             csv_writer.writerow([input_file_name] + topic_freq_list)
+
+    if executor is not None:
+        executor.shutdown()
+
+    # record scored files once their rows are written
+    if manifest is not None:
+        manifest.remove_missing(input_file_paths)
+        for input_file_path in pending_file_paths:
+            manifest.update(input_file_path)
+        manifest.save()
+
+    metrics.close()
@@ -1,147 +1,418 @@
-"""Get n-gram (uni, bi and trigram) frequencies for all tweets in JSON format
-in input directory or file.
+"""Get n-gram (uni, bi, trigram and longer) frequencies for all tweets in
+JSON format in input directory or file.
 """
-import json
 import os
-import spacy
 import csv
+import itertools
+import json
+import tempfile
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from tweet_reader import iter_tweet_texts, list_json_files
+from tokenization import load_nlp
+from fast_tokenizer import FastTokenizer
+from ngram_counter import NGramCounter, parse_size
+from corpus_store import CorpusStore
+from time_index import (TimeIndex, SlidingWindow, add_period_arguments,
+                        check_period_arguments, format_period)
+from dedup import add_dedup_arguments, collapse_duplicates
+from manifest import Manifest, get_output_fingerprint
+from metrics import Metrics, add_metrics_arguments, open_metrics
+
+# output file names of n-gram frequencies
+NGRAM_FILE_NAMES = {1: 'unigram.csv', 2: 'bigram.csv', 3: 'trigram.csv'}
+
+# names of merged counts, and of list of partial counts merged into them,
+# in partial counts directory
+TOTALS_FILE_NAME = 'totals.npz'
+TOTALS_INDEX_FILE_NAME = 'totals.json'
+
+# name of manifest of input files with partial counts in partial counts
+# directory
+MANIFEST_FILE_NAME = 'manifest.json'
+
+# number of partial count files merged at a time
+MERGE_BATCH_SIZE = 32
 
 
 def parse_arguments():
-    parser = ArgumentParser('Get n-gram (uni, bi and trigram) frequencies '
-                            'for all tweets in input directory or file.')
+    parser = ArgumentParser('Get n-gram (uni, bi, trigram and longer) '
+                            'frequencies for all tweets in input directory '
+                            'or file.')
     parser.add_argument('--input_path', '-i', type=str,
                         help='Path to input directory or file containing '
-                        'tweets in JSON format.')
+                        'tweets in JSON format. '
+                        'Files may be line-delimited (.jsonl, .ndjson) and '
+                        'compressed (.gz, .bz2, .zst).')
     parser.add_argument('--output_dir_path', '-o', type=str,
                         help='Path to output directory containing CSV files '
-                        'with n-gram frequencies (one each for uni, bi and '
-                        'trigrams)')
+                        'with n-gram frequencies (one for each n up to '
+                        'max_n)')
     parser.add_argument('--spacy_model', '-s', type=str,
                         default='en_core_web_sm',
                         help='Name of spacy model to use.'
                         )
-    return parser.parse_args()
+    parser.add_argument('--tokenizer', type=str, choices=['spacy', 'fast'],
+                        default='spacy',
+                        help='Tokenizer: spacy (model given by '
+                        '--spacy_model) or fast (rule-based, with spacy '
+                        'stopwords). Defaults to spacy.')
+    parser.add_argument('--max_n', type=int, default=3,
+                        help='Max length of n-grams to count. Defaults to 3.')
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='Number of tweets per spacy batch. Defaults to '
+                        '1000.')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of worker processes counting input '
+                        'files at the same time. Defaults to 1.')
+    parser.add_argument('--partial_dir_path', type=str,
+                        help='Path to directory (possibly shared) with '
+                        'partial n-gram counts of each input file and their '
+                        'merged totals. Files already counted there are not '
+                        'counted again (according to the manifest of input '
+                        'files in the directory).')
+    parser.add_argument('--force', action='store_true',
+                        help='Count all input files again, ignoring partial '
+                        'counts and their manifest.')
+    parser.add_argument('--memory_budget', type=parse_size,
+                        help='Approximate memory for n-gram counts, '
+                        'including the token buffer and the temporaries of '
+                        'counting it (e.g. 500M, 2G). Counts beyond it are '
+                        'spilled to disk as sorted runs and merged '
+                        'externally, also when partial counts are saved, '
+                        'loaded and merged.')
+    parser.add_argument('--spill_dir_path', type=str,
+                        help='Path to directory for spilled runs. Defaults '
+                        'to the system temporary directory.')
+    parser.add_argument('--top_k', type=int,
+                        help='Number of most frequent n-grams to write for '
+                        'each n. Defaults to all.')
+    parser.add_argument('--min_count', type=int, default=1,
+                        help='Min frequency of n-grams to write. Defaults '
+                        'to 1.')
+    parser.add_argument('--corpus_store_path', type=str,
+                        help='Path to corpus store written by '
+                        'export_tweets_json_to_csv.py. Tweet texts are read '
+                        'from the store instead of the input path, and '
+                        'counted in this process.')
+    add_period_arguments(parser)
+    add_dedup_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    check_period_arguments(parser, args)
+    return args
 
 
-if __name__ == '__main__':
-    args = parse_arguments()
+def iter_input_texts(input_file_paths, metrics=None):
+    """Yield stripped text of each tweet in input JSON files (recording
+    per-file statistics in metrics, if given).
+    """
+    for input_file_path in input_file_paths:
 
-    # get input arguments from command line
-    input_path = args.input_path
-    output_path = args.output_dir_path
+        print('Processing file: %s' % input_file_path)
 
-    # load spacy nlp module
-    nlp = spacy.load(args.spacy_model)
-
-    # check if input path is a directory or list
-    input_file_paths = []
-    # if input path is a directory, make a list of all files inside it
-    if os.path.isdir(input_path):
-        input_file_paths = [os.path.join(input_path, f)
-                            for f in os.listdir(input_path)
-                            if f.endswith('.json')]
-    # if input path is not a directory, just get the single input file path
-    else:
-        if input_path.endswith('.json'):
-            input_file_paths = [input_path]
+        # stream tweets from json file
+        tweet_texts = iter_tweet_texts(input_file_path)
+        if metrics is not None:
+            tweet_texts = metrics.iter_file(input_file_path, tweet_texts)
+        for tweet_text in tweet_texts:
+            yield tweet_text.strip()
+
+
+def get_tokenizer(args):
+    """Return spacy model or FastTokenizer for command line arguments."""
+    if args.tokenizer == 'fast':
+        return FastTokenizer()
+    return load_nlp(args.spacy_model)
+
+
+def iter_doc_tokens(nlp, tweet_texts, batch_size):
+    """Yield (token texts, flags of tokens that are not stopwords,
+    punctuation or space characters) of each tweet text, tokenized in
+    batches with spacy model (or with a FastTokenizer).
+    """
+    if isinstance(nlp, FastTokenizer):
+        yield from nlp.iter_tokens(tweet_texts)
+        return
+    for doc in nlp.pipe(tweet_texts, batch_size=batch_size):
+        yield ([w.text for w in doc],
+               [not (w.is_stop or w.is_punct or w.is_space) for w in doc])
+
+
+def count_ngrams(nlp, tweet_texts, ngram_counter, batch_size, metrics=None,
+                 weights=None):
+    """Tokenize tweet texts in batches, and count n-grams of each tweet
+    (and tweets, tokens and kept tokens in metrics, if given). If weights
+    are given, n-grams of each text are counted its weight times.
+    """
+    if weights is None:
+        weights = itertools.repeat(1)
+    num_tweets = num_texts = num_tokens = num_kept = 0
+    for (tokens, keep_flags), weight in zip(
+            iter_doc_tokens(nlp, tweet_texts, batch_size), weights):
+        # n-grams only start at tokens that are not stopwords, punctuation
+        # or space characters
+        ngram_counter.add(tokens, keep_flags, weight)
+
+        num_tweets += weight
+        num_texts += 1
+        num_tokens += len(keep_flags)
+        num_kept += sum(keep_flags)
+
+    if metrics is not None:
+        metrics.count('tweets_read', num_tweets)
+        metrics.count('texts_tokenized', num_texts)
+        metrics.count('tokens', num_tokens)
+        metrics.count('tokens_kept', num_kept)
+
+
+def count_texts(tweet_texts, ngram_counter, args, metrics, nlp=None):
+    """Count n-grams of tweet texts (tokenized with nlp, or the tokenizer
+    of command line arguments), collapsing duplicate texts first (if
+    enabled by command line arguments) so that each unique text is
+    tokenized once.
+    """
+    weights = None
+    if args.dedup != 'none':
+        with metrics.stage('dedup'):
+            tweet_texts, weights, _ = collapse_duplicates(
+                tweet_texts, args.dedup, args.near_duplicate_threshold,
+                with_ids=False)
+    with metrics.stage('count'):
+        count_ngrams(nlp or get_tokenizer(args), tweet_texts, ngram_counter,
+                     args.batch_size, metrics, weights)
+
+
+def get_partial_file_name(input_file_path):
+    """Return name of partial counts file of input file."""
+    return os.path.basename(input_file_path) + '.ngrams.npz'
+
+
+def new_counter(args):
+    """Return empty n-gram counter for command line arguments."""
+    return NGramCounter(max_n=args.max_n, memory_budget=args.memory_budget,
+                        spill_dir_path=args.spill_dir_path)
+
+
+def load_counter(file_path, args):
+    """Return n-gram counter loaded from file, read from disk as a spilled
+    run if there is a memory budget.
+    """
+    return NGramCounter.load(file_path, memory_budget=args.memory_budget,
+                             spill_dir_path=args.spill_dir_path)
+
+
+def count_file(input_file_path, partial_file_path, args):
+    """Count n-grams of tweets in input file, and save them as partial
+    counts. Returns (partial counts path, stage timings, counters, file
+    statistics).
+    """
+    file_metrics = Metrics()
+    ngram_counter = new_counter(args)
+    count_texts(iter_input_texts([input_file_path], file_metrics),
+                ngram_counter, args, file_metrics)
+    with file_metrics.stage('save_partial'):
+        ngram_counter.save(partial_file_path)
+    return (partial_file_path, file_metrics.stages, file_metrics.counters,
+            file_metrics.files)
+
+
+def count_partials(input_file_paths, partial_dir_path, args, metrics):
+    """Count n-grams of each input file in a pool of worker processes into
+    partial counts, and merge them into the totals in partial_dir_path.
+    Input files counted before with the same settings and unchanged since
+    (according to the manifest) are not counted again, and partial counts
+    already in the totals are not merged again. Returns the total counts.
+    """
+    manifest = Manifest(os.path.join(partial_dir_path, MANIFEST_FILE_NAME),
+                        get_output_fingerprint(
+                            args.max_n, args.spacy_model, args.tokenizer,
+                            args.dedup, args.near_duplicate_threshold
+                            if args.dedup == 'near' else None),
+                        force=args.force)
+
+    # count input files without up-to-date partial counts
+    partial_file_names = [get_partial_file_name(f) for f in input_file_paths]
+    pending = {}
+    for input_file_path, partial_file_name in zip(input_file_paths,
+                                                  partial_file_names):
+        partial_file_path = os.path.join(partial_dir_path, partial_file_name)
+        if not os.path.exists(partial_file_path) or \
+                not manifest.is_current(input_file_path):
+            pending[partial_file_name] = input_file_path
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(count_file, input_file_path,
+                                   os.path.join(partial_dir_path,
+                                                partial_file_name),
+                                   args)
+                   for partial_file_name, input_file_path in pending.items()]
+        for future in futures:
+            partial_file_path, stages, counters, files = future.result()
+            metrics.merge(stages, counters, files)
+            print('Counted partial: %s' % partial_file_path)
+    metrics.count('files_skipped', len(input_file_paths) - len(pending))
+
+    for input_file_path in pending.values():
+        manifest.update(input_file_path)
+    manifest.remove_missing(input_file_paths)
+    manifest.save()
+
+    # load totals; if partial counts already merged were counted again, or
+    # their input files are gone, rebuild them from all partial counts
+    totals_file_path = os.path.join(partial_dir_path, TOTALS_FILE_NAME)
+    totals_index_file_path = os.path.join(partial_dir_path,
+                                          TOTALS_INDEX_FILE_NAME)
+    merged = []
+    if os.path.exists(totals_index_file_path):
+        with open(totals_index_file_path, 'r') as file_reader:
+            merged = json.load(file_reader)
+    with metrics.stage('merge'):
+        if merged and not set(merged) & set(pending) and \
+                set(merged) <= set(partial_file_names):
+            totals = load_counter(totals_file_path, args)
         else:
-            input_file_paths = []
+            totals = new_counter(args)
+            merged = []
 
-    # initialize ngram frequency dictionaries
-    unigram_freq = {}
-    bigram_freq = {}
-    trigram_freq = {}
+        # merge partial counts of all input files not in the totals yet
+        to_merge = [f for f in partial_file_names if f not in merged]
+        for start in range(0, len(to_merge), MERGE_BATCH_SIZE):
+            batch = to_merge[start:start + MERGE_BATCH_SIZE]
+            print('Merging %d partial counts' % len(batch))
+            totals.update(load_counter(os.path.join(partial_dir_path, f),
+                                       args)
+                          for f in batch)
+            merged.extend(batch)
 
-    # iterate over each file in input_file_paths
-    for input_file_path in input_file_paths:
+        if to_merge:
+            totals.save(totals_file_path)
+            with open(totals_index_file_path, 'w') as file_writer:
+                json.dump(merged, file_writer, indent=1)
+
+    return totals
+
+
+def iter_period_counts(corpus_store, args, metrics):
+    """Yield (period label, n-gram counter) of each period of the corpus
+    store with tweets, in time order: counts of the period's tweets, or
+    with args.window, running totals over the window ending at the period.
+    """
+    time_index = TimeIndex(corpus_store)
+    window = None
+    if args.window:
+        totals = new_counter(args)
+        window = SlidingWindow(args.window, args.period,
+                               lambda counter: totals.update([counter]),
+                               totals.subtract)
+
+    for period_start, rows in time_index.iter_periods(args.period):
+        label = format_period(period_start, args.period)
+        print('Processing %s: %s (%d tweets)' % (args.period, label,
+                                                len(rows)))
+        ngram_counter = new_counter(args)
+        count_texts((tweet_text.strip() for tweet_text in
+                     corpus_store.iter_texts_at(rows)),
+                    ngram_counter, args, metrics)
+        metrics.count('periods')
+        if window is None:
+            yield label, ngram_counter
+        else:
+            with metrics.stage('window'):
+                window.push(period_start, ngram_counter)
+                # counts of periods in the window are kept on disk until
+                # they are subtracted
+                if args.memory_budget:
+                    ngram_counter.spill()
+            yield label, totals
 
-        print('Processing file: %s' % input_file_path)
 
-        # load data from json file
-        with open(input_file_path, 'r') as file_reader:
-            data = json.load(file_reader)
-
-        # iterate over each tweet in json, and form ngram frequency dictionary
-        for tweet in data['results']:
-            if 'extended_tweet' in tweet:
-                tweet_text = tweet['extended_tweet']['full_text']
-            else:
-                tweet_text = tweet['text']
-
-            doc = nlp(tweet_text.strip())
-            word_list = [w for w in doc]
-
-            for i in range(len(word_list)):
-                # check if current token is a stopword, punctuation or space
-                # character
-                if word_list[i].is_stop or word_list[i].is_punct or \
-                        word_list[i].is_space:
-                    continue
-
-                # get unigram text
-                unigram_text = word_list[i].text
-
-                # update unigram frequency dictionary
-                if unigram_text not in unigram_freq:
-                    unigram_freq[unigram_text] = 1
-                else:
-                    unigram_freq[unigram_text] = unigram_freq[unigram_text]+1
-
-                # check if next word exists (for calculating bigram frequency)
-                if i < len(word_list) - 1:
-                    # get bigram text
-                    bigram_text = unigram_text + '__' + word_list[i+1].text
-
-                    # update bigram frequency dictionary
-                    if bigram_text not in bigram_freq:
-                        bigram_freq[bigram_text] = 1
-                    else:
-                        bigram_freq[bigram_text] = bigram_freq[bigram_text]+1
-
-                    # check if next two words exist (for calculating trigram
-                    # frequency)
-                    if i < len(word_list) - 2:
-                        # get trigram text
-                        trigram_text = bigram_text + '__' + word_list[i+2].text
-
-                        # update trigram frequency dictionary
-                        if trigram_text not in trigram_freq:
-                            trigram_freq[trigram_text] = 1
-                        else:
-                            trigram_freq[trigram_text] = \
-                                trigram_freq[trigram_text]+1
-
-    unigram_freq_list = sorted(unigram_freq.items(), key=lambda k: k[1],
-                               reverse=True)
-    bigram_freq_list = sorted(bigram_freq.items(), key=lambda k: k[1],
-                              reverse=True)
-    trigram_freq_list = sorted(trigram_freq.items(), key=lambda k: k[1],
-                               reverse=True)
+def write_period_counts(corpus_store, output_path, args, metrics):
+    """Write frequencies of each n in each period of the corpus store to
+    output_path, one CSV file per n with rows (period, n-gram, count).
+    """
+    file_writers = []
+    csv_writers = []
+    for n in range(1, args.max_n + 1):
+        output_file_name = NGRAM_FILE_NAMES.get(n, '%d-gram.csv' % n)
+        file_writers.append(open(os.path.join(output_path, output_file_name),
+                                 'w'))
+        csv_writers.append(csv.writer(file_writers[-1]))
+
+    for label, ngram_counter in iter_period_counts(corpus_store, args,
+                                                   metrics):
+        with metrics.stage('write'):
+            for n, csv_writer in enumerate(csv_writers, 1):
+                csv_writer.writerows(
+                    (label,) + row for row in ngram_counter.most_common(
+                        n, top_k=args.top_k, min_count=args.min_count))
+
+    for file_writer in file_writers:
+        file_writer.close()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    metrics = open_metrics(args)
+
+    # get input arguments from command line
+    input_path = args.input_path
+    output_path = args.output_dir_path
+
+    # get all JSON files in input directory, or the single input file
+    input_file_paths = list_json_files(input_path) if input_path else []
 
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    # write frequencies to output_path with name
-    # "<input_name>_<ngram_n>-gram.txt"
-    # unigram
-    output_file_name = 'unigram.csv'
-    output_file_path = os.path.join(output_path, output_file_name)
-    with open(output_file_path, 'w') as file_writer:
-        csv_writer = csv.writer(file_writer)
-        csv_writer.writerows(unigram_freq_list)
-
-    # bigram
-    output_file_name = 'bigram.csv'
-    output_file_path = os.path.join(output_path, output_file_name)
-    with open(output_file_path, 'w') as file_writer:
-        csv_writer = csv.writer(file_writer)
-        csv_writer.writerows(bigram_freq_list)
-
-    # trigram
-    output_file_name = 'trigram.csv'
-    output_file_path = os.path.join(output_path, output_file_name)
-    with open(output_file_path, 'w') as file_writer:
-        csv_writer = csv.writer(file_writer)
-        csv_writer.writerows(trigram_freq_list)
+    ngram_counter = None
+    if args.period:
+        # count and write n-grams of each period of the corpus store in one
+        # pass
+        write_period_counts(CorpusStore(args.corpus_store_path), output_path,
+                            args, metrics)
+    elif args.corpus_store_path:
+        # count n-grams of texts in the memory-mapped corpus store
+        # texts of each source file are counted separately, so that
+        # duplicates are only collapsed (and held) within a file
+        corpus_store = CorpusStore(args.corpus_store_path)
+        ngram_counter = new_counter(args)
+        nlp = get_tokenizer(args)
+        for _, start, stop in corpus_store.iter_sources():
+            count_texts((tweet_text.strip() for tweet_text in
+                         corpus_store.iter_texts(start, stop)),
+                        ngram_counter, args, metrics, nlp)
+    elif args.partial_dir_path:
+        # count each file separately, and merge new partial counts into
+        # the totals
+        if not os.path.isdir(args.partial_dir_path):
+            os.makedirs(args.partial_dir_path)
+        ngram_counter = count_partials(input_file_paths,
+                                       args.partial_dir_path, args, metrics)
+    elif args.jobs > 1:
+        # count each file separately in a temporary directory
+        with tempfile.TemporaryDirectory() as partial_dir_path:
+            ngram_counter = count_partials(input_file_paths,
+                                           partial_dir_path, args, metrics)
+    else:
+        # initialize n-gram counter over interned token ids, and count
+        # n-grams of each file, with duplicates collapsed within the file
+        ngram_counter = new_counter(args)
+        nlp = get_tokenizer(args)
+        for input_file_path in input_file_paths:
+            count_texts(iter_input_texts([input_file_path], metrics),
+                        ngram_counter, args, metrics, nlp)
+
+    if ngram_counter is not None:
+        # write frequencies of each n to output_path as unigram.csv,
+        # bigram.csv, trigram.csv, 4-gram.csv, ...
+        for n in range(1, args.max_n + 1):
+            output_file_name = NGRAM_FILE_NAMES.get(n, '%d-gram.csv' % n)
+            output_file_path = os.path.join(output_path, output_file_name)
+            with metrics.stage('write'), \
+                    open(output_file_path, 'w') as file_writer:
+                csv_writer = csv.writer(file_writer)
+                csv_writer.writerows(ngram_counter.most_common(
+                    n, top_k=args.top_k, min_count=args.min_count))
+
+    metrics.close()
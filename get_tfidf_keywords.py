@@ -1,11 +1,16 @@
 """Get tf-idf keywords for all tweets in JSON format in input directory
 (separate analysis for each subdirectory).
 """
-import json
 import os
+import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from argparse import ArgumentParser
 import csv
+from tweet_reader import iter_tweet_texts, is_tweet_file
+from tfidf_store import TfidfStore, MANIFEST_FILE_NAME
+from corpus_store import CorpusStore, META_FILE_NAME
+from manifest import Manifest, get_output_fingerprint
+from metrics import add_metrics_arguments, open_metrics
 
 
 def parse_arguments():
@@ -14,77 +19,204 @@ def parse_arguments():
                             'analysis for each subdirectory).')
     parser.add_argument('--input_dir_path', '-i', type=str,
                         help='Path to input directory containing '
-                        'tweets in JSON format.')
+                        'tweets in JSON format. '
+                        'Files may be line-delimited (.jsonl, .ndjson) and '
+                        'compressed (.gz, .bz2, .zst).')
     parser.add_argument('--output_dir_path', '-o', type=str,
                         help='Path to output directory containing CSV files '
                         'with tf-idf keywords and their scores')
+    parser.add_argument('--top_k', type=int,
+                        help='Number of top keywords to write for each '
+                        'subdirectory. Defaults to all keywords with '
+                        'non-zero score.')
+    parser.add_argument('--store_dir_path', type=str,
+                        help='Path to directory with stored term counts of '
+                        'each subdirectory. Only subdirectories not in the '
+                        'store yet, or whose files changed since they were '
+                        'counted, are read, and keywords are written for '
+                        'all subdirectories in the store.')
+    parser.add_argument('--drop_missing_buckets', action='store_true',
+                        help='With --store_dir_path, remove subdirectories '
+                        'that are no longer in the input from the store.')
+    parser.add_argument('--corpus_store_path', type=str,
+                        help='Path to corpus store written by '
+                        'export_tweets_json_to_csv.py from the input '
+                        'directory. Tweets of each subdirectory are read from '
+                        'the store instead of its JSON files.')
+    add_metrics_arguments(parser)
     return parser.parse_args()
 
 
+def get_subdir_file_paths(input_subdir_path):
+    """Return sorted paths of (possibly compressed) JSON and JSONL files in
+    subdirectory.
+    """
+    return sorted(os.path.join(input_subdir_path, input_file_name)
+                  for input_file_name in os.listdir(input_subdir_path)
+                  if is_tweet_file(input_file_name))
+
+
+def iter_subdir_texts(input_subdir_path):
+    """Yield text of each tweet in JSON files in subdirectory."""
+    for input_file_path in get_subdir_file_paths(input_subdir_path):
+
+        # stream tweets from json file
+        for tweet_text in iter_tweet_texts(input_file_path):
+            yield tweet_text
+
+
+def get_store_subdir_rows(corpus_store):
+    """Return dict of subdirectory name to list of (start row, stop row) of
+    its source files in corpus store.
+    """
+    subdir_rows = {}
+    for source_name, start, stop in corpus_store.iter_sources():
+        subdir_name = os.path.dirname(source_name)
+        if subdir_name:
+            subdir_rows.setdefault(subdir_name, []).append((start, stop))
+    return subdir_rows
+
+
+def get_top_keywords(X, i, top_k=None):
+    """Return (feature indices, scores) of the top_k (or all) non-zero
+    features of row i of sparse CSR matrix X, in decreasing order of score.
+    """
+    start, end = X.indptr[i], X.indptr[i+1]
+    indices = X.indices[start:end]
+    scores = X.data[start:end]
+
+    if top_k and top_k < len(scores):
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        indices = indices[top]
+        scores = scores[top]
+
+    # sort by decreasing score, then by feature index
+    order = np.lexsort((indices, -scores))
+    return indices[order], scores[order]
+
+
 if __name__ == '__main__':
     args = parse_arguments()
+    metrics = open_metrics(args)
 
     # get input arguments from command line
     input_path = args.input_dir_path
-    if not os.path.isdir(input_path):
-        print('Input path must be a directory.')
     output_path = args.output_dir_path
     if not os.path.isdir(output_path):
         print('Output path must be a directory.')
 
+    if args.corpus_store_path:
+        # get rows of each subdir's files in the memory-mapped corpus store
+        corpus_store = CorpusStore(args.corpus_store_path)
+        subdir_rows = get_store_subdir_rows(corpus_store)
+        input_subdir_paths = list(subdir_rows)
+    else:
+        if not os.path.isdir(input_path):
+            print('Input path must be a directory.')
+
+        # get all subdir paths; each subdir contains tweets for one group of
+        # tweets that are to be considered as a single document for TFIDF
+        input_subdir_paths = [os.path.join(input_path, d)
+                              for d in os.listdir(input_path)
+                              if not d.startswith('.') and
+                              os.path.isdir(os.path.join(input_path, d))]
+
+    # each document is given as its subdir path, and analyzed by streaming
+    # the tokens of each of its tweets (same tokens as analyzing all its
+    # tweets joined by spaces)
+    tweet_analyzer = TfidfVectorizer().build_analyzer()
+
+    def analyze_subdir(input_subdir_path):
+        print('Processing dir: %s' % input_subdir_path)
+        if args.corpus_store_path:
+            tweet_texts = (tweet_text
+                           for start, stop in subdir_rows[input_subdir_path]
+                           for tweet_text in corpus_store.iter_texts(start,
+                                                                     stop))
+        else:
+            tweet_texts = iter_subdir_texts(input_subdir_path)
+        tweet_texts = metrics.iter_counted(
+            metrics.iter_file(input_subdir_path, tweet_texts), 'tweets_read')
+        for tweet_text in tweet_texts:
+            yield from tweet_analyzer(tweet_text)
+
     # tfidf score will not penalize stopwords when number of documents is
     # small; so, in our case, since the number of documents is only 10
     # (one for each week), we filter our terms that occur in more than 7
     # weeks out of 10
-    vectorizer = TfidfVectorizer(max_df=0.7)
-
-    # get all subdir paths; each subdir contains tweets for one group of
-    # tweets that are to be considered as a single document for TFIDF
-    input_subdir_paths = [os.path.join(input_path, d)
-                          for d in os.listdir(input_path)
-                          if not d.startswith('.') and
-                          os.path.isdir(os.path.join(input_path, d))]
-
-    tweet_docs = []
-    # iterate over each subdir in input_subdir_paths
-    for input_subdir_path in input_subdir_paths:
-
-        print('Processing dir: %s' % input_subdir_path)
-
-        tweet_doc = ''
-        for input_file_name in os.listdir(input_subdir_path):
-            input_file_path = os.path.join(input_subdir_path, input_file_name)
-
-            # load data from json file
-            with open(input_file_path, 'r') as file_reader:
-                data = json.load(file_reader)
-
-            # iterate over each tweet in json, and form ngram frequency
-            # dictionary
-            for tweet in data['results']:
-                if 'extended_tweet' in tweet:
-                    tweet_text = tweet['extended_tweet']['full_text']
+    max_df = 0.7
+
+    if args.store_dir_path:
+        # count terms of new or changed subdirs only, and recompute tf-idf
+        # of all subdirs in the store from their stored counts
+        store = TfidfStore.load(args.store_dir_path)
+        if not os.path.isdir(args.store_dir_path):
+            os.makedirs(args.store_dir_path)
+        manifest = Manifest(os.path.join(args.store_dir_path,
+                                         MANIFEST_FILE_NAME),
+                            get_output_fingerprint())
+        with metrics.stage('count'):
+            bucket_names = set()
+            for input_subdir_path in input_subdir_paths:
+                bucket_name = os.path.basename(input_subdir_path)
+                bucket_names.add(bucket_name)
+
+                # tweets read from the corpus store depend on the whole
+                # store, which is rewritten on each export
+                if args.corpus_store_path:
+                    file_paths = [os.path.join(args.corpus_store_path,
+                                               META_FILE_NAME)]
                 else:
-                    tweet_text = tweet['text']
-                tweet_doc += tweet_text + ' '
-        tweet_docs.append(tweet_doc)
+                    file_paths = get_subdir_file_paths(input_subdir_path)
+                if bucket_name in store and \
+                        store.bucket_files.get(bucket_name) == file_paths \
+                        and all(manifest.is_current(file_path)
+                                for file_path in file_paths):
+                    continue
+                store.replace_bucket(bucket_name,
+                                     analyze_subdir(input_subdir_path),
+                                     file_paths)
+                for file_path in file_paths:
+                    manifest.update(file_path)
+
+            if args.drop_missing_buckets:
+                for bucket_name in list(store.bucket_names):
+                    if bucket_name not in bucket_names:
+                        print('Dropping bucket: %s' % bucket_name)
+                        store.remove_bucket(bucket_name)
+            store.save(args.store_dir_path)
+            manifest.remove_missing([file_path
+                                     for file_paths in
+                                     store.bucket_files.values()
+                                     for file_path in file_paths])
+            manifest.save()
+
+        with metrics.stage('tfidf'):
+            X, feature_names = store.get_tfidf(max_df=max_df)
+        bucket_names = store.bucket_names
+    else:
+        vectorizer = TfidfVectorizer(max_df=max_df, analyzer=analyze_subdir)
+
+        # sparse (CSR) tf-idf matrix
+        with metrics.stage('count_and_tfidf'):
+            X = vectorizer.fit_transform(input_subdir_paths).tocsr()
+
+        if hasattr(vectorizer, 'get_feature_names_out'):
+            feature_names = vectorizer.get_feature_names_out()
+        else:
+            feature_names = vectorizer.get_feature_names()
+        bucket_names = [os.path.basename(d) for d in input_subdir_paths]
 
-    X = vectorizer.fit_transform(tweet_docs)
-    X = X.toarray()
+    for i in range(X.shape[0]):
+        with metrics.stage('write'):
+            indices, scores = get_top_keywords(X, i, args.top_k)
 
-    feature_names = vectorizer.get_feature_names()
-    feature_indices = range(len(feature_names))
+            output_file_name = bucket_names[i]+'_tfidf_keywords.txt'
 
-    for i in range(X.shape[0]):
-        scores = X[i]
-        sorted_indices_scores = sorted(zip(feature_indices, scores),
-                                       key=lambda k: k[1], reverse=True)
-
-        output_file_name = os.path.basename(
-            input_subdir_paths[i])+'_tfidf_keywords.txt'
-
-        output_file_path = os.path.join(output_path, output_file_name)
-        with open(output_file_path, 'w') as file_writer:
-            csv_writer = csv.writer(file_writer)
-            for (idx, score) in sorted_indices_scores:
-                csv_writer.writerow([feature_names[idx], score])
+            output_file_path = os.path.join(output_path, output_file_name)
+            with open(output_file_path, 'w') as file_writer:
+                csv_writer = csv.writer(file_writer)
+                for (idx, score) in zip(indices.tolist(), scores.tolist()):
+                    csv_writer.writerow([feature_names[idx], score])
+
+    metrics.close()
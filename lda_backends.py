@@ -0,0 +1,47 @@
+"""LDA training backends: Mallet (Java collapsed Gibbs sampling through
+gensim's LdaMallet wrapper, which round-trips the corpus through text files
+and was removed in gensim 4), or gensim's in-process LdaMulticore (online
+variational Bayes over worker processes, streaming the corpus in chunks).
+
+Models of both backends are pickled the same way, and have print_topics and
+get_topics for the hyperparameter report and coherence.
+"""
+import gensim
+from gensim.models import LdaMulticore
+
+BACKENDS = ['mallet', 'multicore']
+
+# number of documents per LdaMulticore training chunk
+CHUNK_SIZE = 2000
+
+
+def get_lda_mallet():
+    """Return gensim's LdaMallet class, if this gensim version has it."""
+    try:
+        from gensim.models.wrappers import LdaMallet
+    except ImportError:
+        raise ImportError('LdaMallet is not available in gensim %s (it was '
+                          'removed in gensim 4.0); use the multicore '
+                          'backend instead.' % gensim.__version__)
+    return LdaMallet
+
+
+def train_lda_model(backend, corpus, dictionary, num_topics, workers,
+                    mallet_path=None, prefix=None, passes=1,
+                    iterations=50, random_state=None):
+    """Return LDA model with num_topics topics trained on bag-of-words
+    corpus with backend. Mallet models keep their files under prefix.
+    """
+    if backend == 'mallet':
+        return get_lda_mallet()(mallet_path, corpus=corpus,
+                                num_topics=num_topics, id2word=dictionary,
+                                workers=workers, prefix=prefix)
+
+    if backend == 'multicore':
+        return LdaMulticore(corpus, num_topics=num_topics,
+                            id2word=dictionary, workers=workers,
+                            chunksize=CHUNK_SIZE, passes=passes,
+                            iterations=iterations,
+                            random_state=random_state)
+
+    raise ValueError('Unknown LDA backend: %s' % backend)
@@ -0,0 +1,99 @@
+"""Manifest of processed input files for incremental runs.
+
+For each input file the manifest records its size, mtime and content hash,
+and a fingerprint of the settings its output was computed with (model,
+dictionary, ...). A file is processed again only if it is new, its content
+changed, or it was processed with other settings. Size and mtime are
+checked first, so unchanged files are not hashed again.
+"""
+import hashlib
+import json
+import os
+
+# number of bytes hashed at a time
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_file(file_path):
+    """Return hex sha1 digest of file content."""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file_reader:
+        for chunk in iter(lambda: file_reader.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_output_fingerprint(*settings):
+    """Return fingerprint of settings (JSON-serializable values) that
+    outputs depend on.
+    """
+    return hashlib.sha1(json.dumps(settings, sort_keys=True)
+                        .encode('utf-8')).hexdigest()
+
+
+def get_file_fingerprint(file_path):
+    """Return fingerprint (path-independent) of input or model file from
+    its size and mtime, or None if it does not exist.
+    """
+    if not file_path or not os.path.exists(file_path):
+        return None
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Manifest:
+    """Processed input files of one output, stored as a JSON file."""
+
+    def __init__(self, manifest_path, output_fingerprint, force=False):
+        self.manifest_path = manifest_path
+        self.output_fingerprint = output_fingerprint
+        self.files = {}
+        if not force and os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as file_reader:
+                self.files = json.load(file_reader)['files']
+
+    def __contains__(self, file_path):
+        return file_path in self.files
+
+    def is_current(self, file_path):
+        """Return True if file was processed before with the current
+        settings and is unchanged since.
+        """
+        entry = self.files.get(file_path)
+        if entry is None or entry['output'] != self.output_fingerprint:
+            return False
+
+        stat = os.stat(file_path)
+        if entry['size'] == stat.st_size and \
+                entry['mtime'] == stat.st_mtime_ns:
+            return True
+        if entry['size'] != stat.st_size or \
+                entry['sha1'] != hash_file(file_path):
+            return False
+
+        # touched but unchanged
+        entry['mtime'] = stat.st_mtime_ns
+        return True
+
+    def update(self, file_path):
+        """Record file as processed with the current settings."""
+        stat = os.stat(file_path)
+        self.files[file_path] = {'size': stat.st_size,
+                                 'mtime': stat.st_mtime_ns,
+                                 'sha1': hash_file(file_path),
+                                 'output': self.output_fingerprint}
+
+    def remove_missing(self, file_paths):
+        """Drop entries of files not in file_paths. Returns dropped paths."""
+        missing = set(self.files) - set(file_paths)
+        for file_path in missing:
+            del self.files[file_path]
+        return sorted(missing)
+
+    def save(self):
+        """Save manifest (written atomically)."""
+        tmp_manifest_path = self.manifest_path + '.tmp'
+        with open(tmp_manifest_path, 'w', encoding='utf-8') as file_writer:
+            json.dump({'files': self.files}, file_writer, indent=1,
+                      sort_keys=True)
+        os.replace(tmp_manifest_path, self.manifest_path)
@@ -0,0 +1,214 @@
+"""Stage timing, counters, per-file timings and peak memory of script runs,
+written as a JSON report with --metrics_out.
+
+Scripts add the command line arguments with add_metrics_arguments, and
+create a Metrics object with open_metrics. Without --metrics_out, timings
+and counts are still kept (cheaply) but no report is written. Counters are
+meant to be incremented per batch or file, not per token.
+
+Optionally, the run is profiled with cProfile or pyinstrument (if
+installed), and the profile written next to the report.
+"""
+from contextlib import contextmanager
+import json
+import os
+import resource
+import sys
+import time
+
+PROFILERS = ['cprofile', 'pyinstrument']
+
+
+def add_metrics_arguments(parser):
+    """Add --metrics_out and --profile arguments to argument parser."""
+    parser.add_argument('--metrics_out', type=str,
+                        help='Path to output JSON file with stage timings, '
+                        'counters, per-file timings and peak memory of the '
+                        'run.')
+    parser.add_argument('--profile', type=str, choices=PROFILERS,
+                        help='Profile the run with cProfile or pyinstrument. '
+                        'The profile is written to the metrics output path '
+                        'with .prof (cProfile) or .html (pyinstrument) '
+                        'appended.')
+
+
+def get_peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Return peak resident set size of this process (or of its largest
+    finished child process) in MB.
+    """
+    peak_rss = resource.getrusage(who).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak_rss / (1 << 20)
+    return peak_rss / (1 << 10)
+
+
+class Metrics:
+    """Timings, counters and per-file statistics of one script run."""
+
+    def __init__(self, metrics_out=None, profile=None):
+        self.metrics_out = metrics_out
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.files = []
+        self.profiler = None
+
+        if profile == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profile == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                print('pyinstrument is not installed; not profiling.')
+            else:
+                self.profiler = Profiler()
+                self.profiler.start()
+        self.profile = profile if self.profiler is not None else None
+
+    @contextmanager
+    def stage(self, stage_name):
+        """Context manager adding time spent in it to stage."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage_name, time.perf_counter() - start_time)
+
+    def add_time(self, stage_name, seconds):
+        """Add seconds (e.g. measured in a worker process) to stage."""
+        stage = self.stages.setdefault(stage_name,
+                                       {'seconds': 0.0, 'calls': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += 1
+
+    def merge(self, stages, counters, files=()):
+        """Add stage timings, counters and file statistics of another
+        Metrics (e.g. of a worker process).
+        """
+        for stage_name, stage in stages.items():
+            total = self.stages.setdefault(stage_name,
+                                           {'seconds': 0.0, 'calls': 0})
+            total['seconds'] += stage['seconds']
+            total['calls'] += stage['calls']
+        for counter_name, n in counters.items():
+            self.count(counter_name, n)
+        self.files.extend(files)
+
+    def count(self, counter_name, n=1):
+        """Add n to counter."""
+        self.counters[counter_name] = self.counters.get(counter_name, 0) + n
+
+    def add_file(self, file_path, num_tweets, seconds):
+        """Record number of tweets and seconds taken for input file."""
+        self.files.append({
+            'path': file_path,
+            'bytes': os.path.getsize(file_path)
+            if os.path.isfile(file_path) else None,
+            'tweets': num_tweets,
+            'seconds': seconds,
+            'tweets_per_sec': num_tweets / seconds if seconds else None,
+        })
+
+    def iter_file(self, file_path, items):
+        """Yield items (e.g. tweet texts) of input file, and record their
+        number and the time until the last one was taken as the file's
+        statistics.
+        """
+        start_time = time.perf_counter()
+        num_items = 0
+        try:
+            for item in items:
+                num_items += 1
+                yield item
+        finally:
+            self.add_file(file_path, num_items,
+                          time.perf_counter() - start_time)
+
+    def iter_counted(self, items, counter_name, length_counter_name=None):
+        """Yield items, adding their number to counter (and the sum of
+        their lengths, e.g. tokens of documents, to length counter) once
+        all were taken (or the generator is closed).
+        """
+        num_items = 0
+        total_length = 0
+        try:
+            for item in items:
+                num_items += 1
+                if length_counter_name:
+                    total_length += len(item)
+                yield item
+        finally:
+            self.count(counter_name, num_items)
+            if length_counter_name:
+                self.count(length_counter_name, total_length)
+
+    def iter_timed(self, items, stage_name):
+        """Yield items, adding time spent producing them (e.g. by a lazy
+        tokenizer) to stage.
+        """
+        items = iter(items)
+        seconds = 0.0
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - start_time
+                yield item
+        finally:
+            self.add_time(stage_name, seconds)
+
+    def get_report(self):
+        """Return report of the run as a JSON-serializable dict."""
+        wall_seconds = time.perf_counter() - self.start_time
+        tweets_read = self.counters.get('tweets_read', 0)
+        return {
+            'script': os.path.basename(sys.argv[0]),
+            'argv': sys.argv[1:],
+            'wall_seconds': wall_seconds,
+            'tweets_per_sec': tweets_read / wall_seconds
+            if wall_seconds else None,
+            'stages': self.stages,
+            'counters': self.counters,
+            'peak_rss_mb': get_peak_rss_mb(),
+            'peak_children_rss_mb': get_peak_rss_mb(
+                resource.RUSAGE_CHILDREN),
+            # slowest files first
+            'files': sorted(self.files, key=lambda f: f['seconds'],
+                            reverse=True),
+        }
+
+    def close(self):
+        """Stop profiling, and write report and profile (if enabled)."""
+        if self.profile == 'cprofile':
+            self.profiler.disable()
+        elif self.profile == 'pyinstrument':
+            self.profiler.stop()
+
+        if not self.metrics_out:
+            if self.profile == 'cprofile':
+                self.profiler.print_stats('cumulative')
+            elif self.profile == 'pyinstrument':
+                print(self.profiler.output_text())
+            return
+
+        with open(self.metrics_out, 'w') as file_writer:
+            json.dump(self.get_report(), file_writer, indent=1)
+        if self.profile == 'cprofile':
+            self.profiler.dump_stats(self.metrics_out + '.prof')
+        elif self.profile == 'pyinstrument':
+            with open(self.metrics_out + '.html', 'w') as file_writer:
+                file_writer.write(self.profiler.output_html())
+
+
+def open_metrics(args):
+    """Return Metrics for command line arguments added by
+    add_metrics_arguments.
+    """
+    return Metrics(args.metrics_out, args.profile)
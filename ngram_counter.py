@@ -0,0 +1,510 @@
+"""N-gram counting over integer token ids.
+
+Tokens are interned to integer ids as they are added, and n-grams are kept
+as rows of ids in NumPy arrays. Buffered n-grams are counted with np.unique
+and merged into the running counts, so no string is built per n-gram; ids
+are decoded back to text only when the counts are written out.
+
+Counts can be saved to and loaded from .npz files, and counters with
+different token ids merged, so partial counts of separate inputs can be
+combined later.
+
+With a memory budget, the token buffer is sized so that counting it takes a
+quarter of the budget, and counts are spilled to disk as sorted runs
+whenever merging into them could take more than the rest. The runs are
+merged externally (streaming) when the counts are read, saved or merged
+into other counters, and counts loaded with a budget are read from disk
+as a run, so saving, loading and merging counters stay within the budget
+as well.
+"""
+from array import array
+import heapq
+from itertools import islice
+import os
+import shutil
+import tempfile
+import weakref
+import zipfile
+import numpy as np
+
+# separator between n-gram tokens in output
+NGRAM_SEPARATOR = '__'
+
+# number of buffered tokens before n-grams are counted
+BUFFER_SIZE = 10000000
+
+# fraction (1 / n) of the memory budget for buffered tokens and the
+# temporaries of counting them
+_BUFFER_BUDGET_DIVISOR = 4
+
+# peak memory of merging n-grams into the counts, in multiples of the
+# counts: the counts, their concatenation with the new rows and counts,
+# np.unique's sorted copy, order, mask and inverse indices, and the summed
+# counts
+_MERGE_OVERHEAD = 5
+
+# id marking document boundaries in the token buffer
+_BOUNDARY = -1
+
+# number of rows read from a spilled run at a time during merge (without a
+# memory budget)
+_RUN_READ_SIZE = 100000
+
+_SIZE_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def parse_size(size):
+    """Return number of bytes in size string such as 500M or 2G."""
+    size = size.strip().upper()
+    if size and size[-1] in _SIZE_UNITS:
+        return int(float(size[:-1]) * _SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def _get_flush_nbytes_per_token(max_n):
+    """Return estimated peak bytes per buffered token while the buffer is
+    counted: the buffer (id, keep flag and weight), the mask and positions
+    of n-gram starts, and, for the largest n, the columns and rows of
+    n-grams, np.unique's sorted copy and unique rows, and its order,
+    inverse indices and counts.
+    """
+    return 4 + 1 + 8 + 1 + 8 + 4 * max_n * 4 + 3 * 8
+
+
+def _get_row_nbytes(n):
+    """Return estimated bytes of an n-gram row and its count as Python
+    objects (list, tuple and ints) while runs are merged.
+    """
+    return 200 + 64 * n
+
+
+def _iter_rows(rows, counts, read_size):
+    """Yield (n-gram tuple, count) of rows of token ids and their counts,
+    converted to Python objects read_size rows at a time.
+    """
+    for start in range(0, len(counts), read_size):
+        end = start + read_size
+        yield from zip(map(tuple, rows[start:end].tolist()),
+                       counts[start:end].tolist())
+
+
+def _save_npz(file_path, arrays, chunk_nbytes):
+    """Save arrays to uncompressed .npz file as np.savez does, writing the
+    data of each (possibly memory-mapped) array chunk_nbytes at a time.
+    """
+    with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_STORED,
+                         allowZip64=True) as zip_file:
+        for name, values in arrays.items():
+            values = np.asarray(values)
+            with zip_file.open(name + '.npy', 'w',
+                               force_zip64=True) as file_writer:
+                np.lib.format.write_array_header_2_0(
+                    file_writer,
+                    np.lib.format.header_data_from_array_1_0(values))
+                chunk_size = max(chunk_nbytes // max(values.itemsize, 1), 1)
+                values = values.reshape(-1)
+                for start in range(0, len(values), chunk_size):
+                    file_writer.write(
+                        values[start:start + chunk_size].tobytes())
+
+
+def _load_run_array(file_path):
+    """Return array of .npy file, memory-mapped unless it is empty."""
+    values = np.load(file_path, mmap_mode='r')
+    return np.asarray(values) if values.size == 0 else values
+
+
+class NGramCounter:
+    """Counts n-grams for n = 1 to max_n.
+
+    As in the original counting loop, an n-gram is counted at every position
+    whose first token is kept (not a stopword, punctuation or space);
+    following tokens of the n-gram may be any tokens of the same document.
+    """
+
+    def __init__(self, max_n=3, buffer_size=BUFFER_SIZE,
+                 memory_budget=None, spill_dir_path=None):
+        self.max_n = max_n
+        self.memory_budget = memory_budget
+        if memory_budget:
+            buffer_size = min(buffer_size, max(
+                memory_budget // _BUFFER_BUDGET_DIVISOR //
+                _get_flush_nbytes_per_token(max_n), 1))
+        self.buffer_size = buffer_size
+        self.spill_dir_path = spill_dir_path
+        self._spill_dir = None
+        self.runs = []
+        self.token_ids = {}
+        self.tokens = []
+        self.ngrams = [np.empty((0, n), dtype=np.int32)
+                       for n in range(1, max_n + 1)]
+        self.counts = [np.empty(0, dtype=np.int64)
+                       for n in range(1, max_n + 1)]
+        self._buffer_ids = array('i')
+        self._buffer_keep = array('b')
+        # weight of each buffered token, only kept once a document with
+        # weight other than 1 is added
+        self._buffer_weights = None
+
+    def intern(self, token):
+        """Return id of token, assigning a new one if it is not known."""
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = self.token_ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return token_id
+
+    def add(self, tokens, keep_flags, weight=1):
+        """Add tokens of one document, with flags marking tokens at which
+        n-grams may start. Its n-grams are counted weight times (e.g. for a
+        text standing for weight duplicate tweets).
+        """
+        if weight != 1 and self._buffer_weights is None:
+            self._buffer_weights = array('q', [1]) * len(self._buffer_ids)
+        if self._buffer_weights is not None:
+            self._buffer_weights.extend([weight] * (len(tokens) + 1))
+
+        for token in tokens:
+            self._buffer_ids.append(self.intern(token))
+        self._buffer_keep.extend(keep_flags)
+
+        self._buffer_ids.append(_BOUNDARY)
+        self._buffer_keep.append(False)
+
+        if len(self._buffer_ids) >= self.buffer_size:
+            self.flush()
+
+    def buffered_ngrams(self, n):
+        """Return (rows of token ids, buffer positions) of n-grams in the
+        buffer.
+        """
+        ids = np.frombuffer(self._buffer_ids, dtype=np.int32)
+        num_starts = len(ids) - n + 1
+        if num_starts <= 0:
+            return np.empty((0, n), dtype=np.int32), np.empty(0, dtype=int)
+
+        valid = np.frombuffer(self._buffer_keep, dtype=np.int8)[:num_starts] \
+            .astype(bool)
+        for k in range(1, n):
+            valid &= ids[k:k + num_starts] != _BOUNDARY
+        starts = np.nonzero(valid)[0]
+
+        return np.stack([ids[starts + k] for k in range(n)], axis=1), starts
+
+    def flush(self):
+        """Count buffered n-grams into the running counts."""
+        if not self._buffer_ids:
+            return
+
+        weights = None
+        if self._buffer_weights is not None:
+            weights = np.frombuffer(self._buffer_weights, dtype=np.int64)
+        for n in range(1, self.max_n + 1):
+            rows, starts = self.buffered_ngrams(n)
+            if weights is None:
+                rows, counts = np.unique(rows, axis=0, return_counts=True)
+            else:
+                rows, inverse = np.unique(rows, axis=0, return_inverse=True)
+                counts = np.bincount(inverse.ravel(), weights=weights[starts],
+                                     minlength=len(rows)).astype(np.int64)
+            self.merge(n, rows, counts)
+
+        self._buffer_ids = array('i')
+        self._buffer_keep = array('b')
+        self._buffer_weights = None
+
+        self._check_memory_budget()
+
+    def nbytes(self):
+        """Return approximate memory used by counts (not vocabulary)."""
+        return sum(rows.nbytes + counts.nbytes
+                   for rows, counts in zip(self.ngrams, self.counts))
+
+    def _check_memory_budget(self):
+        # leave room for the next buffer and merging it into the counts
+        if self.memory_budget and \
+                self.nbytes() * _MERGE_OVERHEAD + \
+                self.buffer_size * _get_flush_nbytes_per_token(self.max_n) \
+                > self.memory_budget:
+            self.spill()
+
+    def _get_spill_path(self, file_name):
+        """Return path of file in the counter's spill directory, created
+        (and removed with the counter) on first use.
+        """
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='ngram_runs_',
+                                               dir=self.spill_dir_path)
+            weakref.finalize(self, shutil.rmtree, self._spill_dir,
+                             ignore_errors=True)
+        return os.path.join(self._spill_dir, file_name)
+
+    def spill(self):
+        """Write counts to disk as a sorted run, and clear them from
+        memory.
+        """
+        run = []
+        for n in range(1, self.max_n + 1):
+            run_prefix = self._get_spill_path('run%d_n%d'
+                                              % (len(self.runs), n))
+            np.save(run_prefix + '_rows.npy', self.ngrams[n - 1])
+            np.save(run_prefix + '_counts.npy', self.counts[n - 1])
+            run.append((run_prefix + '_rows.npy',
+                        run_prefix + '_counts.npy'))
+            self.ngrams[n - 1] = np.empty((0, n), dtype=np.int32)
+            self.counts[n - 1] = np.empty(0, dtype=np.int64)
+        self.runs.append(run)
+
+    def _get_read_size(self, n):
+        """Return number of n-grams read at a time from each spilled run
+        (and from the counts in memory) when runs are merged.
+        """
+        if not self.memory_budget:
+            return _RUN_READ_SIZE
+        return max(self.memory_budget // _BUFFER_BUDGET_DIVISOR //
+                   ((len(self.runs) + 2) * _get_row_nbytes(n)), 1)
+
+    def iter_counts(self, n):
+        """Yield (n-gram tuple of token ids, count) of all n-grams, merging
+        spilled runs as a stream. N-grams whose counts were subtracted to 0
+        are skipped.
+        """
+        self.flush()
+        read_size = self._get_read_size(n)
+        if not self.runs:
+            yield from _iter_rows(self.ngrams[n - 1], self.counts[n - 1],
+                                  read_size)
+            return
+
+        runs = [_iter_rows(_load_run_array(rows_path),
+                           _load_run_array(counts_path), read_size)
+                for rows_path, counts_path in
+                (run[n - 1] for run in self.runs)]
+        runs.append(_iter_rows(self.ngrams[n - 1], self.counts[n - 1],
+                               read_size))
+        current, total = None, 0
+        for row, count in heapq.merge(*runs):
+            if row != current:
+                if current is not None and total > 0:
+                    yield current, total
+                current, total = row, 0
+            total += count
+        if current is not None and total > 0:
+            yield current, total
+
+    def iter_count_chunks(self, n):
+        """Yield (rows of token ids, counts) of all n-grams in sorted order,
+        in chunks of arrays no larger than the memory budget allows.
+        """
+        self.flush()
+        if not self.runs:
+            rows, counts = self.ngrams[n - 1], self.counts[n - 1]
+            chunk_size = max(self.buffer_size, 1)
+            for start in range(0, len(counts), chunk_size):
+                yield (rows[start:start + chunk_size],
+                       counts[start:start + chunk_size])
+            return
+
+        counts = self.iter_counts(n)
+        read_size = self._get_read_size(n)
+        while True:
+            chunk = list(islice(counts, read_size))
+            if not chunk:
+                return
+            yield (np.array([row for row, _ in chunk],
+                            dtype=np.int32).reshape(-1, n),
+                   np.array([count for _, count in chunk], dtype=np.int64))
+
+    def _merge_runs_to_files(self, n):
+        """Merge spilled runs and counts in memory of n-grams into .npy
+        files in the spill directory. Returns their memory-mapped (rows,
+        counts).
+        """
+        num_rows = len(self.counts[n - 1]) + sum(
+            len(_load_run_array(run[n - 1][1])) for run in self.runs)
+        if not num_rows:
+            return (np.empty((0, n), dtype=np.int32),
+                    np.empty(0, dtype=np.int64))
+
+        rows = np.lib.format.open_memmap(
+            self._get_spill_path('merged_n%d_rows.npy' % n), mode='w+',
+            dtype=np.int32, shape=(num_rows, n))
+        counts = np.lib.format.open_memmap(
+            self._get_spill_path('merged_n%d_counts.npy' % n), mode='w+',
+            dtype=np.int64, shape=(num_rows,))
+        end = 0
+        for chunk_rows, chunk_counts in self.iter_count_chunks(n):
+            rows[end:end + len(chunk_counts)] = chunk_rows
+            counts[end:end + len(chunk_counts)] = chunk_counts
+            end += len(chunk_counts)
+        return rows[:end], counts[:end]
+
+    def merge(self, n, rows, counts):
+        """Add counts of n-grams given as rows of token ids."""
+        rows = np.concatenate([self.ngrams[n - 1], rows])
+        counts = np.concatenate([self.counts[n - 1], counts])
+        rows, inverse = np.unique(rows, axis=0, return_inverse=True)
+        self.ngrams[n - 1] = rows
+        self.counts[n - 1] = np.bincount(inverse.ravel(), weights=counts,
+                                         minlength=len(rows)).astype(np.int64)
+
+    def update(self, others):
+        """Add counts of other counters (with their own token ids). Counts
+        of other counters are read in chunks, merging their spilled runs as
+        a stream.
+        """
+        others = list(others)
+        for other in others:
+            if other.max_n != self.max_n:
+                raise ValueError('Cannot merge counts of n-grams up to %d '
+                                 'into counts up to %d.'
+                                 % (other.max_n, self.max_n))
+        self.flush()
+
+        # map token ids of each counter to ids of this counter
+        id_maps = [np.array([self.intern(t) for t in other.tokens],
+                            dtype=np.int32) for other in others]
+
+        # merge chunks of all counters together, up to a buffer of rows at
+        # a time
+        for n in range(1, self.max_n + 1):
+            rows, counts = [], []
+            num_rows = 0
+            for id_map, other in zip(id_maps, others):
+                for other_rows, other_counts in other.iter_count_chunks(n):
+                    rows.append(id_map[other_rows].reshape(-1, n))
+                    counts.append(other_counts)
+                    num_rows += len(other_counts)
+                    if num_rows >= self.buffer_size:
+                        self.merge(n, np.concatenate(rows),
+                                   np.concatenate(counts))
+                        self._check_memory_budget()
+                        rows, counts = [], []
+                        num_rows = 0
+            if rows:
+                self.merge(n, np.concatenate(rows), np.concatenate(counts))
+                self._check_memory_budget()
+
+    def subtract(self, other):
+        """Subtract counts of other counter (e.g. added before with update,
+        for sliding windows), dropping n-grams whose count falls to 0.
+        Counts of spilled runs are subtracted when the runs are merged.
+        """
+        if other.max_n != self.max_n:
+            raise ValueError('Cannot subtract counts of n-grams up to %d '
+                             'from counts up to %d.'
+                             % (other.max_n, self.max_n))
+        self.flush()
+
+        id_map = np.array([self.intern(t) for t in other.tokens],
+                          dtype=np.int32)
+        for n in range(1, self.max_n + 1):
+            for rows, counts in other.iter_count_chunks(n):
+                self.merge(n, id_map[rows].reshape(-1, n), -counts)
+                if not self.runs:
+                    kept = self.counts[n - 1] > 0
+                    self.ngrams[n - 1] = self.ngrams[n - 1][kept]
+                    self.counts[n - 1] = self.counts[n - 1][kept]
+                self._check_memory_budget()
+
+    def save(self, file_path):
+        """Save counts to .npz file (written atomically). Spilled runs are
+        merged into files and written from there, not loaded into memory.
+        """
+        self.flush()
+        token_bytes = [t.encode('utf-8') for t in self.tokens]
+        arrays = {
+            'max_n': np.array(self.max_n),
+            'token_bytes': np.frombuffer(b''.join(token_bytes),
+                                         dtype=np.uint8),
+            'token_offsets': np.cumsum([0] + [len(t) for t in token_bytes]),
+        }
+        for n in range(1, self.max_n + 1):
+            if self.runs:
+                rows, counts = self._merge_runs_to_files(n)
+            else:
+                rows, counts = self.ngrams[n - 1], self.counts[n - 1]
+            arrays['ngrams_%d' % n] = rows
+            arrays['counts_%d' % n] = counts
+
+        tmp_file_path = file_path + '.tmp.npz'
+        _save_npz(tmp_file_path, arrays, self.memory_budget //
+                  _BUFFER_BUDGET_DIVISOR if self.memory_budget else
+                  BUFFER_SIZE)
+        os.replace(tmp_file_path, file_path)
+        if self.runs:
+            del arrays
+            for n in range(1, self.max_n + 1):
+                for name in ['rows', 'counts']:
+                    merged_path = self._get_spill_path(
+                        'merged_n%d_%s.npy' % (n, name))
+                    if os.path.exists(merged_path):
+                        os.remove(merged_path)
+
+    @classmethod
+    def load(cls, file_path, memory_budget=None, spill_dir_path=None):
+        """Load counts saved with save. With a memory budget, the counts
+        are extracted to the spill directory and read from there as a
+        spilled run.
+        """
+        with np.load(file_path) as data:
+            counter = cls(max_n=int(data['max_n']),
+                          memory_budget=memory_budget,
+                          spill_dir_path=spill_dir_path)
+            token_bytes = data['token_bytes'].tobytes()
+            offsets = data['token_offsets'].tolist()
+            counter.tokens = [token_bytes[start:end].decode('utf-8')
+                              for start, end in zip(offsets, offsets[1:])]
+            counter.token_ids = {t: i for i, t in enumerate(counter.tokens)}
+            if not memory_budget:
+                for n in range(1, counter.max_n + 1):
+                    counter.ngrams[n - 1] = data['ngrams_%d' % n]
+                    counter.counts[n - 1] = data['counts_%d' % n]
+                return counter
+
+        # saved counts are sorted, as spilled runs are
+        run = []
+        with zipfile.ZipFile(file_path) as zip_file:
+            for n in range(1, counter.max_n + 1):
+                run_paths = []
+                for name in ['ngrams_%d' % n, 'counts_%d' % n]:
+                    run_path = counter._get_spill_path('run0_%s.npy' % name)
+                    with zip_file.open(name + '.npy') as file_reader, \
+                            open(run_path, 'wb') as file_writer:
+                        shutil.copyfileobj(file_reader, file_writer)
+                    run_paths.append(run_path)
+                run.append(tuple(run_paths))
+        counter.runs.append(run)
+        return counter
+
+    def decode(self, row):
+        """Return text of n-gram given as row of token ids."""
+        return NGRAM_SEPARATOR.join(self.tokens[i] for i in row)
+
+    def most_common(self, n, top_k=None, min_count=1):
+        """Return list of (n-gram text, count) in decreasing order of count,
+        limited to the top_k most frequent n-grams (if given) occurring at
+        least min_count times.
+        """
+        self.flush()
+
+        if self.runs:
+            # stream merged counts of spilled runs through a heap
+            counts = ((row, count) for row, count in self.iter_counts(n)
+                      if count >= min_count)
+            if top_k:
+                top = heapq.nlargest(top_k, counts, key=lambda k: k[1])
+            else:
+                top = sorted(counts, key=lambda k: k[1], reverse=True)
+            return [(self.decode(row), count) for row, count in top]
+
+        counts = self.counts[n - 1]
+        indices = np.nonzero(counts >= min_count)[0]
+        if top_k and top_k < len(indices):
+            # select top_k counts without sorting all of them
+            indices = np.sort(indices[np.argpartition(-counts[indices],
+                                                      top_k - 1)[:top_k]])
+        order = indices[np.argsort(-counts[indices], kind='stable')]
+        rows = self.ngrams[n - 1][order].tolist()
+        return [(self.decode(row), count)
+                for row, count in zip(rows, counts[order].tolist())]
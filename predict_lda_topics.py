@@ -1,10 +1,31 @@
 from argparse import ArgumentParser
+import itertools
+import json
 import os
+import shutil
+import time
 from gensim import corpora
 import csv
 import pickle
-import spacy
-import json
+from tweet_reader import iter_tweet_texts, is_tweet_file, iter_in_background
+from tokenization import tokenize_texts, normalize_text
+from fast_tokenizer import load_fast_tokenizer
+from token_cache import open_token_cache
+from topic_inference import (iter_topic_matrices, get_top_topics,
+                             iter_chunks, get_name_seed)
+from corpus_store import CorpusStore, META_FILE_NAME
+from lda_backends import BACKENDS
+from dedup import (add_dedup_arguments, collapse_duplicates,
+                   DuplicateCollapser)
+from topic_client import TopicClient, add_server_arguments
+from manifest import Manifest, get_output_fingerprint, get_file_fingerprint
+from metrics import add_metrics_arguments, open_metrics
+
+# suffix of checkpoint file of --stream runs, next to the output file
+CHECKPOINT_SUFFIX = '.checkpoint.json'
+
+# number of chunks each --stream stage may run ahead of the next one
+PIPELINE_DEPTH = 2
 
 
 def parse_arguments():
@@ -12,17 +33,30 @@ def parse_arguments():
                             'input directory using trained LDA model.')
     parser.add_argument('--input_dir_path', '-i', type=str,
                         help='Path to input directory containing JSON files '
-                        'with tweets.')
+                        'with tweets. '
+                        'Files may be line-delimited (.jsonl, .ndjson) and '
+                        'compressed (.gz, .bz2, .zst).')
     parser.add_argument('--mallet_path', '-m', type=str,
                         help='Path to mallet directory (download from '
                         'http://mallet.cs.umass.edu/dist/mallet-2.0.8.zip).')
     parser.add_argument('--output_file_path', '-o', type=str, required=True,
                         help='Path to output CSV file with top topics '
                         'for each tweet in input directory.')
-    parser.add_argument('--model_file_path', type=str, required=True,
-                        help='Path to trained LDA model file')
-    parser.add_argument('--lda_mallet_prefix', type=str, required=True,
-                        help='Prefix for LDA Mallet model.')
+    parser.add_argument('--model_file_path', type=str,
+                        help='Path to trained LDA model file (required '
+                        'unless --server_url is given).')
+    parser.add_argument('--backend', type=str, choices=BACKENDS,
+                        default='mallet',
+                        help='LDA backend the model was trained with by '
+                        'train_lda_topics.py: mallet or multicore. Defaults '
+                        'to mallet.')
+    parser.add_argument('--lda_mallet_prefix', type=str,
+                        help='Prefix for LDA Mallet model (required with the '
+                        'mallet backend).')
+    parser.add_argument('--dictionary_path', type=str,
+                        help='Path to dictionary saved by train_lda_topics.py '
+                        '(lda_dictionary.dict). Defaults to the dictionary '
+                        'stored in the LDA model.')
     parser.add_argument('--num_top_topics', type=int, default=3,
                         help='Number of top topics to output for each entry.'
                         ' Defaults to 3.')
@@ -30,81 +64,486 @@ def parse_arguments():
                         default='en_core_web_sm',
                         help='Name of spacy model to use.'
                         )
-    return parser.parse_args()
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='Number of tweets per spacy batch. Defaults to '
+                        '1000.')
+    parser.add_argument('--n_process', type=int, default=1,
+                        help='Number of processes for spacy tokenization. '
+                        'Defaults to 1.')
+    parser.add_argument('--token_cache_path', type=str,
+                        help='Path to SQLite token cache file. Tweets found '
+                        'in the cache are not tokenized again.')
+    parser.add_argument('--tokenizer', type=str, choices=['spacy', 'fast'],
+                        default='spacy',
+                        help='Tokenizer for lemmas: spacy (model given by '
+                        '--spacy_model) or fast (rule-based, with spacy '
+                        'stopwords and the lemma table given by '
+                        '--lemma_table_path; the token cache is not used). '
+                        'Use the same tokenizer for training and '
+                        'prediction. Defaults to spacy.')
+    parser.add_argument('--lemma_table_path', type=str,
+                        help='Path to JSON lemma lookup table of the fast '
+                        'tokenizer (written by compare_tokenizers.py).')
+    parser.add_argument('--chunk_size', type=int, default=100000,
+                        help='Number of tweets scored per inference call. '
+                        'Defaults to 100000.')
+    parser.add_argument('--corpus_store_path', type=str,
+                        help='Path to corpus store written by '
+                        'export_tweets_json_to_csv.py. Tweets and lemmas '
+                        'are read from the store instead of the input '
+                        'directory; the store must be exported with the same '
+                        '--tokenizer and --spacy_model (or '
+                        '--lemma_table_path).')
+    parser.add_argument('--manifest_path', type=str,
+                        help='Path to manifest of JSON files already '
+                        'predicted. Only new or changed files are predicted '
+                        'again, and the output file is rebuilt from the '
+                        'stored predictions of each file (in a .parts '
+                        'directory next to the output file). Defaults to '
+                        'the output file path with .manifest.json appended.')
+    parser.add_argument('--force', action='store_true',
+                        help='Predict all files again, ignoring the '
+                        'manifest and stored predictions.')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read, tokenize, score and write tweets in '
+                        'chunks of --stream_chunk_size, each stage running '
+                        'in its own thread at most a few chunks ahead of the '
+                        'next, so memory does not grow with the input. The '
+                        'output file is written directly (without the '
+                        'manifest and stored predictions), and an '
+                        'interrupted run resumes after the last chunk '
+                        'written unless --force is given.')
+    parser.add_argument('--stream_chunk_size', type=int, default=10000,
+                        help='Number of tweets per chunk with --stream. '
+                        'Duplicates are collapsed within each chunk. '
+                        'Defaults to 10000.')
+    add_dedup_arguments(parser)
+    add_server_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    if not args.server_url and not args.model_file_path:
+        parser.error('--model_file_path is required without --server_url.')
+    if not args.server_url and args.backend == 'mallet' and \
+            not args.lda_mallet_prefix:
+        parser.error('--lda_mallet_prefix is required with the mallet '
+                     'backend.')
+    return args
 
 
-if __name__ == '__main__':
+def get_header_row(num_top_topics):
+    """Return header row with topic IDs and scores."""
+    header_row = ['tweet']
+    for t in range(num_top_topics):
+        header_row.extend(['topic_' + str(t+1),
+                           'topic_' + str(t+1) + '_score'])
+    return header_row
+
+
+def iter_top_topics(ldamodel, dictionary, tweet_docs, args, metrics,
+                    seed=None):
+    """Yield (top topic ids, top topic scores) of each tokenized tweet. If
+    seed is given, inference is seeded from it (see iter_topic_matrices).
+    """
+    # time spent tokenizing is recorded separately from scoring
+    tweet_docs = metrics.iter_counted(
+        metrics.iter_timed(tweet_docs, 'tokenization'), 'documents_scored',
+        'tokens_kept')
+
+    # score tweets in chunks, converted through the dictionary into
+    # array-backed document-term matrices, and get top topics of each tweet
+    # in the chunk from its document-topic matrix
+    for topic_matrix in iter_topic_matrices(ldamodel, tweet_docs,
+                                            args.chunk_size, dictionary,
+                                            seed):
+        top_ids, top_scores = get_top_topics(topic_matrix,
+                                             args.num_top_topics)
+        yield from zip(top_ids.tolist(), top_scores.tolist())
+
+
+def write_predictions(csv_writer, tweet_texts, top_topics,
+                      unique_ids=None):
+    """Write row with top topics of each tweet, and return the number of
+    rows. If unique_ids are given, top_topics are those of unique texts,
+    and each tweet gets the top topics of its unique text.
+    """
+    if unique_ids is not None:
+        unique_top_topics = list(top_topics)
+        top_topics = (unique_top_topics[u] for u in unique_ids)
+
+    num_rows = 0
+    for tweet_text, (topic_nums, topic_scores) in zip(tweet_texts,
+                                                      top_topics):
+        output_row = [tweet_text]
+        for topic_num, topic_score in zip(topic_nums, topic_scores):
+            output_row.extend([topic_num, format(topic_score, '.2f')])
+
+        csv_writer.writerow(output_row)
+        num_rows += 1
+    return num_rows
+
+
+def predict_file(input_file_path, part_file_path, score_texts, args,
+                 metrics):
+    """Write rows with top topics of tweets in JSON file to part file
+    (without header), scored with score_texts. Inference is seeded from the
+    file name, so rows of a file do not depend on the files predicted
+    before it.
+    """
+    start_time = time.perf_counter()
+
+    # stream tweets from json file, so that only a chunk of them is held
+    # while it is tokenized and scored
+    tweet_texts = iter_tweet_texts(input_file_path)
+    if args.dedup == 'none':
+        tweet_texts, unique_texts = itertools.tee(tweet_texts)
+        unique_ids = None
+    else:
+        # tokenize and score each unique text once: duplicates are
+        # collapsed in a first pass over the file, and each tweet is looked
+        # up in a second pass as it is written
+        collapser = DuplicateCollapser(
+            normalize_text, args.near_duplicate_threshold
+            if args.dedup == 'near' else None)
+        with metrics.stage('dedup'):
+            for tweet_text in tweet_texts:
+                collapser.add(tweet_text)
+        unique_texts = collapser.unique_texts
+        tweet_texts, id_texts = itertools.tee(
+            iter_tweet_texts(input_file_path))
+        unique_ids = map(collapser.get_id, id_texts)
+
+    seed = get_name_seed(os.path.basename(input_file_path))
+    tmp_part_file_path = part_file_path + '.tmp'
+    with open(tmp_part_file_path, 'w', encoding='utf-8',
+              errors='ignore') as file_writer:
+        with metrics.stage('predict'):
+            num_tweets = write_predictions(
+                csv.writer(file_writer), tweet_texts,
+                score_texts(unique_texts, seed), unique_ids)
+    os.replace(tmp_part_file_path, part_file_path)
+    metrics.count('tweets_read', num_tweets)
+
+    metrics.add_file(input_file_path, num_tweets,
+                     time.perf_counter() - start_time)
+
+
+def list_input_files(input_dir_path):
+    """Return (names, paths) of (possibly compressed) JSON and JSONL files
+    in input directory, in sorted order so that output rows are
+    deterministic.
+    """
+    input_file_names = sorted(f for f in os.listdir(input_dir_path)
+                              if is_tweet_file(f))
+    return input_file_names, [os.path.join(input_dir_path, f)
+                              for f in input_file_names]
 
-    args = parse_arguments()
 
+def iter_stream_chunks(input_file_paths, corpus_store, with_docs, args,
+                       skip=0):
+    """Yield (row of first tweet, tweet texts, lemma lists or None) of each
+    chunk of args.stream_chunk_size consecutive tweets of input files (or
+    of the corpus store, with lemmas if with_docs), after the first skip
+    tweets.
+    """
+    chunk_size = args.stream_chunk_size
+    if corpus_store is not None:
+        for start in range(skip, len(corpus_store), chunk_size):
+            stop = min(start + chunk_size, len(corpus_store))
+            yield (start, list(corpus_store.iter_texts(start, stop)),
+                   list(corpus_store.iter_lemmas(start, stop))
+                   if with_docs else None)
+        return
+
+    tweet_texts = itertools.islice(itertools.chain.from_iterable(
+        iter_tweet_texts(f) for f in input_file_paths), skip, None)
+    start = skip
+    for chunk in iter_chunks(tweet_texts, chunk_size):
+        yield start, chunk, None
+        start += len(chunk)
+
+
+def predict_chunk(start, tweet_texts, tweet_docs, score_texts, score_docs,
+                  args, metrics):
+    """Return list of (top topic ids, top topic scores) of each tweet of a
+    chunk starting at row start, scored from its lemmas with score_docs if
+    given, and otherwise from its text with score_texts. Duplicates are
+    scored once. Inference is seeded from start, so that a resumed run
+    scores the chunk as the uninterrupted run did.
+    """
+    if tweet_docs is not None:
+        items, normalize, score_items = tweet_docs, '\n'.join, score_docs
+    else:
+        items, normalize, score_items = tweet_texts, normalize_text, \
+            score_texts
+
+    unique_ids = None
+    if args.dedup != 'none':
+        with metrics.stage('dedup'):
+            items, _, unique_ids = collapse_duplicates(
+                items, args.dedup, args.near_duplicate_threshold, normalize)
+    with metrics.stage('score'):
+        top_topics = list(score_items(items, start))
+    if unique_ids is not None:
+        top_topics = [top_topics[u] for u in unique_ids]
+    return top_topics
+
+
+def read_checkpoint(checkpoint_path, fingerprint):
+    """Return checkpoint of interrupted --stream run with the same inputs
+    and settings, or None.
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, 'r', encoding='utf-8') as file_reader:
+        checkpoint = json.load(file_reader)
+    if checkpoint['fingerprint'] != fingerprint:
+        return None
+    return checkpoint
+
+
+def write_checkpoint(checkpoint_path, fingerprint, tweets_written,
+                     output_size):
+    """Record number of tweets and bytes written to the output file so
+    far (written atomically).
+    """
+    tmp_checkpoint_path = checkpoint_path + '.tmp'
+    with open(tmp_checkpoint_path, 'w', encoding='utf-8') as file_writer:
+        json.dump({'fingerprint': fingerprint,
+                   'tweets_written': tweets_written,
+                   'output_size': output_size}, file_writer)
+    os.replace(tmp_checkpoint_path, checkpoint_path)
+
+
+def predict_stream(input_file_paths, corpus_store, score_texts, score_docs,
+                   fingerprint, args, metrics):
+    """Write rows with top topics of all tweets to the output file, chunk by
+    chunk, with reading, scoring and writing pipelined over bounded queues.
+    After each chunk the output is synced and a checkpoint written, so that
+    a run with the same fingerprint resumes after the last chunk written.
+    """
+    checkpoint_path = args.output_file_path + CHECKPOINT_SUFFIX
+    checkpoint = None
+    if not args.force and os.path.exists(args.output_file_path):
+        checkpoint = read_checkpoint(checkpoint_path, fingerprint)
+
+    if checkpoint is not None:
+        # drop rows written after the last checkpoint
+        file_writer = open(args.output_file_path, 'r+', encoding='utf-8',
+                           errors='ignore')
+        file_writer.truncate(checkpoint['output_size'])
+        file_writer.seek(0, os.SEEK_END)
+        tweets_written = checkpoint['tweets_written']
+        print('Resuming after %d tweets' % tweets_written)
+    else:
+        file_writer = open(args.output_file_path, 'w', encoding='utf-8',
+                           errors='ignore')
+        csv.writer(file_writer).writerow(get_header_row(args.num_top_topics))
+        tweets_written = 0
+    csv_writer = csv.writer(file_writer)
+
+    # chunks are read in one thread and scored in another, each blocking
+    # when PIPELINE_DEPTH chunks are waiting for the next stage
+    chunks = iter_in_background(
+        iter_stream_chunks(input_file_paths, corpus_store,
+                           score_docs is not None, args, tweets_written),
+        batch_size=1, max_batches=PIPELINE_DEPTH)
+    scored_chunks = iter_in_background(
+        ((tweet_texts, predict_chunk(start, tweet_texts, tweet_docs,
+                                     score_texts, score_docs, args, metrics))
+         for start, tweet_texts, tweet_docs in chunks),
+        batch_size=1, max_batches=PIPELINE_DEPTH)
+
+    with file_writer:
+        for tweet_texts, top_topics in scored_chunks:
+            with metrics.stage('write'):
+                write_predictions(csv_writer, tweet_texts, top_topics)
+                file_writer.flush()
+                os.fsync(file_writer.fileno())
+                tweets_written += len(tweet_texts)
+                write_checkpoint(checkpoint_path, fingerprint, tweets_written,
+                                 os.fstat(file_writer.fileno()).st_size)
+            metrics.count('tweets_read', len(tweet_texts))
+            metrics.count('chunks_written')
+            print('Wrote %d tweets' % tweets_written)
+
+    # the run is complete
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def load_model(args):
+    """Return (LDA model, dictionary) for command line arguments."""
     with open(args.model_file_path, 'rb') as pickle_reader:
         ldamodel = pickle.load(pickle_reader)
+    if args.backend == 'mallet':
+        # Mallet models are scored by Java through files under the prefix
         ldamodel.prefix = args.lda_mallet_prefix
 
-    # load spacy nlp module
-    nlp = spacy.load(args.spacy_model)
+    # load id <-> term dictionary used to train the model
+    if args.dictionary_path:
+        dictionary = corpora.Dictionary.load(args.dictionary_path)
+    else:
+        dictionary = ldamodel.id2word
+    return ldamodel, dictionary
 
-    tweet_texts = []
-    tweet_docs = []
-    # iterate over each subdir in input_subdir_paths
-    for input_file_name in os.listdir(args.input_dir_path):
 
-        # only read JSON files
-        if not input_file_name.endswith('.json'):
-            continue
+if __name__ == '__main__':
 
-        print('Processing file: %s' % input_file_name)
+    args = parse_arguments()
+    metrics = open_metrics(args)
 
-        input_file_path = os.path.join(args.input_dir_path, input_file_name)
+    if args.server_url:
+        # score tweets with the model and tokenizer of a running server
+        client = TopicClient(args.server_url)
+        model_fingerprint = client.get_info()['fingerprint']
 
-        # load data from json file
-        with open(input_file_path, 'r') as file_reader:
-            data = json.load(file_reader)
+        def score_texts(tweet_texts, seed=None):
+            # the server scores micro-batches with its own random state
+            return client.iter_top_topics(
+                metrics.iter_counted(tweet_texts, 'documents_scored'),
+                args.num_top_topics)
 
-        # iterate over each tweet in json, and form ngram frequency dictionary
-        for tweet in data['results']:
-            if 'extended_tweet' in tweet:
-                tweet_text = tweet['extended_tweet']['full_text']
-            else:
-                tweet_text = tweet['text']
+        # the server tokenizes texts itself, so lemmas are not scored
+        score_docs = None
+    else:
+        ldamodel, dictionary = load_model(args)
+        model_fingerprint = [
+            get_file_fingerprint(args.model_file_path),
+            get_file_fingerprint(args.dictionary_path), args.spacy_model,
+            args.tokenizer, get_file_fingerprint(args.lemma_table_path)]
 
-            tweet_texts.append(tweet_text)
+        # open token cache (if any); spacy model is loaded only for tweets
+        # missing from the cache
+        token_cache = open_token_cache(args.token_cache_path,
+                                       args.spacy_model)
+        fast_tokenizer = load_fast_tokenizer(args.lemma_table_path) \
+            if args.tokenizer == 'fast' else None
 
-            doc = nlp(tweet_text.lower().strip())
+        def score_texts(tweet_texts, seed=None):
+            # tokenize tweets in batches, and score them in chunks
+            tweet_docs = tokenize_texts(args.spacy_model, tweet_texts,
+                                        batch_size=args.batch_size,
+                                        n_process=args.n_process,
+                                        token_cache=token_cache,
+                                        fast_tokenizer=fast_tokenizer)
+            return iter_top_topics(ldamodel, dictionary, tweet_docs, args,
+                                   metrics, seed)
 
-            tweet_tokens = [token.lemma_ for token in doc
-                            if not token.is_stop and
-                            not token.is_punct and
-                            not token.is_space]
+        def score_docs(tweet_docs, seed=None):
+            # score lemmas of the corpus store in chunks
+            return iter_top_topics(ldamodel, dictionary, tweet_docs, args,
+                                   metrics, seed)
 
-            tweet_docs.append(tweet_tokens)
+    if args.stream:
+        # tweets of the corpus store (scored from their lemmas, unless by
+        # the server) or of the input directory, in chunks
+        corpus_store = None
+        input_file_paths = []
+        if args.corpus_store_path:
+            corpus_store = CorpusStore(args.corpus_store_path)
+            if not args.server_url:
+                corpus_store.check_model_key(args.spacy_model,
+                                             args.tokenizer,
+                                             args.lemma_table_path)
+            input_fingerprint = get_file_fingerprint(os.path.join(
+                args.corpus_store_path, META_FILE_NAME))
+        else:
+            input_file_names, input_file_paths = list_input_files(
+                args.input_dir_path)
+            input_fingerprint = [[f, get_file_fingerprint(p)] for f, p in
+                                 zip(input_file_names, input_file_paths)]
 
-    # turn our tokenized documents into a id <-> term dictionary
-    dictionary = corpora.Dictionary(tweet_docs)
+        predict_stream(input_file_paths, corpus_store, score_texts,
+                       score_docs if corpus_store is not None else None,
+                       get_output_fingerprint(
+                           model_fingerprint, input_fingerprint,
+                           args.num_top_topics, args.stream_chunk_size,
+                           args.dedup, args.near_duplicate_threshold
+                           if args.dedup == 'near' else None),
+                       args, metrics)
+    elif args.corpus_store_path:
+        # tweets and their lemmas from the memory-mapped corpus store
+        corpus_store = CorpusStore(args.corpus_store_path)
+        if not args.server_url:
+            corpus_store.check_model_key(args.spacy_model, args.tokenizer,
+                                         args.lemma_table_path)
+        tweet_texts = list(corpus_store.iter_texts())
+        metrics.count('tweets_read', len(tweet_texts))
 
-    # convert tokenized documents into a document-term matrix
-    corpus = [dictionary.doc2bow(doc) for doc in tweet_docs]
+        if args.server_url:
+            # the server tokenizes the texts, with duplicates collapsed
+            unique_texts, unique_ids = tweet_texts, None
+            if args.dedup != 'none':
+                with metrics.stage('dedup'):
+                    unique_texts, _, unique_ids = collapse_duplicates(
+                        tweet_texts, args.dedup,
+                        args.near_duplicate_threshold, normalize_text)
+            top_topics = score_texts(unique_texts)
+        else:
+            # collapse tweets with the same lemmas
+            tweet_docs, unique_ids = corpus_store.iter_lemmas(), None
+            if args.dedup != 'none':
+                with metrics.stage('dedup'):
+                    tweet_docs, _, unique_ids = collapse_duplicates(
+                        tweet_docs, args.dedup,
+                        args.near_duplicate_threshold, '\n'.join)
+            top_topics = score_docs(tweet_docs)
 
-    with open(args.output_file_path, 'w', encoding='utf-8',
-              errors='ignore') as file_writer:
+        with open(args.output_file_path, 'w', encoding='utf-8',
+                  errors='ignore') as file_writer:
+            csv_writer = csv.writer(file_writer)
+            csv_writer.writerow(get_header_row(args.num_top_topics))
+            with metrics.stage('predict'):
+                write_predictions(csv_writer, tweet_texts, top_topics,
+                                  unique_ids)
+    else:
+        input_file_names, input_file_paths = list_input_files(
+            args.input_dir_path)
+
+        # predictions of each file are kept in a part file, and only
+        # predicted again if the file or the model changed
+        parts_dir_path = args.output_file_path + '.parts'
+        if not os.path.isdir(parts_dir_path):
+            os.makedirs(parts_dir_path)
+        part_file_paths = [os.path.join(parts_dir_path, f + '.csv')
+                           for f in input_file_names]
+        manifest = Manifest(
+            args.manifest_path or args.output_file_path + '.manifest.json',
+            get_output_fingerprint(
+                model_fingerprint, args.num_top_topics, args.dedup,
+                args.near_duplicate_threshold
+                if args.dedup == 'near' else None),
+            force=args.force)
 
-        csv_writer = csv.writer(file_writer)
+        for input_file_path, part_file_path in zip(input_file_paths,
+                                                   part_file_paths):
+            if os.path.exists(part_file_path) and \
+                    manifest.is_current(input_file_path):
+                metrics.count('files_skipped')
+                continue
 
-        header_row = ['tweet']
+            print('Processing file: %s' % input_file_path)
 
-        # write header with topic IDs and scores
-        for t in range(args.num_top_topics):
-            header_row.extend(['topic_' + str(t+1),
-                               'topic_' + str(t+1) + '_score'])
-        csv_writer.writerow(header_row)
+            predict_file(input_file_path, part_file_path, score_texts,
+                         args, metrics)
+            manifest.update(input_file_path)
 
-        for i, topic_row in enumerate(ldamodel[corpus]):
-            topic_row = sorted(topic_row, key=lambda x: (x[1]),
-                               reverse=True)
+        # drop predictions of files no longer in the input directory
+        for input_file_path in manifest.remove_missing(input_file_paths):
+            part_file_path = os.path.join(
+                parts_dir_path, os.path.basename(input_file_path) + '.csv')
+            if os.path.exists(part_file_path):
+                os.remove(part_file_path)
+        manifest.save()
 
-            output_row = [tweet_texts[i]]
-            for t in range(args.num_top_topics):
-                topic_num, topic_score = topic_row[t]
-                output_row.extend([topic_num, format(topic_score, '.2f')])
+        # merge predictions of all files into the output file
+        with open(args.output_file_path, 'w', encoding='utf-8',
+                  errors='ignore') as file_writer:
+            csv.writer(file_writer).writerow(
+                get_header_row(args.num_top_topics))
+            for part_file_path in part_file_paths:
+                with open(part_file_path, 'r', encoding='utf-8',
+                          newline='') as file_reader:
+                    shutil.copyfileobj(file_reader, file_writer)
 
-            csv_writer.writerow(output_row)
+    metrics.close()
@@ -0,0 +1,279 @@
+"""Benchmark the stages of the tweet analysis scripts on a synthetic (or
+given) tweet corpus, and write timings as JSON.
+
+Stages are run in pipeline order on the same tweets: JSON load, spacy
+tokenization, Dictionary/doc2bow, LDA training (only to get a model if none
+is given; with gensim LdaModel, LdaMulticore or Mallet), LDA inference,
+n-gram counting and tf-idf. Each stage records seconds, tweets per second
+and peak RSS of the process after the stage.
+"""
+from argparse import ArgumentParser
+import json
+import os
+import platform
+import tempfile
+import time
+from gensim import corpora
+from gensim.models.ldamodel import LdaModel
+from sklearn.feature_extraction.text import TfidfVectorizer
+from tweet_reader import iter_tweet_texts, list_json_files
+from tokenization import tokenize_texts, load_nlp
+from topic_inference import count_dominant_topics
+from bow_corpus import BowCorpus
+from ngram_counter import NGramCounter
+from get_ngram_frequencies import count_ngrams
+from generate_synthetic_tweets import generate_tweet_files
+from metrics import get_peak_rss_mb
+from lda_backends import BACKENDS, train_lda_model
+
+STAGES = ['json_load', 'tokenization', 'dictionary', 'lda_training',
+          'lda_inference', 'ngram_counting', 'tfidf']
+
+
+def parse_arguments():
+    parser = ArgumentParser('Benchmark the stages of the tweet analysis '
+                            'scripts, and write timings as JSON.')
+    parser.add_argument('--input_dir_path', '-i', type=str,
+                        help='Path to input directory containing JSON files '
+                        'with tweets. Defaults to a generated synthetic '
+                        'corpus.')
+    parser.add_argument('--output_file_path', '-o', type=str, required=True,
+                        help='Path to output JSON file with benchmark '
+                        'results.')
+    parser.add_argument('--compare_path', type=str,
+                        help='Path to results of an earlier run to compare '
+                        'stage timings with.')
+    parser.add_argument('--num_files', type=int, default=4,
+                        help='Number of synthetic JSON files. Defaults to 4.')
+    parser.add_argument('--tweets_per_file', type=int, default=5000,
+                        help='Number of tweets per synthetic file. Defaults '
+                        'to 5000.')
+    parser.add_argument('--extended_fraction', type=float, default=0.3,
+                        help='Fraction of synthetic tweets with an extended '
+                        'tweet. Defaults to 0.3.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed of synthetic corpus. Defaults to '
+                        '0.')
+    parser.add_argument('--spacy_model', '-s', type=str,
+                        default='en_core_web_sm',
+                        help='Name of spacy model to use.')
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='Number of tweets per spacy batch. Defaults to '
+                        '1000.')
+    parser.add_argument('--n_process', type=int, default=1,
+                        help='Number of processes for spacy tokenization. '
+                        'Defaults to 1.')
+    parser.add_argument('--model_path', '-m', type=str,
+                        help='Path to trained LDA model file for inference. '
+                        'Defaults to a model trained on the corpus.')
+    parser.add_argument('--num_topics', type=int, default=10,
+                        help='Number of topics of the model trained on the '
+                        'corpus. Defaults to 10.')
+    parser.add_argument('--lda_backend', type=str,
+                        choices=['single'] + BACKENDS, default='single',
+                        help='Backend of the lda_training stage: single '
+                        '(gensim LdaModel), or a backend of '
+                        'train_lda_topics.py (mallet or multicore); run '
+                        'once per backend and compare with --compare_path. '
+                        'Defaults to single.')
+    parser.add_argument('--mallet_path', type=str,
+                        help='Path to mallet directory for the mallet '
+                        'backend.')
+    parser.add_argument('--lda_workers', type=int, default=4,
+                        help='Number of Mallet threads or LdaMulticore '
+                        'worker processes. Defaults to 4.')
+    parser.add_argument('--chunk_size', type=int, default=100000,
+                        help='Number of tweets scored per inference call. '
+                        'Defaults to 100000.')
+    parser.add_argument('--max_n', type=int, default=3,
+                        help='Max length of n-grams to count. Defaults to 3.')
+    parser.add_argument('--stages', type=str, default=','.join(STAGES),
+                        help='Comma-separated stages to run (later stages '
+                        'need the output of earlier ones). Defaults to all '
+                        'stages: ' + ', '.join(STAGES) + '.')
+    return parser.parse_args()
+
+
+class StageTimer:
+    """Records seconds and peak RSS of each benchmark stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, stage_name, function, *args, **kwargs):
+        """Return result of function(*args, **kwargs), timed as stage."""
+        print('Running stage: %s' % stage_name)
+        start_time = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start_time
+
+        self.stages[stage_name] = {
+            'seconds': seconds,
+            'peak_rss_mb': get_peak_rss_mb(),
+        }
+        print('Finished stage: %s (%.2fs)' % (stage_name, seconds))
+        return result
+
+
+def load_texts(input_file_paths):
+    """Return texts of tweets of each input file."""
+    return [list(iter_tweet_texts(f)) for f in input_file_paths]
+
+
+def build_corpus(tweet_docs):
+    dictionary = corpora.Dictionary(tweet_docs)
+    return dictionary, BowCorpus.from_docs(dictionary, tweet_docs)
+
+
+def count_all_ngrams(spacy_model, tweet_texts, max_n, batch_size):
+    ngram_counter = NGramCounter(max_n=max_n)
+    count_ngrams(load_nlp(spacy_model),
+                 (tweet_text.strip() for tweet_text in tweet_texts),
+                 ngram_counter, batch_size)
+    for n in range(1, max_n + 1):
+        ngram_counter.most_common(n)
+    return ngram_counter
+
+
+def compute_tfidf(file_texts):
+    """Return tf-idf matrix with each input file as one document, as in
+    get_tfidf_keywords.py.
+    """
+    tweet_analyzer = TfidfVectorizer().build_analyzer()
+
+    def analyze_file(i):
+        for tweet_text in file_texts[i]:
+            yield from tweet_analyzer(tweet_text)
+
+    vectorizer = TfidfVectorizer(analyzer=analyze_file)
+    return vectorizer.fit_transform(range(len(file_texts)))
+
+
+def get_versions():
+    """Return versions of python and of the main libraries."""
+    import gensim
+    import numpy
+    import sklearn
+    import spacy
+    return {'python': platform.python_version(), 'numpy': numpy.__version__,
+            'gensim': gensim.__version__, 'spacy': spacy.__version__,
+            'sklearn': sklearn.__version__}
+
+
+def print_comparison(results, previous_results):
+    """Print speedup of each stage over an earlier run."""
+    print('Stage              before     after   speedup')
+    for stage_name, stage in results['stages'].items():
+        previous_stage = previous_results['stages'].get(stage_name)
+        if not previous_stage:
+            continue
+        print('%-15s %8.2fs %8.2fs %8.2fx'
+              % (stage_name, previous_stage['seconds'], stage['seconds'],
+                 previous_stage['seconds'] / max(stage['seconds'], 1e-9)))
+
+
+def run_benchmarks(input_file_paths, args, tmp_dir_path):
+    """Run stages on tweets of input files (with temporary files in
+    tmp_dir_path), and return results.
+    """
+    stages = set(args.stages.split(','))
+    timer = StageTimer()
+
+    file_texts = timer.run('json_load', load_texts, input_file_paths)
+    tweet_texts = [t for texts in file_texts for t in texts]
+
+    tweet_docs = None
+    corpus_memory = None
+    if stages & {'tokenization', 'dictionary', 'lda_training',
+                 'lda_inference'}:
+        tweet_docs = timer.run('tokenization', lambda: list(tokenize_texts(
+            args.spacy_model, tweet_texts, batch_size=args.batch_size,
+            n_process=args.n_process)))
+
+    if stages & {'dictionary', 'lda_training', 'lda_inference'}:
+        dictionary, corpus = timer.run('dictionary', build_corpus,
+                                       tweet_docs)
+
+        if args.model_path:
+            ldamodel = LdaModel.load(args.model_path)
+            corpus = BowCorpus.from_docs(ldamodel.id2word, tweet_docs)
+        elif stages & {'lda_training', 'lda_inference'} and \
+                args.lda_backend == 'single':
+            ldamodel = timer.run('lda_training', LdaModel, corpus,
+                                 num_topics=args.num_topics,
+                                 id2word=dictionary, random_state=args.seed)
+        elif stages & {'lda_training', 'lda_inference'}:
+            ldamodel = timer.run(
+                'lda_training', train_lda_model, args.lda_backend, corpus,
+                dictionary, args.num_topics, args.lda_workers,
+                mallet_path=args.mallet_path,
+                prefix=os.path.join(tmp_dir_path, 'mallet_'),
+                random_state=args.seed)
+
+        # memory of the array-backed corpus and of the same corpus as
+        # lists of tuples
+        corpus_memory = {
+            'num_documents': len(corpus),
+            'num_entries': corpus.num_nonzero,
+            'array_mb': corpus.nbytes / 2 ** 20,
+            'list_mb_estimate': corpus.get_list_nbytes() / 2 ** 20,
+        }
+
+        if 'lda_inference' in stages:
+            timer.run('lda_inference', count_dominant_topics, ldamodel,
+                      corpus, args.chunk_size)
+
+    if 'ngram_counting' in stages:
+        timer.run('ngram_counting', count_all_ngrams, args.spacy_model,
+                  tweet_texts, args.max_n, args.batch_size)
+
+    if 'tfidf' in stages:
+        timer.run('tfidf', compute_tfidf, file_texts)
+
+    for stage in timer.stages.values():
+        stage['tweets_per_sec'] = len(tweet_texts) / stage['seconds'] \
+            if stage['seconds'] else None
+
+    return {
+        'config': {k: v for k, v in vars(args).items()
+                   if k not in ('output_file_path', 'compare_path')},
+        'num_files': len(input_file_paths),
+        'num_tweets': len(tweet_texts),
+        'versions': get_versions(),
+        'stages': timer.stages,
+        'corpus_memory': corpus_memory,
+        'total_seconds': sum(s['seconds'] for s in timer.stages.values()),
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        if args.input_dir_path:
+            input_file_paths = sorted(list_json_files(args.input_dir_path))
+        else:
+            print('Generating %d files of %d synthetic tweets'
+                  % (args.num_files, args.tweets_per_file))
+            input_file_paths = generate_tweet_files(
+                tmp_dir_path, args.num_files, args.tweets_per_file,
+                extended_fraction=args.extended_fraction, seed=args.seed)
+
+        results = run_benchmarks(input_file_paths, args, tmp_dir_path)
+
+    with open(args.output_file_path, 'w') as file_writer:
+        json.dump(results, file_writer, indent=1)
+
+    for stage_name, stage in results['stages'].items():
+        print('%-15s %8.2fs %10.0f tweets/s %8.1f MB'
+              % (stage_name, stage['seconds'], stage['tweets_per_sec'] or 0,
+                 stage['peak_rss_mb']))
+
+    if results['corpus_memory']:
+        print('Corpus: %(array_mb).1f MB in arrays, %(list_mb_estimate).1f '
+              'MB as lists (estimated)' % results['corpus_memory'])
+
+    if args.compare_path:
+        with open(args.compare_path, 'r') as file_reader:
+            print_comparison(results, json.load(file_reader))
@@ -0,0 +1,199 @@
+"""Persistent per-bucket term counts for incremental tf-idf.
+
+Each bucket (e.g. one week of tweets) is stored as one row of term counts
+with a vocabulary shared by all buckets. Adding a bucket only counts its
+own tweets, and tf-idf scores of all buckets are recomputed from the stored
+counts, the same way as TfidfVectorizer with default settings. The input
+files each bucket was counted from are stored with it, so a bucket whose
+files changed can be counted again and its row replaced.
+"""
+from collections import Counter
+import json
+import os
+import numpy as np
+import scipy.sparse as sp
+
+BUCKETS_FILE_NAME = 'buckets.json'
+BUCKET_FILES_FILE_NAME = 'bucket_files.json'
+VOCABULARY_FILE_NAME = 'vocabulary.json'
+COUNTS_FILE_NAME = 'counts.npz'
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+class TfidfStore:
+    """Term counts of named buckets over a shared vocabulary."""
+
+    def __init__(self):
+        self.bucket_names = []
+        self.bucket_files = {}
+        self.terms = []
+        self.term_ids = {}
+        self.counts = sp.csr_matrix((0, 0), dtype=np.int64)
+
+    def __contains__(self, bucket_name):
+        return bucket_name in self.bucket_names
+
+    def _count_row(self, terms):
+        """Return 1-row CSR matrix of counts of terms (an iterable of
+        tokens), adding new terms to the vocabulary.
+        """
+        term_counts = Counter(terms)
+        for term in term_counts:
+            if term not in self.term_ids:
+                self.term_ids[term] = len(self.terms)
+                self.terms.append(term)
+
+        indices = np.array([self.term_ids[t] for t in term_counts],
+                           dtype=np.int64)
+        data = np.array(list(term_counts.values()), dtype=np.int64)
+        self.counts.resize((self.counts.shape[0], len(self.terms)))
+        return sp.csr_matrix((data, indices, [0, len(indices)]),
+                             shape=(1, len(self.terms)))
+
+    def add_bucket(self, bucket_name, terms, file_paths=()):
+        """Count terms (an iterable of tokens) of a new bucket, read from
+        input files file_paths.
+        """
+        if bucket_name in self:
+            raise ValueError('Bucket %s is already in the store.'
+                             % bucket_name)
+
+        row = self._count_row(terms)
+        self.counts = sp.vstack([self.counts, row], format='csr')
+        self.bucket_names.append(bucket_name)
+        self.bucket_files[bucket_name] = sorted(file_paths)
+
+    def replace_bucket(self, bucket_name, terms, file_paths=()):
+        """Count terms of a bucket again, read from input files file_paths,
+        replacing its row (or adding it if it is not in the store).
+        """
+        if bucket_name not in self:
+            self.add_bucket(bucket_name, terms, file_paths)
+            return
+
+        i = self.bucket_names.index(bucket_name)
+        row = self._count_row(terms)
+        self.counts = sp.vstack([self.counts[:i], row, self.counts[i+1:]],
+                                format='csr')
+        self.bucket_files[bucket_name] = sorted(file_paths)
+        self._drop_unused_terms()
+
+    def remove_bucket(self, bucket_name):
+        """Remove bucket and the terms no other bucket contains."""
+        i = self.bucket_names.index(bucket_name)
+        self.counts = sp.vstack([self.counts[:i], self.counts[i+1:]],
+                                format='csr')
+        del self.bucket_names[i]
+        self.bucket_files.pop(bucket_name, None)
+        self._drop_unused_terms()
+
+    def _drop_unused_terms(self):
+        """Drop terms with no counts from the vocabulary, keeping the order
+        of the other terms.
+        """
+        used = np.bincount(self.counts.indices,
+                           minlength=len(self.terms)) > 0
+        if used.all():
+            return
+        new_ids = np.cumsum(used) - 1
+        self.counts = sp.csr_matrix(
+            (self.counts.data, new_ids[self.counts.indices],
+             self.counts.indptr), shape=(self.counts.shape[0], used.sum()))
+        self.terms = [t for t, u in zip(self.terms, used) if u]
+        self.term_ids = {t: i for i, t in enumerate(self.terms)}
+
+    def get_tfidf(self, max_df=1.0, min_df=1):
+        """Return (sparse CSR tf-idf matrix of buckets, feature names) as
+        computed by TfidfVectorizer(max_df=max_df, min_df=min_df) on the
+        buckets' tokens. Features are in alphabetical order.
+        """
+        num_buckets = len(self.bucket_names)
+
+        # entries of each row ordered by term id, i.e. by first occurrence
+        # of terms, as in the count matrix of TfidfVectorizer (this keeps
+        # floating point sums of rows in the same order)
+        counts = self.counts.copy()
+        counts.sort_indices()
+
+        # drop terms occurring in too many or too few buckets
+        df = np.bincount(counts.indices, minlength=len(self.terms))
+        max_doc_count = max_df if isinstance(max_df, int) \
+            else max_df * num_buckets
+        min_doc_count = min_df if isinstance(min_df, int) \
+            else min_df * num_buckets
+        keep = (df <= max_doc_count) & (df >= min_doc_count)
+
+        # number kept features in alphabetical order, as in TfidfVectorizer,
+        # without reordering row entries
+        order = np.argsort(np.array(self.terms, dtype=object))
+        order = order[keep[order]]
+        feature_names = [self.terms[i] for i in order]
+        new_ids = np.full(len(self.terms), -1, dtype=np.int64)
+        new_ids[order] = np.arange(len(order))
+        df = df[order]
+
+        entry_mask = keep[counts.indices]
+        entry_rows = np.repeat(np.arange(num_buckets),
+                               np.diff(counts.indptr))[entry_mask]
+        indptr = np.concatenate([[0], np.cumsum(
+            np.bincount(entry_rows, minlength=num_buckets))])
+        X = sp.csr_matrix((counts.data[entry_mask].astype(np.float64),
+                           new_ids[counts.indices[entry_mask]], indptr),
+                          shape=(num_buckets, len(order)))
+
+        # smoothed idf and l2-normalized rows
+        idf = np.log((1 + num_buckets) / (1 + df)) + 1
+        X.data *= idf[X.indices]
+        row_lengths = np.diff(X.indptr)
+        norms = np.zeros(X.shape[0])
+        nonempty = row_lengths > 0
+        norms[nonempty] = np.sqrt(np.add.reduceat(
+            X.data ** 2, X.indptr[:-1][nonempty]))
+        norms[norms == 0] = 1
+        X.data /= np.repeat(norms, row_lengths)
+        return X, feature_names
+
+    def save(self, store_dir_path):
+        """Save store to directory."""
+        if not os.path.isdir(store_dir_path):
+            os.makedirs(store_dir_path)
+        sp.save_npz(os.path.join(store_dir_path, COUNTS_FILE_NAME),
+                    self.counts)
+        with open(os.path.join(store_dir_path, VOCABULARY_FILE_NAME), 'w',
+                  encoding='utf-8') as file_writer:
+            json.dump(self.terms, file_writer, ensure_ascii=False)
+        with open(os.path.join(store_dir_path, BUCKETS_FILE_NAME), 'w',
+                  encoding='utf-8') as file_writer:
+            json.dump(self.bucket_names, file_writer, indent=1)
+        with open(os.path.join(store_dir_path, BUCKET_FILES_FILE_NAME), 'w',
+                  encoding='utf-8') as file_writer:
+            json.dump(self.bucket_files, file_writer, indent=1)
+
+    @classmethod
+    def load(cls, store_dir_path):
+        """Load store from directory, or return an empty store if it does
+        not exist.
+        """
+        store = cls()
+        if not os.path.exists(os.path.join(store_dir_path,
+                                           BUCKETS_FILE_NAME)):
+            return store
+
+        store.counts = sp.load_npz(os.path.join(store_dir_path,
+                                                COUNTS_FILE_NAME)).tocsr()
+        with open(os.path.join(store_dir_path, VOCABULARY_FILE_NAME), 'r',
+                  encoding='utf-8') as file_reader:
+            store.terms = json.load(file_reader)
+        store.term_ids = {t: i for i, t in enumerate(store.terms)}
+        with open(os.path.join(store_dir_path, BUCKETS_FILE_NAME), 'r',
+                  encoding='utf-8') as file_reader:
+            store.bucket_names = json.load(file_reader)
+
+        # stores saved before files were recorded have no bucket files
+        bucket_files_path = os.path.join(store_dir_path,
+                                         BUCKET_FILES_FILE_NAME)
+        if os.path.exists(bucket_files_path):
+            with open(bucket_files_path, 'r',
+                      encoding='utf-8') as file_reader:
+                store.bucket_files = json.load(file_reader)
+        return store
@@ -0,0 +1,133 @@
+"""Index of corpus store rows by tweet created_at, for counts per hour, day
+or week.
+
+The index is the order of rows sorted by created_at, saved next to the
+store's columns (created_at_order.npy) with the fingerprint of the store's
+meta.json it was built for, and rebuilt when the store changed. Periods
+are in UTC; weeks start on Monday.
+"""
+from collections import deque
+from datetime import datetime, timezone
+import json
+import os
+import numpy as np
+from corpus_store import (META_FILE_NAME, TIME_INDEX_FILE_NAME,
+                          TIME_INDEX_META_FILE_NAME)
+from manifest import get_file_fingerprint, get_output_fingerprint, hash_file
+
+PERIODS = ['hour', 'day', 'week']
+
+# length of each period in seconds
+PERIOD_SECONDS = {'hour': 3600, 'day': 86400, 'week': 7 * 86400}
+
+# seconds from the Unix epoch (a Thursday) to the first period start
+PERIOD_OFFSETS = {'hour': 0, 'day': 0, 'week': 4 * 86400}
+
+# strftime format of period labels
+PERIOD_FORMATS = {'hour': '%Y-%m-%d %H:00', 'day': '%Y-%m-%d',
+                  'week': '%Y-%m-%d'}
+
+
+def add_period_arguments(parser):
+    """Add --period and --window arguments to argument parser."""
+    parser.add_argument('--period', type=str, choices=PERIODS,
+                        help='Count tweets of the corpus store per hour, '
+                        'day or week (UTC, weeks starting on Monday) of '
+                        'their created_at, instead of in total. Requires '
+                        '--corpus_store_path.')
+    parser.add_argument('--window', type=int,
+                        help='With --period, write counts over a sliding '
+                        'window of this many periods ending at each period, '
+                        'updated incrementally as periods enter and leave '
+                        'the window.')
+
+
+def check_period_arguments(parser, args):
+    """Exit with a usage error if --period or --window are misused."""
+    if args.period and not args.corpus_store_path:
+        parser.error('--period requires --corpus_store_path')
+    if args.window is not None:
+        if not args.period:
+            parser.error('--window requires --period')
+        if args.window < 1:
+            parser.error('--window must be at least 1')
+
+
+def get_period_start(timestamp, period):
+    """Return Unix timestamp of start of period containing timestamp."""
+    offset = PERIOD_OFFSETS[period]
+    return timestamp - (timestamp - offset) % PERIOD_SECONDS[period]
+
+
+def format_period(period_start, period):
+    """Return label of period starting at Unix timestamp period_start."""
+    return datetime.fromtimestamp(period_start, timezone.utc) \
+        .strftime(PERIOD_FORMATS[period])
+
+
+class TimeIndex:
+    """Rows of a corpus store in created_at order."""
+
+    def __init__(self, corpus_store):
+        self.created_at = corpus_store.columns['created_at']
+        store_dir_path = corpus_store.store_dir_path
+        index_file_path = os.path.join(store_dir_path, TIME_INDEX_FILE_NAME)
+        index_meta_file_path = os.path.join(store_dir_path,
+                                            TIME_INDEX_META_FILE_NAME)
+        meta_file_path = os.path.join(store_dir_path, META_FILE_NAME)
+        store_fingerprint = get_output_fingerprint(
+            get_file_fingerprint(meta_file_path), hash_file(meta_file_path))
+
+        order = None
+        if os.path.exists(index_file_path) and \
+                os.path.exists(index_meta_file_path):
+            with open(index_meta_file_path, 'r') as file_reader:
+                if json.load(file_reader)['store_fingerprint'] == \
+                        store_fingerprint:
+                    order = np.load(index_file_path, mmap_mode='r')
+        if order is None:
+            order = np.argsort(self.created_at, kind='stable')
+            np.save(index_file_path, order)
+            with open(index_meta_file_path, 'w') as file_writer:
+                json.dump({'store_fingerprint': store_fingerprint},
+                          file_writer)
+        self.order = order
+
+    def iter_periods(self, period):
+        """Yield (period start, array of rows) of each period with tweets,
+        in time order. Rows are in store order; tweets without created_at
+        are skipped.
+        """
+        order = np.asarray(self.order)
+        created_at = np.asarray(self.created_at)[order]
+        first = np.searchsorted(created_at, 0)
+        order, created_at = order[first:], created_at[first:]
+
+        period_starts = get_period_start(created_at, period)
+        bounds = np.flatnonzero(np.diff(period_starts)) + 1
+        for rows, start in zip(np.split(order, bounds),
+                               np.split(period_starts, bounds)):
+            if len(rows):
+                yield int(start[0]), np.sort(rows)
+
+
+class SlidingWindow:
+    """Running total over the periods of a sliding window: values of each
+    new period are added to the total, and values of periods leaving the
+    window subtracted from it, with the add and subtract functions.
+    """
+
+    def __init__(self, num_periods, period, add, subtract):
+        self.length = num_periods * PERIOD_SECONDS[period]
+        self.add = add
+        self.subtract = subtract
+        self.periods = deque()
+
+    def push(self, period_start, value):
+        """Add value of period starting at period_start, and remove values
+        of periods no longer in the window ending with it.
+        """
+        self.add(value)
+        self.periods.append((period_start, value))
+        while self.periods[0][0] <= period_start - self.length:
+            self.subtract(self.periods.popleft()[1])
@@ -0,0 +1,93 @@
+"""Persistent SQLite cache of tweet lemma lists.
+
+Entries are keyed by a hash of the normalized tweet text together with the
+spacy model name and version (and spacy version), so a cache is never
+reused across models that could tokenize differently.
+"""
+import hashlib
+import json
+import sqlite3
+from tokenization import normalize_text
+
+# max number of hashes per SELECT (sqlite variable limit is 999 on older
+# builds)
+_LOOKUP_BATCH_SIZE = 500
+
+
+def hash_text(tweet_text):
+    """Return digest of normalized tweet text used as cache key."""
+    return hashlib.sha1(normalize_text(tweet_text).encode('utf-8')).digest()
+
+
+def get_model_key(spacy_model):
+    """Return identifier of spacy model name and versions for cache keys."""
+    import spacy
+    from spacy.util import get_package_version
+
+    model_version = get_package_version(spacy_model) or 'unknown'
+    return '%s-%s/spacy-%s' % (spacy_model, model_version, spacy.__version__)
+
+
+def get_tokenizer_key(spacy_model, tokenizer='spacy', lemma_table_path=None):
+    """Return identifier of the tokenizer lemmas are made with: the key of
+    the spacy model, or for the fast tokenizer, a hash of its lemma table
+    and the spacy version (whose stopwords it uses).
+    """
+    if tokenizer != 'fast':
+        return get_model_key(spacy_model)
+
+    import spacy
+    from manifest import hash_file
+
+    lemma_table_hash = hash_file(lemma_table_path) if lemma_table_path \
+        else 'none'
+    return 'fast-%s/spacy-%s' % (lemma_table_hash, spacy.__version__)
+
+
+class TokenCache:
+    """Lemma lists of tweets stored in a SQLite database file."""
+
+    def __init__(self, db_path, model_key):
+        self.model_key = model_key
+        # wait for other processes writing to the same cache
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tokens ('
+                                'model TEXT NOT NULL, '
+                                'text_hash BLOB NOT NULL, '
+                                'lemmas TEXT NOT NULL, '
+                                'PRIMARY KEY (model, text_hash)) '
+                                'WITHOUT ROWID')
+        self.connection.commit()
+
+    def get_many(self, tweet_texts):
+        """Return list with cached lemma list (or None if missing) for each
+        tweet text.
+        """
+        hashes = [hash_text(t) for t in tweet_texts]
+        found = {}
+        for start in range(0, len(hashes), _LOOKUP_BATCH_SIZE):
+            batch = list(set(hashes[start:start + _LOOKUP_BATCH_SIZE]))
+            query = ('SELECT text_hash, lemmas FROM tokens WHERE model = ? '
+                     'AND text_hash IN (%s)' % ','.join('?' * len(batch)))
+            for text_hash, lemmas in self.connection.execute(
+                    query, [self.model_key] + batch):
+                found[text_hash] = json.loads(lemmas)
+        return [found.get(h) for h in hashes]
+
+    def put_many(self, tweet_texts, tweet_docs):
+        """Store lemma list of each tweet text."""
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)',
+            ((self.model_key, hash_text(t), json.dumps(d, ensure_ascii=False))
+             for t, d in zip(tweet_texts, tweet_docs)))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def open_token_cache(db_path, spacy_model):
+    """Return TokenCache for spacy model, or None if db_path is not set."""
+    if not db_path:
+        return None
+    return TokenCache(db_path, get_model_key(spacy_model))
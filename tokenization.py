@@ -0,0 +1,84 @@
+"""Batched spaCy tokenization of tweets into lemma lists for LDA.
+"""
+from functools import lru_cache
+from itertools import islice
+import spacy
+
+# pipeline components that do not affect lemmas or stopword, punctuation
+# and space flags
+UNUSED_PIPES = ['parser', 'ner']
+
+# number of tweets looked up in the token cache at a time
+CACHE_CHUNK_SIZE = 50000
+
+
+@lru_cache(maxsize=None)
+def load_nlp(spacy_model):
+    """Load spacy model without the components unused for tokenization.
+    The model is only loaded once per process.
+    """
+    return spacy.load(spacy_model, disable=UNUSED_PIPES)
+
+
+def normalize_text(tweet_text):
+    """Return tweet text as passed to the tokenizer."""
+    return tweet_text.lower().strip()
+
+
+def get_lemmas(doc):
+    """Return lemmas of tokens in spacy doc that are not stopwords,
+    punctuation or space characters.
+    """
+    return [token.lemma_ for token in doc
+            if not token.is_stop and
+            not token.is_punct and
+            not token.is_space]
+
+
+def pipe_lemmas(nlp, tweet_texts, batch_size=1000, n_process=1):
+    """Yield lemma list for each tweet text using nlp.pipe, in input
+    order.
+    """
+    texts = (normalize_text(tweet_text) for tweet_text in tweet_texts)
+    for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process):
+        yield get_lemmas(doc)
+
+
+def tokenize_texts(spacy_model, tweet_texts, batch_size=1000, n_process=1,
+                   token_cache=None, fast_tokenizer=None):
+    """Yield lemma list for each tweet text, in input order.
+
+    Texts are processed with nlp.pipe in batches of batch_size over
+    n_process worker processes. If token_cache is given, cached lemma lists
+    are reused and only missing tweets are tokenized (the spacy model is not
+    loaded at all if every tweet is cached). If fast_tokenizer (a
+    fast_tokenizer.FastTokenizer) is given, it is used instead of spacy and
+    the token cache.
+    """
+    if fast_tokenizer is not None:
+        yield from fast_tokenizer.iter_lemmas(tweet_texts)
+        return
+
+    if token_cache is None:
+        yield from pipe_lemmas(load_nlp(spacy_model), tweet_texts,
+                               batch_size, n_process)
+        return
+
+    tweet_texts = iter(tweet_texts)
+    while True:
+        chunk = list(islice(tweet_texts, CACHE_CHUNK_SIZE))
+        if not chunk:
+            return
+
+        tweet_docs = token_cache.get_many(chunk)
+        missing_indices = [i for i, d in enumerate(tweet_docs) if d is None]
+        if missing_indices:
+            missing_texts = [chunk[i] for i in missing_indices]
+            missing_docs = list(pipe_lemmas(load_nlp(spacy_model),
+                                            missing_texts, batch_size,
+                                            n_process))
+            token_cache.put_many(missing_texts, missing_docs)
+            for i, tweet_tokens in zip(missing_indices, missing_docs):
+                tweet_docs[i] = tweet_tokens
+
+        yield from tweet_docs
@@ -0,0 +1,115 @@
+"""Client of the topic inference server (topic_server.py), over HTTP or a
+Unix socket.
+
+Server URLs are http://host:port or unix:/path/to/socket. Only the standard
+library is used, so clients need not load spacy or the LDA model.
+"""
+import http.client
+import json
+import socket
+
+# number of tweets sent per request
+BATCH_SIZE = 1000
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def add_server_arguments(parser):
+    """Add --server_url argument to argument parser."""
+    parser.add_argument('--server_url', type=str,
+                        help='URL of topic inference server '
+                        '(topic_server.py) to score tweets with instead of '
+                        'loading the model and tokenizer: '
+                        'http://host:port or unix:/path/to/socket.')
+
+
+class TopicClient:
+    """Scores tweet texts with the model and tokenizer of a running topic
+    server, over one kept-alive connection.
+    """
+
+    def __init__(self, server_url, timeout=None):
+        self.server_url = server_url
+        self.timeout = timeout
+        self.connection = None
+
+    def _connect(self):
+        if self.server_url.startswith('unix:'):
+            return _UnixHTTPConnection(self.server_url[len('unix:'):],
+                                       self.timeout)
+        if self.server_url.startswith('http://'):
+            return http.client.HTTPConnection(
+                self.server_url[len('http://'):].rstrip('/'),
+                timeout=self.timeout)
+        raise ValueError('Server URL must start with http:// or unix: (%s)'
+                         % self.server_url)
+
+    def _request(self, method, path, body=None):
+        """Return decoded JSON response of request, reconnecting once if
+        the kept-alive connection was closed.
+        """
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'}
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self._connect()
+            try:
+                self.connection.request(method, path, data, headers)
+                response = self.connection.getresponse()
+                payload = json.loads(response.read().decode('utf-8'))
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+
+        if response.status != 200:
+            raise RuntimeError('Topic server error %d: %s'
+                               % (response.status, payload.get('error')))
+        return payload
+
+    def get_info(self):
+        """Return dict with the server's model and tokenizer fingerprint,
+        number of topics, tokenizer settings and request statistics.
+        """
+        return self._request('GET', '/info')
+
+    def get_top_topics(self, tweet_texts, num_top_topics):
+        """Return list of (top topic ids, top topic scores) of each tweet
+        text, in decreasing order of probability.
+        """
+        response = self._request('POST', '/predict',
+                                 {'texts': list(tweet_texts),
+                                  'num_top_topics': num_top_topics})
+        return [tuple(topics) for topics in response['topics']]
+
+    def iter_top_topics(self, tweet_texts, num_top_topics,
+                        batch_size=BATCH_SIZE):
+        """Yield (top topic ids, top topic scores) of each tweet text, sent
+        in batches of batch_size.
+        """
+        batch = []
+        for tweet_text in tweet_texts:
+            batch.append(tweet_text)
+            if len(batch) >= batch_size:
+                yield from self.get_top_topics(batch, num_top_topics)
+                batch = []
+        if batch:
+            yield from self.get_top_topics(batch, num_top_topics)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,139 @@
+"""Batched LDA topic inference into NumPy document-topic matrices.
+"""
+from itertools import islice
+import zlib
+import numpy as np
+from gensim import matutils
+from gensim.models.ldamodel import LdaModel
+from bow_corpus import BowCorpus
+
+# number of documents scored per inference call
+CHUNK_SIZE = 100000
+
+
+def iter_chunks(iterable, chunk_size=CHUNK_SIZE):
+    """Yield lists of up to chunk_size consecutive items of iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_bow_chunks(dictionary, docs, chunk_size=CHUNK_SIZE):
+    """Yield BowCorpus of each chunk of chunk_size consecutive token lists
+    in docs, converted with dictionary's doc2bow.
+    """
+    iterator = iter(docs)
+    while True:
+        chunk = BowCorpus.from_docs(dictionary, islice(iterator, chunk_size))
+        if not len(chunk):
+            return
+        yield chunk
+
+
+def seed_inference(ldamodel, seed):
+    """Reset the random state gensim LdaModel inference draws initial
+    topic weights from, so that scores of the next chunk do not depend on
+    the chunks scored before it.
+    """
+    if isinstance(ldamodel, LdaModel):
+        ldamodel.random_state = np.random.RandomState(seed % (1 << 32))
+
+
+def get_name_seed(name):
+    """Return inference seed of input file (or other unit scored on its
+    own) from its name, so that its scores do not depend on the files
+    scored before it in the same process.
+    """
+    return zlib.crc32(name.encode('utf-8'))
+
+
+def get_topic_matrix(ldamodel, corpus):
+    """Return dense (documents x topics) matrix of topic probabilities of
+    documents in bag-of-words corpus (a list or BowCorpus).
+    """
+    if isinstance(ldamodel, LdaModel):
+        # variational inference over the whole chunk at once
+        gamma, _ = ldamodel.inference(corpus)
+        return gamma / gamma.sum(axis=1)[:, np.newaxis]
+
+    # other models (e.g. LdaMallet) score the whole chunk in one call
+    return matutils.corpus2dense(ldamodel[corpus],
+                                 num_terms=ldamodel.num_topics,
+                                 num_docs=len(corpus)).T
+
+
+def iter_topic_matrices(ldamodel, corpus, chunk_size=CHUNK_SIZE,
+                        dictionary=None, seed=None):
+    """Yield document-topic matrix of each chunk of chunk_size documents in
+    bag-of-words corpus (or in token lists converted into a BowCorpus with
+    dictionary, if given). If seed is given, inference of each chunk is
+    seeded with seed plus the offset of its first document.
+    """
+    if dictionary is not None:
+        chunks = iter_bow_chunks(dictionary, corpus, chunk_size)
+    else:
+        chunks = iter_chunks(corpus, chunk_size)
+    start = 0
+    for chunk in chunks:
+        if seed is not None:
+            seed_inference(ldamodel, seed + start)
+        start += len(chunk)
+        yield get_topic_matrix(ldamodel, chunk)
+
+
+def count_dominant_topics(ldamodel, corpus, chunk_size=CHUNK_SIZE,
+                          weights=None, dictionary=None, seed=None):
+    """Return array with number of documents in corpus (or token lists
+    converted with dictionary, if given) for which each topic is the
+    dominant (most probable) one. If weights are given, each document
+    counts as its weight (e.g. its number of duplicate tweets). Inference
+    is seeded as in iter_topic_matrices.
+    """
+    dominant_topic_dist = np.zeros(ldamodel.num_topics, dtype=np.int64)
+    start = 0
+    for topic_matrix in iter_topic_matrices(ldamodel, corpus, chunk_size,
+                                            dictionary, seed):
+        chunk_weights = None
+        if weights is not None:
+            chunk_weights = weights[start:start + len(topic_matrix)]
+            start += len(topic_matrix)
+        dominant_topic_dist += np.bincount(
+            topic_matrix.argmax(axis=1), weights=chunk_weights,
+            minlength=ldamodel.num_topics).astype(np.int64)
+    return dominant_topic_dist
+
+
+def get_top_topics(topic_matrix, num_top_topics):
+    """Return (topic ids, scores) matrices of the num_top_topics most
+    probable topics of each document, in decreasing order of probability
+    (and increasing topic id among equally probable topics).
+    """
+    num_topics = topic_matrix.shape[1]
+    if num_top_topics < num_topics:
+        top_ids = np.argpartition(-topic_matrix, num_top_topics - 1,
+                                  axis=1)[:, :num_top_topics]
+
+        # rows with topics tied with the num_top_topics-th probability that
+        # were partitioned out take the lowest ids of the tied topics, as a
+        # stable sort of all topics by probability would
+        min_scores = np.take_along_axis(topic_matrix, top_ids, axis=1).min(
+            axis=1, keepdims=True, initial=np.inf)
+        tied_rows = np.flatnonzero(
+            (topic_matrix >= min_scores).sum(axis=1) > num_top_topics)
+        if len(tied_rows):
+            top_ids[tied_rows] = np.argsort(
+                -topic_matrix[tied_rows], axis=1,
+                kind='stable')[:, :num_top_topics]
+        top_ids.sort(axis=1)
+    else:
+        top_ids = np.tile(np.arange(num_topics), (len(topic_matrix), 1))
+    top_scores = np.take_along_axis(topic_matrix, top_ids, axis=1)
+
+    # top topics are in order of id, and sorted stably, so that tied
+    # topics stay in order of id
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return (np.take_along_axis(top_ids, order, axis=1),
+            np.take_along_axis(top_scores, order, axis=1))
@@ -0,0 +1,302 @@
+"""Resident topic inference server that keeps the LDA model, dictionary and
+tokenizer loaded, and returns the top topics of tweets sent to it.
+
+Requests are served over HTTP on a local port or on a Unix socket:
+
+    GET /info      fingerprint of model and tokenizer, number of topics,
+                   tokenizer settings and request statistics
+    POST /predict  {"texts": [...], "num_top_topics": k} ->
+                   {"topics": [[[topic ids], [scores]], ...]}
+
+Texts of concurrent requests are micro-batched: a single inference thread
+takes requests from a queue until max_batch_size texts are waiting or
+max_wait_ms passed, and tokenizes and scores them together.
+
+predict_lda_topics.py and get_dominant_lda_topic_distribution.py use the
+server instead of loading the model with --server_url (see topic_client.py).
+"""
+from argparse import ArgumentParser
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import pickle
+import queue
+import socketserver
+import threading
+import time
+from gensim import corpora
+from gensim.models.ldamodel import LdaModel
+from tokenization import tokenize_texts, load_nlp
+from fast_tokenizer import load_fast_tokenizer
+from topic_inference import get_topic_matrix, get_top_topics
+from bow_corpus import BowCorpus
+from lda_backends import BACKENDS
+from manifest import get_file_fingerprint, get_output_fingerprint
+
+
+def parse_arguments():
+    parser = ArgumentParser('Serve top topics of tweets from a resident LDA '
+                            'model over HTTP or a Unix socket.')
+    parser.add_argument('--model_path', '-m', type=str, required=True,
+                        help='Path to trained LDA model: a pickle (.pkl, as '
+                        'written by train_lda_topics.py) or a model saved '
+                        'with gensim.')
+    parser.add_argument('--backend', type=str, choices=BACKENDS,
+                        default='mallet',
+                        help='LDA backend the model was trained with by '
+                        'train_lda_topics.py: mallet or multicore. Defaults '
+                        'to mallet.')
+    parser.add_argument('--lda_mallet_prefix', type=str,
+                        help='Prefix for LDA Mallet model (required with the '
+                        'mallet backend).')
+    parser.add_argument('--dictionary_path', type=str,
+                        help='Path to dictionary saved by train_lda_topics.py '
+                        '(lda_dictionary.dict). Defaults to the dictionary '
+                        'stored in the LDA model.')
+    parser.add_argument('--spacy_model', '-s', type=str,
+                        default='en_core_web_sm',
+                        help='Name of spacy model to use.')
+    parser.add_argument('--tokenizer', type=str, choices=['spacy', 'fast'],
+                        default='spacy',
+                        help='Tokenizer for lemmas: spacy (model given by '
+                        '--spacy_model) or fast (rule-based, with the lemma '
+                        'table given by --lemma_table_path). Defaults to '
+                        'spacy.')
+    parser.add_argument('--lemma_table_path', type=str,
+                        help='Path to JSON lemma lookup table of the fast '
+                        'tokenizer (written by compare_tokenizers.py).')
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='Number of tweets per spacy batch. Defaults to '
+                        '1000.')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Host to listen on. Defaults to 127.0.0.1.')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='Port to listen on. Defaults to 8765.')
+    parser.add_argument('--socket_path', type=str,
+                        help='Path to Unix socket to listen on instead of '
+                        'a port.')
+    parser.add_argument('--max_batch_size', type=int, default=1000,
+                        help='Max number of tweets scored together. Defaults '
+                        'to 1000.')
+    parser.add_argument('--max_wait_ms', type=float, default=10,
+                        help='Max milliseconds a request waits for others to '
+                        'be batched with. Defaults to 10.')
+    return parser.parse_args()
+
+
+def load_lda_model(model_path, backend='mallet', lda_mallet_prefix=None):
+    """Return LDA model pickled by train_lda_topics.py (.pkl) or saved
+    with gensim.
+    """
+    if not model_path.endswith('.pkl'):
+        return LdaModel.load(model_path)
+    with open(model_path, 'rb') as pickle_reader:
+        ldamodel = pickle.load(pickle_reader)
+    if backend == 'mallet':
+        ldamodel.prefix = lda_mallet_prefix
+    return ldamodel
+
+
+class TopicScorer:
+    """Scores micro-batches of tweet texts with a resident model, in one
+    inference thread.
+    """
+
+    def __init__(self, ldamodel, dictionary, args):
+        self.ldamodel = ldamodel
+        self.dictionary = dictionary
+        self.args = args
+        self.fast_tokenizer = load_fast_tokenizer(args.lemma_table_path) \
+            if args.tokenizer == 'fast' else None
+        if self.fast_tokenizer is None:
+            # load spacy before serving the first request
+            load_nlp(args.spacy_model)
+
+        self.requests = queue.Queue()
+        self.stats = {'requests': 0, 'batches': 0, 'texts': 0,
+                      'seconds': 0.0}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, tweet_texts, num_top_topics):
+        """Return Future of list of (top topic ids, top topic scores) of
+        each tweet text.
+        """
+        future = Future()
+        self.requests.put((tweet_texts, num_top_topics, future))
+        return future
+
+    def get_batch(self):
+        """Return list of waiting requests, waiting for the first one, and
+        then up to max_wait_ms for others until max_batch_size texts.
+        """
+        batch = [self.requests.get()]
+        num_texts = len(batch[0][0])
+        deadline = time.perf_counter() + self.args.max_wait_ms / 1000
+        while num_texts < self.args.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            num_texts += len(request[0])
+        return batch
+
+    def score(self, tweet_texts):
+        """Return document-topic matrix of tweet texts."""
+        tweet_docs = tokenize_texts(self.args.spacy_model, tweet_texts,
+                                    batch_size=self.args.batch_size,
+                                    fast_tokenizer=self.fast_tokenizer)
+        return get_topic_matrix(self.ldamodel,
+                                BowCorpus.from_docs(self.dictionary,
+                                                    tweet_docs))
+
+    def run(self):
+        """Score batches of waiting requests, until the process exits."""
+        while True:
+            batch = self.get_batch()
+            start_time = time.perf_counter()
+            tweet_texts = [t for texts, _, _ in batch for t in texts]
+            try:
+                topic_matrix = self.score(tweet_texts)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            # split the batch's matrix into the requests' rows
+            start = 0
+            for texts, num_top_topics, future in batch:
+                try:
+                    top_ids, top_scores = get_top_topics(
+                        topic_matrix[start:start + len(texts)],
+                        num_top_topics)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result([list(topics) for topics in zip(
+                        top_ids.tolist(), top_scores.tolist())])
+                start += len(texts)
+
+            self.stats['requests'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['texts'] += len(tweet_texts)
+            self.stats['seconds'] += time.perf_counter() - start_time
+
+
+class TopicRequestHandler(BaseHTTPRequestHandler):
+    """Handles /info and /predict requests with the server's scorer."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/info':
+            self.send_json(404, {'error': 'Unknown path: %s' % self.path})
+            return
+        self.send_json(200, dict(self.server.info,
+                                 stats=self.server.scorer.stats))
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_json(404, {'error': 'Unknown path: %s' % self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            tweet_texts = request['texts']
+            num_top_topics = request.get('num_top_topics', 3)
+
+            # invalid texts would fail the whole batch they are scored in
+            if not isinstance(tweet_texts, list) or \
+                    not all(isinstance(t, str) for t in tweet_texts):
+                raise ValueError('texts must be a list of strings')
+            if not isinstance(num_top_topics, int) or \
+                    isinstance(num_top_topics, bool) or num_top_topics < 0:
+                raise ValueError('num_top_topics must be a non-negative '
+                                 'integer')
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': 'Bad request: %s' % e})
+            return
+
+        try:
+            topics = self.server.scorer.submit(tweet_texts,
+                                               num_top_topics).result()
+        except Exception as e:
+            self.send_json(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+        self.send_json(200, {'topics': topics})
+
+    def log_message(self, format, *args):
+        # requests are not logged (Unix socket clients have no address)
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    """Threading HTTP server on a Unix socket."""
+
+    daemon_threads = True
+
+
+def get_model_info(args, ldamodel):
+    """Return dict describing the server's model and tokenizer, with a
+    fingerprint of both for clients' manifests.
+    """
+    return {
+        'fingerprint': get_output_fingerprint(
+            get_file_fingerprint(args.model_path),
+            get_file_fingerprint(args.dictionary_path), args.backend,
+            args.spacy_model, args.tokenizer,
+            get_file_fingerprint(args.lemma_table_path)),
+        'num_topics': ldamodel.num_topics,
+        'spacy_model': args.spacy_model,
+        'tokenizer': args.tokenizer,
+    }
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    print('Loading model: %s' % args.model_path)
+    ldamodel = load_lda_model(args.model_path, args.backend,
+                              args.lda_mallet_prefix)
+
+    # load id <-> term dictionary used to train the model
+    if args.dictionary_path:
+        dictionary = corpora.Dictionary.load(args.dictionary_path)
+    else:
+        dictionary = ldamodel.id2word
+
+    if args.socket_path:
+        if os.path.exists(args.socket_path):
+            os.remove(args.socket_path)
+        server = UnixHTTPServer(args.socket_path, TopicRequestHandler)
+        address = 'unix:' + args.socket_path
+    else:
+        server = ThreadingHTTPServer((args.host, args.port),
+                                     TopicRequestHandler)
+        address = 'http://%s:%d' % (args.host, args.port)
+    server.scorer = TopicScorer(ldamodel, dictionary, args)
+    server.info = get_model_info(args, ldamodel)
+
+    print('Serving topics at %s' % address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket_path and os.path.exists(args.socket_path):
+            os.remove(args.socket_path)
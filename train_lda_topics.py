@@ -1,13 +1,20 @@
 """Train LDA for all tweets in JSON format in input directory.
 """
-import json
 import os
-import spacy
 import pickle
-import gensim
 from gensim import corpora
-from gensim.models import CoherenceModel
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from tweet_reader import iter_tweet_texts, is_tweet_file
+from tokenization import tokenize_texts
+from fast_tokenizer import load_fast_tokenizer
+from token_cache import open_token_cache
+from coherence import CoherenceStatistics, get_topic_word_ids
+from corpus_store import CorpusStore
+from bow_corpus import (BowCorpus, add_vocabulary_arguments,
+                        filter_vocabulary, format_memory_report)
+from lda_backends import BACKENDS, train_lda_model
+from metrics import add_metrics_arguments, open_metrics
 
 
 def parse_arguments():
@@ -15,10 +22,25 @@ def parse_arguments():
                             'directory.')
     parser.add_argument('--input_dir_path', '-i', type=str,
                         help='Path to input directory containing JSON files '
-                        'with tweets.')
+                        'with tweets. '
+                        'Files may be line-delimited (.jsonl, .ndjson) and '
+                        'compressed (.gz, .bz2, .zst).')
     parser.add_argument('--mallet_path', '-m', type=str,
                         help='Path to mallet directory (download from '
                         'http://mallet.cs.umass.edu/dist/mallet-2.0.8.zip).')
+    parser.add_argument('--backend', type=str, choices=BACKENDS,
+                        default='mallet',
+                        help='LDA backend: mallet (Java, needs --mallet_path '
+                        'and gensim < 4.0) or multicore (gensim LdaMulticore, '
+                        'in process). Defaults to mallet.')
+    parser.add_argument('--passes', type=int, default=1,
+                        help='Number of passes over the corpus of the '
+                        'multicore backend. Defaults to 1.')
+    parser.add_argument('--iterations', type=int, default=50,
+                        help='Max number of inference iterations per '
+                        'document of the multicore backend. Defaults to 50.')
+    parser.add_argument('--random_state', type=int,
+                        help='Random seed of the multicore backend.')
     parser.add_argument('--min_topics', type=int,
                         help='Min number of topics to train LDA model.')
     parser.add_argument('--max_topics', type=int,
@@ -33,90 +55,198 @@ def parse_arguments():
                         default='en_core_web_sm',
                         help='Name of spacy model to use.'
                         )
+    parser.add_argument('--batch_size', type=int, default=1000,
+                        help='Number of tweets per spacy batch. Defaults to '
+                        '1000.')
+    parser.add_argument('--n_process', type=int, default=1,
+                        help='Number of processes for spacy tokenization. '
+                        'Defaults to 1.')
+    parser.add_argument('--token_cache_path', type=str,
+                        help='Path to SQLite token cache file. Tweets found '
+                        'in the cache are not tokenized again.')
+    parser.add_argument('--tokenizer', type=str, choices=['spacy', 'fast'],
+                        default='spacy',
+                        help='Tokenizer for lemmas: spacy (model given by '
+                        '--spacy_model) or fast (rule-based, with spacy '
+                        'stopwords and the lemma table given by '
+                        '--lemma_table_path; the token cache is not used). '
+                        'Use the same tokenizer for training and '
+                        'prediction. Defaults to spacy.')
+    parser.add_argument('--lemma_table_path', type=str,
+                        help='Path to JSON lemma lookup table of the fast '
+                        'tokenizer (written by compare_tokenizers.py).')
+    parser.add_argument('--max_jobs', type=int, default=1,
+                        help='Max number of LDA models trained at the same '
+                        'time. Defaults to 1.')
+    parser.add_argument('--threads_per_job', type=int, default=4,
+                        help='Number of Mallet threads (or LdaMulticore '
+                        'worker processes) per LDA model. Defaults to 4.')
+    parser.add_argument('--corpus_store_path', type=str,
+                        help='Path to corpus store written by '
+                        'export_tweets_json_to_csv.py. Lemmas are read from '
+                        'the store instead of tokenizing the input '
+                        'directory; the store must be exported with the same '
+                        '--tokenizer and --spacy_model (or '
+                        '--lemma_table_path).')
+    add_vocabulary_arguments(parser)
+    add_metrics_arguments(parser)
     return parser.parse_args()
 
 
-if __name__ == '__main__':
-    args = parse_arguments()
-
-    # get input arguments from command line
-    input_path = args.input_dir_path
-    if not os.path.isdir(input_path):
-        print('Input path must be a directory.')
-    output_path = args.output_dir_path
-    if not os.path.isdir(output_path):
-        os.makedirs(output_path)
-
-    # load spacy nlp module
-    nlp = spacy.load(args.spacy_model)
-
-    tweet_docs = []
-    # iterate over each subdir in input_subdir_paths
+def iter_input_texts(input_path, metrics=None):
+    """Yield text of each tweet in JSON files in input directory (recording
+    per-file statistics in metrics, if given).
+    """
     for input_file_name in os.listdir(input_path):
 
-        # only read JSON files
-        if not input_file_name.endswith('.json'):
+        # only read (possibly compressed) JSON and JSONL files
+        if not is_tweet_file(input_file_name):
             continue
 
         print('Processing file: %s' % input_file_name)
 
         input_file_path = os.path.join(input_path, input_file_name)
 
-        # load data from json file
-        with open(input_file_path, 'r') as file_reader:
-            data = json.load(file_reader)
+        # stream tweets from json file
+        tweet_texts = iter_tweet_texts(input_file_path)
+        if metrics is not None:
+            tweet_texts = metrics.iter_file(input_file_path, tweet_texts)
+        for tweet_text in tweet_texts:
+            yield tweet_text
 
-        # iterate over each tweet in json, and form ngram frequency dictionary
-        for tweet in data['results']:
-            if 'extended_tweet' in tweet:
-                tweet_text = tweet['extended_tweet']['full_text']
-            else:
-                tweet_text = tweet['text']
 
-            doc = nlp(tweet_text.lower().strip())
+# training data shared with sweep workers (set by init_sweep_worker)
+_sweep_data = {}
 
-            tweet_tokens = [token.lemma_ for token in doc
-                            if not token.is_stop and
-                            not token.is_punct and
-                            not token.is_space]
 
-            tweet_docs.append(tweet_tokens)
+def init_sweep_worker(args, corpus, dictionary, output_path):
+    """Store training data for train_sweep_point in this process."""
+    _sweep_data.update(args=args, corpus=corpus, dictionary=dictionary,
+                       output_path=output_path)
 
-    # turn our tokenized documents into a id <-> term dictionary
-    dictionary = corpora.Dictionary(tweet_docs)
 
-    # convert tokenized documents into a document-term matrix
-    corpus = [dictionary.doc2bow(doc) for doc in tweet_docs]
+def train_sweep_point(num_topics):
+    """Train LDA model with num_topics topics and pickle it to the output
+    directory. Returns (num_topics, topics, top word ids of each topic for
+    coherence).
+    """
+    args = _sweep_data['args']
+    output_path = _sweep_data['output_path']
 
-    # generate LDA model
-    # ldamodel = gensim.models.ldamodel.LdaModel(corpus, num_topics=20,
-    # id2word=dictionary, passes=20)
-    mallet_path = args.mallet_path
+    print('Running LDA with %2d topics' % num_topics)
 
-    ldamodel_list = []
-    output_file_path = os.path.join(output_path, 'lda_hyperparam_output.txt')
-    with open(output_file_path, 'w') as file_writer:
+    ldamodel = train_lda_model(
+        args.backend, _sweep_data['corpus'], _sweep_data['dictionary'],
+        num_topics, args.threads_per_job, mallet_path=args.mallet_path,
+        prefix=os.path.join(output_path, 'lda_model_n' + str(num_topics)),
+        passes=args.passes, iterations=args.iterations,
+        random_state=args.random_state)
 
-        for num_topics in range(args.min_topics, args.max_topics+1,
-                                args.topic_num_interval):
+    with open(os.path.join(output_path,
+                           'lda_model_n%02d.pkl' % num_topics), 'wb') \
+            as pickle_writer:
+        pickle.dump(ldamodel, pickle_writer)
 
-            print('Running LDA with %2d topics' % num_topics)
+    topics = ldamodel.print_topics(num_topics=num_topics, num_words=20)
 
-            ldamodel = gensim.models.wrappers.LdaMallet(mallet_path,
-                                                        corpus=corpus,
-                                                        num_topics=num_topics,
-                                                        id2word=dictionary,
-                                                        prefix=os.path.join(output_path, 'lda_model_n' + str(num_topics)))
+    print('Finished LDA with %2d topics' % num_topics)
 
-            # ldamodel.save(os.path.join(output_path,
-            #                            'lda_model_n%02d' % num_topics))
+    return num_topics, topics, get_topic_word_ids(ldamodel)
 
-            with open(os.path.join(output_path,
-                                   'lda_model_n%02d.pkl' % num_topics), 'wb') \
-                    as pickle_writer:
-                pickle.dump(ldamodel, pickle_writer)
 
-            topics = ldamodel.print_topics(num_topics=num_topics, num_words=20)
+if __name__ == '__main__':
+    args = parse_arguments()
+    metrics = open_metrics(args)
+
+    # get input arguments from command line
+    input_path = args.input_dir_path
+    if not args.corpus_store_path and not os.path.isdir(input_path):
+        print('Input path must be a directory.')
+    output_path = args.output_dir_path
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+
+    with metrics.stage('tokenization'):
+        if args.corpus_store_path:
+            # lemmas of all tweets from the memory-mapped corpus store,
+            # made by the requested tokenizer
+            corpus_store = CorpusStore(args.corpus_store_path)
+            corpus_store.check_model_key(args.spacy_model, args.tokenizer,
+                                         args.lemma_table_path)
+            tweet_docs = corpus_store.iter_lemmas()
+        else:
+            # open token cache (if any); spacy model is loaded only for
+            # tweets missing from the cache
+            token_cache = open_token_cache(args.token_cache_path,
+                                           args.spacy_model)
+
+            # tokenize tweets from all files in batches
+            tweet_docs = tokenize_texts(
+                args.spacy_model,
+                metrics.iter_counted(iter_input_texts(input_path, metrics),
+                                     'tweets_read'),
+                batch_size=args.batch_size, n_process=args.n_process,
+                token_cache=token_cache,
+                fast_tokenizer=load_fast_tokenizer(args.lemma_table_path)
+                if args.tokenizer == 'fast' else None)
+        tweet_docs = list(metrics.iter_counted(tweet_docs, 'documents',
+                                               'tokens_kept'))
+
+    # turn our tokenized documents into a id <-> term dictionary, pruned of
+    # rare and common terms (if enabled), and save it for inference with
+    # the trained models
+    with metrics.stage('dictionary'):
+        dictionary = corpora.Dictionary(tweet_docs)
+        metrics.count('terms_dropped', filter_vocabulary(dictionary, args))
+        dictionary.save(os.path.join(output_path, 'lda_dictionary.dict'))
+
+    # convert tokenized documents into a document-term matrix held in
+    # int32 arrays (also for sweep workers)
+    with metrics.stage('doc2bow'):
+        corpus = BowCorpus.from_docs(dictionary, tweet_docs)
+    metrics.count('corpus_bytes', corpus.nbytes)
+    metrics.count('corpus_list_bytes_estimate', corpus.get_list_nbytes())
+    print('\n'.join(format_memory_report(corpus)))
+
+    topic_nums = list(range(args.min_topics, args.max_topics+1,
+                            args.topic_num_interval))
+    worker_args = (args, corpus, dictionary, output_path)
+
+    # train models for all sweep points, at most max_jobs at a time; results
+    # are returned in sweep order
+    if args.max_jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=args.max_jobs,
+                                       initializer=init_sweep_worker,
+                                       initargs=worker_args)
+        sweep_results = executor.map(train_sweep_point, topic_nums)
+    else:
+        executor = None
+        init_sweep_worker(*worker_args)
+        sweep_results = map(train_sweep_point, topic_nums)
+
+    with metrics.stage('lda_training'):
+        sweep_results = list(sweep_results)
+    if executor is not None:
+        executor.shutdown()
+    metrics.count('models_trained', len(sweep_results))
+
+    # Compute Coherence Scores from co-occurrence statistics of the top
+    # words of all models, collected in a single pass over the tweets
+    print('Computing coherence statistics')
+    with metrics.stage('coherence'):
+        coherence_stats = CoherenceStatistics(
+            tweet_docs, dictionary,
+            [w for _, _, topic_word_ids in sweep_results
+             for topic in topic_word_ids for w in topic])
+
+    coherence_list = []
+    output_file_path = os.path.join(output_path, 'lda_hyperparam_output.txt')
+    with open(output_file_path, 'w') as file_writer:
+
+        for num_topics, topics, topic_word_ids in sweep_results:
+            with metrics.stage('coherence'):
+                coherence_lda = coherence_stats.get_coherence(topic_word_ids)
+
             file_writer.write('=================='
                               '\nLDA with %2d topics\n'
                               '==================\n'
@@ -124,12 +254,14 @@ if __name__ == '__main__':
             for t in topics:
                 file_writer.write(str(t)+'\n')
 
-            # Compute Coherence Score
-            coherence_model_lda = CoherenceModel(model=ldamodel,
-                                                 texts=tweet_docs,
-                                                 dictionary=dictionary,
-                                                 coherence='c_v')
-            coherence_lda = coherence_model_lda.get_coherence()
             file_writer.write('\nCoherence Score: %.2f\n' % coherence_lda)
 
-            ldamodel_list.append((ldamodel, coherence_lda))
+            coherence_list.append((num_topics, coherence_lda))
+
+    # print sweep points ranked by coherence
+    print('Coherence ranking:')
+    for rank, (num_topics, coherence_lda) in enumerate(
+            sorted(coherence_list, key=lambda k: k[1], reverse=True)):
+        print('%2d. %2d topics: %.4f' % (rank+1, num_topics, coherence_lda))
+
+    metrics.close()
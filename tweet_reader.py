@@ -0,0 +1,286 @@
+"""Streaming reader for tweets in JSON files of the form {"results": [...]},
+or in line-delimited JSON files (.jsonl or .ndjson) with one tweet per line.
+
+Tweets are decoded one at a time from the "results" array, so memory use
+does not grow with the size of the input file. Files compressed with gzip
+(.gz), bz2 (.bz2) or zstd (.zst, with the zstandard package) are
+decompressed while reading. Decompression and parsing run in a background
+thread, a few batches of tweets ahead of the caller.
+"""
+import bz2
+from datetime import datetime
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+
+# number of characters read from the input file at a time
+CHUNK_SIZE = 1 << 20
+
+# extensions of tweet files: JSON with a "results" array, or line-delimited
+JSON_EXTENSIONS = ['.json']
+JSONL_EXTENSIONS = ['.jsonl', '.ndjson']
+
+# extensions of compressed files
+COMPRESSION_EXTENSIONS = ['.gz', '.bz2', '.zst']
+
+# number of tweets per batch passed from the background reader thread, and
+# max number of batches read ahead
+PREFETCH_BATCH_SIZE = 256
+PREFETCH_BATCHES = 16
+
+_WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+class _JSONStream:
+    """Minimal pull parser over a text file, decoding one JSON value at a
+    time with json.JSONDecoder.raw_decode.
+    """
+
+    def __init__(self, file_reader, chunk_size=CHUNK_SIZE):
+        self.file_reader = file_reader
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read the next chunk into the buffer, dropping consumed text.
+        Returns False at end of file.
+        """
+        if self.eof:
+            return False
+        chunk = self.file_reader.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character ('' at end of file)."""
+        while True:
+            while self.pos < len(self.buffer) and \
+                    self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expected %r but found %r in JSON input.'
+                             % (char, found))
+        self.pos += 1
+
+    def decode(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # value is cut off at the end of the buffer
+                if not self.fill():
+                    raise
+                continue
+            # a number at the very end of the buffer may continue in the
+            # next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def split_compression(file_path):
+    """Return (file path without compression extension, compression
+    extension or '').
+    """
+    root, extension = os.path.splitext(file_path)
+    if extension in COMPRESSION_EXTENSIONS:
+        return root, extension
+    return file_path, ''
+
+
+def is_tweet_file(file_path):
+    """Return whether file name has the extension of a (possibly
+    compressed) JSON or line-delimited JSON file.
+    """
+    extension = os.path.splitext(split_compression(file_path)[0])[1]
+    return extension in JSON_EXTENSIONS + JSONL_EXTENSIONS
+
+
+def is_jsonl_file(file_path):
+    """Return whether file is line-delimited JSON, by its extension."""
+    extension = os.path.splitext(split_compression(file_path)[0])[1]
+    return extension in JSONL_EXTENSIONS
+
+
+def open_text(file_path):
+    """Open (possibly compressed) file for reading as utf-8 text."""
+    compression = split_compression(file_path)[1]
+    if compression == '.gz':
+        return gzip.open(file_path, 'rt', encoding='utf-8')
+    if compression == '.bz2':
+        return bz2.open(file_path, 'rt', encoding='utf-8')
+    if compression == '.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('Reading %s requires the zstandard package.'
+                              % file_path)
+        # files written by concatenating frames (e.g. zstd of appended
+        # chunks) are read to the end, not only their first frame
+        file_reader = open(file_path, 'rb')
+        return io.TextIOWrapper(
+            zstandard.ZstdDecompressor().stream_reader(
+                file_reader, read_across_frames=True, closefd=True),
+            encoding='utf-8')
+    return open(file_path, 'r', encoding='utf-8')
+
+
+def iter_in_background(values, batch_size=PREFETCH_BATCH_SIZE,
+                       max_batches=PREFETCH_BATCHES):
+    """Yield values of iterable, produced in batches by a background thread
+    while the caller works on earlier ones. Exceptions of the iterable are
+    raised in the caller; the thread stops when the caller stops iterating.
+    """
+    batches = queue.Queue(max_batches)
+    stopped = threading.Event()
+    end = object()
+
+    def put(batch):
+        while not stopped.is_set():
+            try:
+                batches.put(batch, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            batch = []
+            for value in values:
+                batch.append(value)
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if put(batch):
+                put(end)
+        except BaseException as e:
+            put(e)
+        finally:
+            if hasattr(values, 'close'):
+                values.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is end:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            yield from batch
+    finally:
+        stopped.set()
+
+
+def _iter_jsonl_tweets(file_reader):
+    """Yield the tweet on each non-empty line of file."""
+    for line in file_reader:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _iter_file_tweets(file_path):
+    """Yield each tweet (as a dict) in file, read in this thread."""
+    with open_text(file_path) as file_reader:
+        if is_jsonl_file(file_path):
+            yield from _iter_jsonl_tweets(file_reader)
+            return
+
+        stream = _JSONStream(file_reader)
+        stream.expect('{')
+        if stream.peek() == '}':
+            raise KeyError('results')
+
+        while True:
+            key = stream.decode()
+            stream.expect(':')
+
+            if key == 'results':
+                stream.expect('[')
+                if stream.peek() == ']':
+                    return
+                while True:
+                    yield stream.decode()
+                    if stream.peek() != ',':
+                        stream.expect(']')
+                        return
+                    stream.pos += 1
+
+            # skip values of other top-level keys
+            stream.decode()
+            if stream.peek() != ',':
+                stream.expect('}')
+                raise KeyError('results')
+            stream.pos += 1
+
+
+def iter_tweets(file_path):
+    """Yield each tweet (as a dict) in the "results" array of a JSON file,
+    or on each line of a line-delimited JSON file.
+    """
+    return iter_in_background(_iter_file_tweets(file_path))
+
+
+def get_tweet_text(tweet):
+    """Return full text of tweet, preferring the extended tweet if present."""
+    if 'extended_tweet' in tweet:
+        return tweet['extended_tweet']['full_text']
+    return tweet['text']
+
+
+def iter_tweet_texts(file_path):
+    """Yield the text of each tweet in a JSON file."""
+    return iter_in_background(get_tweet_text(tweet) for tweet in
+                              _iter_file_tweets(file_path))
+
+
+def iter_tweet_records(file_path):
+    """Yield (tweet_id, created_at, tweet_text) for each tweet in a JSON
+    file.
+    """
+    return iter_in_background(
+        (tweet.get('id_str', tweet.get('id')), tweet.get('created_at'),
+         get_tweet_text(tweet)) for tweet in _iter_file_tweets(file_path))
+
+
+def parse_created_at(created_at):
+    """Return Unix timestamp (seconds) of tweet created_at string such as
+    'Wed Dec 18 10:15:00 +0000 2019'.
+    """
+    return int(datetime.strptime(created_at,
+                                 '%a %b %d %H:%M:%S %z %Y').timestamp())
+
+
+def list_json_files(input_path):
+    """Return paths of (possibly compressed) JSON and line-delimited JSON
+    files in input directory, or the input path itself if it is one.
+    """
+    if os.path.isdir(input_path):
+        return [os.path.join(input_path, f) for f in os.listdir(input_path)
+                if is_tweet_file(f)]
+    if is_tweet_file(input_path):
+        return [input_path]
+    return []